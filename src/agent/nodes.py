@@ -84,12 +84,16 @@ def collect_results(state: AgentState) -> dict:
     for msg in reversed(state["messages"]):
         if hasattr(msg, "type") and msg.type == "tool":
             # Extract RAG sources from structured JSON output
-            if msg.name == "query_rag":
+            if msg.name in ("query_rag", "query_rag_products", "query_rag_batch"):
                 try:
                     parsed = json.loads(msg.content)
-                    collected.append(f"[{msg.name}] {parsed['answer']}")
+                    if parsed.get("answers"):
+                        # query_rag_batch: one collected result per question
+                        collected.extend(f"[{msg.name}] Q: {item['question']}\nA: {item['answer']}" for item in parsed["answers"])
+                    else:
+                        collected.append(f"[{msg.name}] {parsed['answer']}")
                     for src in parsed.get("used_sources", []):
-                        rag_sources.append({"source": Path(str(src)).name, "tool": "query_rag"})
+                        rag_sources.append({"source": Path(str(src)).name, "tool": msg.name})
                 except (json.JSONDecodeError, KeyError):
                     collected.append(f"[{msg.name}] {msg.content}")
             else:
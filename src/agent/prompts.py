@@ -3,8 +3,16 @@
 ###########################################################################
 
 import json
+import sqlite3
 from pathlib import Path
 
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from models import AGE_REFERENCE_DATE
+from sql_pool import get_pool
+
 
 ###########################################################################
 ##                           CONSTANTS
@@ -12,6 +20,27 @@ from pathlib import Path
 
 GOLDEN_BUCKET_PATH = Path(__file__).resolve().parent.parent.parent / "golden_bucket" / "golden_bucket.json"
 
+# Columns and tables added by migrations.py, advertised only once they exist in sales.db
+DERIVED_COLUMN_DOCS = {
+    "transactions": {
+        "line_total_usd": "FLOAT,      -- line_total converted to USD with fx_rates",
+        "invoice_total_usd": "FLOAT,   -- invoice_total converted to USD with fx_rates",
+        "sale_day": "VARCHAR,          -- 'YYYY-MM-DD' (= SUBSTR(date, 1, 10))",
+        "sale_month": "VARCHAR,        -- 'YYYY-MM' (= SUBSTR(date, 1, 7))",
+        "sale_week": "VARCHAR,         -- 'YYYY-Www', weeks start on Monday (W00 = days before the first Monday)",
+        "hour": "INTEGER,              -- 0-23, hour of the sale",
+    },
+    "customers": {
+        "age": f"INTEGER,               -- age in years on {AGE_REFERENCE_DATE}",
+        "age_band": "VARCHAR,          -- '18-24', '25-34', '35-44', '45-54', '55-64', '65+'",
+    },
+    "fx_rates": {
+        "currency": "VARCHAR,          -- 'USD', 'CNY', 'EUR', 'GBP' (joins transactions.currency)",
+        "usd_rate": "FLOAT,            -- USD per one unit of the currency",
+        "source": "VARCHAR,            -- where the rate comes from",
+    },
+}
+
 
 ###########################################################################
 ##                        PROMPT TEMPLATES
@@ -28,8 +57,12 @@ Based on the user's question, the data collected so far, and any reflection feed
 
 TOOL SELECTION RULES:
 - Use query_sql for: sales numbers, revenue, quantities, rankings, customer data, store data — anything numeric/analytical
+- When you need several independent SQL queries in this step (e.g. revenue by country, by category and by month), send them together in ONE query_sql_batch call instead of separate query_sql calls
+- When a query_sql result ends with `handle=r_...`, page through it with fetch_sql_page or get column counts/min/max/sum/avg with summarize_sql_result instead of re-running the query with OFFSET
+- When the question names products ("the silk retro coat", "Vestido Clásico"), call resolve_products with the names first and use the returned product IDs in SQL (WHERE product_id IN (...)) or query_rag_products, instead of matching descriptions with LIKE
 - Use query_rag for: product materials, care instructions, style notes, sustainability info, size guides — anything about product knowledge/specs
-- If the question needs BOTH (e.g. "top selling product and what it's made of"), call SQL first for the data query, then query_rag with the product name/description for product knowledge
+- When you have several product-knowledge questions in this step (different products by name, or different aspects of one product), send them together in ONE query_rag_batch call instead of separate query_rag calls
+- If the question needs BOTH (e.g. "top selling product and what it's made of"), call SQL first for the data query, then ONE query_rag_products call with all the product IDs it returned (optionally section='materials', 'care', 'size', 'sustainability' or 'style') instead of one query_rag call per product
 
 IMPORTANT: Call the tools directly. Do NOT just describe what to do — actually invoke query_sql or query_rag with concrete arguments.
 """
@@ -51,8 +84,8 @@ If iteration equals max_iterations, you MUST set satisfied=true (we have to stop
 If the data is clearly sufficient for a good answer, set satisfied=true even before max iterations.
 If more depth would genuinely improve the answer, set satisfied=false and provide specific feedback on what queries to run next.
 
-CRITICAL: Look at the collected data prefixes — [query_sql] means SQL was used, [query_rag] means RAG was used.
-If the question mentions product knowledge (materials, style card, care, sustainability, sizing) and NO [query_rag] results exist in the collected data, you MUST set satisfied=false and explicitly instruct: "Use query_rag to search for product knowledge about [product name]."
+CRITICAL: Look at the collected data prefixes — [query_sql] means SQL was used, [query_rag], [query_rag_batch] or [query_rag_products] means RAG was used.
+If the question mentions product knowledge (materials, style card, care, sustainability, sizing) and NO RAG results exist in the collected data, you MUST set satisfied=false and explicitly instruct: "Use query_rag to search for product knowledge about [product name]."
 """
 
 SYNTHESIZE_PROMPT = """You are producing the final answer. Combine ALL collected data into a clear, comprehensive response.
@@ -97,9 +130,47 @@ def load_golden_bucket() -> str:
     return "\n".join(lines)
 
 
+def load_derived_columns() -> dict[str, list[str]]:
+    """Columns from DERIVED_COLUMN_DOCS that exist in sales.db, per table."""
+    present = {}
+    try:
+        with get_pool().connection() as conn:
+            for table, docs in DERIVED_COLUMN_DOCS.items():
+                columns = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+                present[table] = [column for column in docs if column in columns]
+    except sqlite3.Error:
+        return {}
+    return {table: columns for table, columns in present.items() if columns}
+
+
+def format_derived_columns(present: dict[str, list[str]]) -> str:
+    if not present:
+        return ""
+    lines = ["", "## Indexed Derived Columns", "", "Prefer these over string functions on date / date_of_birth and over per-currency amounts, they are indexed:", "", "```sql"]
+    for table, columns in present.items():
+        lines.append(f"-- {table}")
+        lines += [f"{column} {DERIVED_COLUMN_DOCS[table][column]}" for column in columns]
+    lines.append("```")
+    return "\n".join(lines) + "\n"
+
+
 def build_system_prompt() -> str:
     """Build the full system prompt with schema, rules, and golden bucket examples."""
     golden_bucket_text = load_golden_bucket()
+    derived_columns = load_derived_columns()
+    derived_columns_text = format_derived_columns(derived_columns)
+    if "sale_month" in derived_columns.get("transactions", []):
+        date_rule = ("Dates are stored as 'YYYY-MM-DD HH:MM:SS'. For time series use the indexed columns: "
+                     "GROUP BY t.sale_month / t.sale_week / t.sale_day / t.hour, and filter ranges on them "
+                     "(e.g. t.sale_day BETWEEN '2024-03-01' AND '2024-03-31') instead of SUBSTR(date, ...).")
+    else:
+        date_rule = ("Dates are stored as 'YYYY-MM-DD HH:MM:SS'. Use SUBSTR(date, 1, 10) for date-only comparisons, "
+                     "SUBSTR(date, 1, 7) for monthly grouping.")
+    if "line_total_usd" in derived_columns.get("transactions", []):
+        currency_rule = ("line_total is in the store's local currency. When comparing or summing revenue across countries "
+                         "use SUM(t.line_total_usd) (already converted to USD), and say the figures are in USD.")
+    else:
+        currency_rule = "When comparing countries, remember that currencies differ. Note this in your analysis when relevant."
 
     return f"""You are a senior data analyst assistant for a global fashion retail brand.
 The company operates 35 stores across 7 countries (United States, China, Germany, United Kingdom, France, Spain, Portugal), selling Feminine, Masculine, and Children's clothing.
@@ -189,7 +260,7 @@ CREATE TABLE transactions (
     invoice_total FLOAT        -- total for the entire invoice
 );
 ```
-
+{derived_columns_text}
 ## Database Stats
 - 200 products, 35 stores (5 per country), ~61K customers, 264 employees, 34 discount campaigns, ~67K transaction lines
 - Date range: 2024-01-01 to 2024-12-31
@@ -198,22 +269,25 @@ CREATE TABLE transactions (
 ## Rules
 
 1. Use **query_sql** for numeric/analytical questions (revenue, top products, country/category/customer/store performance).
-2. Use **query_rag** for product-knowledge questions (materials, care, sizing, sustainability, style notes). Whenever we use the query_rag tool, prefer to search by names, strings, and not by IDs, since similarity search is more reliable with meaningful texts or quotes.
-3. For hybrid questions, call both tools and combine results clearly.
+2. Use **query_rag** for product-knowledge questions (materials, care, sizing, sustainability, style notes). query_rag combines keyword and semantic search: describe products by name, and add the product ID or an exact "quoted" term (material, certification) when you have one, those are matched literally.
+3. For hybrid questions, call both tools and combine results clearly. Once SQL has returned product IDs, use **query_rag_products** with the whole ID list to get product knowledge for all of them in one call.
 4. Never guess or fabricate data.
 5. Write efficient SQL with JOINs when needed. Use aggregations (SUM, AVG, COUNT, GROUP BY) for analytical questions.
 6. **Return rich context, not just one number.** When asked "what is the top/best/most", return TOP 5-10 results so you can give a nuanced answer with comparisons and context. Single-row answers are almost never sufficient.
 7. **Multi-step exploration is encouraged.** If you need to understand the data first before answering, run exploratory queries. For example, first check what categories exist, then query sales for those categories.
 8. Use `line_total` for revenue calculations (it already includes discounts).
 9. Filter by `transaction_type = 'Sale'` for sales analysis. Include returns only when specifically asked about returns or return rates.
-10. Dates are stored as 'YYYY-MM-DD HH:MM:SS'. Use SUBSTR(date, 1, 10) for date-only comparisons, SUBSTR(date, 1, 7) for monthly grouping.
+10. {date_rule}
 11. EXTREMELY IMPORTANT: When presenting multi-row results (rankings, comparisons, lists with attributes), you MUST use <tabledata> tags with a JSON array inside. Example:
 <tabledata>[{{"Country": "Germany", "Revenue": 125000}}, {{"Country": "France", "Revenue": 98000}}]</tabledata>
 NEVER use markdown tables (pipes/dashes), numbered lists, or bullet points for tabular data. The UI ONLY renders <tabledata> blocks as formatted tables. Always use <tabledata> when there are 2+ items with shared attributes.
 12. If a query fails, explain the error and try a corrected query.
 13. For general conversation not related to data, respond directly without using tools.
-14. When comparing countries, remember that currencies differ. Note this in your analysis when relevant.
+14. {currency_rule}
 15. Gender values: F = Female, M = Male, D = Diverse.
+16. query_sql returns tab-separated rows. Lines starting with `# all rows:` list columns that have the same value in every row (they are omitted from the table), and `# column: ~1=..., ~2=...` is a legend for short codes used in that column. Always expand codes back to their full values in your answer.
+17. A query_sql result over 200 rows ends with `handle=r_...`: call fetch_sql_page(handle, offset) for further rows or summarize_sql_result(handle) for per-column statistics, both read the stored result without re-running the query.
+18. Product names in the question (any language, misspellings included) are resolved to product IDs with resolve_products. A score of 1 is an exact name match; when several products score close, say which one you picked or list them.
 
 ## Golden Bucket: Example Query Patterns
 
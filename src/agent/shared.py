@@ -10,8 +10,8 @@ from langchain.chat_models import init_chat_model
 ##                        CUSTOM IMPORTS
 ###########################################################################
 
-from tools_sql import query_sql
-from tools_rag import query_rag
+from tools_sql import fetch_sql_page, query_sql, query_sql_batch, resolve_products, summarize_sql_result
+from tools_rag import query_rag, query_rag_batch, query_rag_products
 from agent.prompts import build_system_prompt
 
 
@@ -21,7 +21,7 @@ from agent.prompts import build_system_prompt
 
 DB_DIR = Path(__file__).resolve().parent.parent.parent / "db"
 APP_DB = DB_DIR / "application.db"
-TOOLS = [query_sql, query_rag]
+TOOLS = [query_sql, query_sql_batch, fetch_sql_page, summarize_sql_result, resolve_products, query_rag, query_rag_batch, query_rag_products]
 SYSTEM_PROMPT = build_system_prompt()
 
 
@@ -0,0 +1,164 @@
+"""Semantic answer cache for query_rag: paraphrased questions over the same chunks reuse the synthesized answer.
+
+The structured-output synthesis is by far the slowest part of query_rag.
+Each answer is stored with its question embedding and the set of chunks it
+was synthesized from (rowid + text hash). A new question gets the stored
+answer when it retrieved exactly the same chunk set and its embedding is
+within ANSWER_CACHE_MIN_COSINE of the stored question's, e.g. "what is the
+wool sweater made of" and "material of wool sweater". Since chunk texts are
+part of the key, chunks changed by a new ingestion never match; ingest.py
+also deletes those entries (prune). Lives in the rag_cache.db sidecar next to
+the query embeddings.
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from embedding_cache import EMBEDDING_CACHE_FILE
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+ANSWER_CACHE_MIN_COSINE = 0.95      # question embeddings at least this similar share an answer (same chunks required)
+ANSWER_CACHE_MAX_CANDIDATES = 256   # stored answers compared per lookup (newest first)
+
+
+###########################################################################
+##                            CACHE
+###########################################################################
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def chunk_set(documents: list[Document]) -> list[tuple[int, str]]:
+    """(rowid, text hash) of each retrieved chunk, sorted: the identity of what an answer was synthesized from."""
+    return sorted({(int(doc.id), _text_hash(doc.page_content)) for doc in documents})
+
+
+def chunk_key(chunks: list[tuple[int, str]]) -> str:
+    return hashlib.sha1(json.dumps(chunks).encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    """Stored RAG answers looked up by (model, chunk set) and then by question embedding cosine."""
+
+    def __init__(self, model: str, cache_file: Path | str = EMBEDDING_CACHE_FILE, min_cosine: float = ANSWER_CACHE_MIN_COSINE):
+        self.model = model
+        self.cache_file = Path(cache_file)
+        self.min_cosine = min_cosine
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._stats = {"lookups": 0, "hits": 0, "stored": 0, "saved_seconds": 0.0}
+
+    def _db(self) -> sqlite3.Connection:
+        """Sidecar connection, opened on first use. Caller holds the lock."""
+        if self._conn is None:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.cache_file), check_same_thread=False, timeout=5.0)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS rag_answers (
+                    id INTEGER PRIMARY KEY, model TEXT NOT NULL, chunk_key TEXT NOT NULL, chunks TEXT NOT NULL,
+                    question TEXT NOT NULL, embedding BLOB NOT NULL, response TEXT NOT NULL,
+                    synthesis_seconds REAL NOT NULL, created REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS rag_answers_key ON rag_answers (model, chunk_key)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _unit(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: list[float], documents: list[Document]) -> dict | None:
+        """The stored response for the most similar question over the same chunks, None below the threshold."""
+        query = self._unit(embedding)
+        key = chunk_key(chunk_set(documents))
+        with self._lock:
+            self._stats["lookups"] += 1
+            rows = self._db().execute(
+                "SELECT id, embedding, response, synthesis_seconds FROM rag_answers WHERE model = ? AND chunk_key = ? ORDER BY id DESC LIMIT ?",
+                (self.model, key, ANSWER_CACHE_MAX_CANDIDATES),
+            ).fetchall()
+            # Entries from an embedding model with another dimension cannot be compared
+            rows = [row for row in rows if len(row[1]) == query.nbytes]
+            if not rows:
+                return None
+            similarities = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) @ query
+            best = int(similarities.argmax())
+            if similarities[best] < self.min_cosine:
+                return None
+            entry_id, _, response, synthesis_seconds = rows[best]
+            self._conn.execute("UPDATE rag_answers SET hits = hits + 1 WHERE id = ?", (entry_id,))
+            self._conn.commit()
+            self._stats["hits"] += 1
+            self._stats["saved_seconds"] += synthesis_seconds
+            return json.loads(response)
+
+    def store(self, question: str, embedding: list[float], documents: list[Document], response: dict, synthesis_seconds: float) -> None:
+        chunks = chunk_set(documents)
+        with self._lock:
+            self._db().execute(
+                "INSERT INTO rag_answers (model, chunk_key, chunks, question, embedding, response, synthesis_seconds, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.model, chunk_key(chunks), json.dumps(chunks), question, self._unit(embedding).tobytes(),
+                 json.dumps(response), synthesis_seconds, time.time()),
+            )
+            self._conn.commit()
+            self._stats["stored"] += 1
+
+    def prune(self, rag_conn: sqlite3.Connection, table: str) -> int:
+        """Delete answers whose chunks no longer exist in `table` or have different text now. Returns the answers deleted."""
+        with self._lock:
+            conn = self._db()
+            entries = [(entry_id, json.loads(chunks)) for entry_id, chunks in conn.execute("SELECT id, chunks FROM rag_answers")]
+            rowids = sorted({rowid for _, chunks in entries for rowid, _ in chunks})
+            current: dict[int, str] = {}
+            for start in range(0, len(rowids), 500):
+                batch = rowids[start:start + 500]
+                current.update((rowid, _text_hash(text)) for rowid, text in rag_conn.execute(
+                    f"SELECT rowid, text FROM {table} WHERE rowid IN ({', '.join('?' * len(batch))})", batch))
+            stale = [(entry_id,) for entry_id, chunks in entries if any(current.get(rowid) != text_hash for rowid, text_hash in chunks)]
+            conn.executemany("DELETE FROM rag_answers WHERE id = ?", stale)
+            conn.commit()
+            return len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stored = self._db().execute("SELECT COUNT(*) FROM rag_answers WHERE model = ?", (self.model,)).fetchone()[0]
+            lookups = self._stats["lookups"]
+            return {
+                "model": self.model,
+                "entries": stored,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                **self._stats,
+                "saved_seconds": round(self._stats["saved_seconds"], 2),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
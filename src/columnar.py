@@ -0,0 +1,821 @@
+"""Optional in-memory columnar engine for aggregate queries over transactions.
+
+transactions and its dimension tables are exported once to NumPy arrays under
+db/columnar/ (one .npy per column, strings dictionary-encoded against a sorted
+dictionary) and memory-mapped on first use. Aggregate shapes parsed by
+sql_shapes.parse_aggregate() are answered with vectorized filters and
+group-bys; everything else, and any query while the export is stale, falls
+back to SQLite.
+
+Build / refresh after every data load:  uv run python src/columnar.py --build
+Benchmark against plain SQLite:         uv run python src/columnar.py --bench
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import argparse
+import json
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from rich.console import Console
+from rich.table import Table
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from sql_cache import db_signature
+from sql_pool import DB_PATH, get_pool
+from sql_shapes import AggregateQuery, Node, Unsupported, has_aggregate, parse_aggregate
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+COLUMNAR_ENGINE = False                  # answer aggregate queries from the columnar export (opt-in)
+COLUMNAR_DIR = DB_PATH.parent / "columnar"
+FACT_TABLE = "transactions"
+TABLE_KEYS = {                           # table -> primary key the fact table (or another dimension) joins on
+    "transactions": "id",
+    "products": "product_id",
+    "stores": "store_id",
+    "customers": "customer_id",
+    "employees": "employee_id",
+}
+SUBSTR_CACHE_ENTRIES = 32               # re-encoded dictionaries kept for SUBSTR(date, 1, 7) and friends
+BENCH_RUNS = 5
+GOLDEN_BUCKET_PATH = Path(__file__).resolve().parent.parent / "golden_bucket" / "golden_bucket.json"
+
+console = Console()
+_substr_cache: dict[tuple, tuple] = {}
+_substr_lock = threading.Lock()          # engines evaluate from ToolNode's parallel threads
+
+
+###########################################################################
+##                            EXPORT
+###########################################################################
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> list[tuple[str, str]]:
+    """(name, declared type) of ordinary and generated columns (hidden 0 / 2 / 3)."""
+    return [(row[1], row[2]) for row in conn.execute(f"PRAGMA table_xinfo({table})") if row[6] != 1]
+
+
+def _fingerprint(conn: sqlite3.Connection) -> dict[str, list]:
+    """(rows, max key, column count) per exported table: enough to notice loads, deletes and migrations,
+    plus the line_total / quantity totals of the fact table for in-place UPDATEs of its measures."""
+    fingerprint = {
+        table: [*conn.execute(f"SELECT COUNT(*), COALESCE(MAX({TABLE_KEYS[table]}), 0) FROM {table}").fetchone(), len(_table_columns(conn, table))]
+        for table in TABLE_KEYS
+    }
+    fingerprint[FACT_TABLE] += conn.execute(f"SELECT TOTAL(line_total), TOTAL(quantity) FROM {FACT_TABLE}").fetchone()
+    return fingerprint
+
+
+def _code_dtype(cardinality: int) -> np.dtype:
+    for dtype in (np.int8, np.int16, np.int32):
+        if cardinality < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def build_columnar(db_path: Path = DB_PATH, out_dir: Path = COLUMNAR_DIR) -> list[tuple[str, int, int, float]]:
+    """Export every table in TABLE_KEYS column by column. Returns (table, rows, bytes, seconds)."""
+    staging = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    conn = sqlite3.connect(str(db_path))
+    manifest = {"fingerprint": _fingerprint(conn), "tables": {}}
+    report = []
+    try:
+        for table in TABLE_KEYS:
+            started, size = time.perf_counter(), 0
+            columns = {}
+            for column, declared in _table_columns(conn, table):
+                series = pd.read_sql_query(f"SELECT {column} FROM {table} ORDER BY {TABLE_KEYS[table]}", conn)[column]
+                if series.dtype == object or "CHAR" in declared.upper() or "TEXT" in declared.upper():
+                    codes, uniques = pd.factorize(series, sort=True, use_na_sentinel=True)
+                    dictionary = np.asarray(uniques, dtype=str)
+                    np.save(staging / f"{table}.{column}.dict.npy", dictionary)
+                    values = codes.astype(_code_dtype(len(dictionary)))
+                    columns[column] = "dict"
+                    size += dictionary.nbytes
+                elif pd.api.types.is_integer_dtype(series.dtype):
+                    values, columns[column] = series.to_numpy(np.int64), "int"
+                else:
+                    # REAL columns, and INTEGER columns holding NULLs (NaN)
+                    values, columns[column] = series.to_numpy(np.float64), "float"
+                np.save(staging / f"{table}.{column}.npy", values)
+                size += values.nbytes
+            manifest["tables"][table] = {"rows": int(len(series)), "columns": columns}
+            report.append((table, int(len(series)), size, time.perf_counter() - started))
+    finally:
+        conn.close()
+
+    (staging / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    shutil.rmtree(out_dir, ignore_errors=True)
+    staging.rename(out_dir)
+    return report
+
+
+###########################################################################
+##                          VALUE VECTORS
+###########################################################################
+
+
+class DictVector:
+    """A string column as codes into a sorted dictionary (code -1 is NULL)."""
+
+    def __init__(self, codes: np.ndarray, dictionary: np.ndarray):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    def take(self, index: np.ndarray) -> "DictVector":
+        return DictVector(self.codes[index], self.dictionary)
+
+    def decode(self) -> np.ndarray:
+        values = np.empty(len(self.codes), dtype=object)
+        present = self.codes >= 0
+        values[present] = self.dictionary[self.codes[present]]
+        values[~present] = None
+        return values
+
+    def code(self, literal: str, side: str = "left") -> int:
+        return int(np.searchsorted(self.dictionary, literal, side=side))
+
+    def compare(self, op: str, literal: str) -> np.ndarray:
+        """Comparison against a string literal, evaluated once per dictionary entry via the sort order."""
+        present = self.codes >= 0
+        if op in ("=", "!="):
+            i = self.code(literal)
+            found = i < len(self.dictionary) and self.dictionary[i] == literal
+            match = (self.codes == i) if found else np.zeros(len(self.codes), dtype=bool)
+            return match if op == "=" else present & ~match
+        bounds = {"<": (None, self.code(literal)), "<=": (None, self.code(literal, "right")),
+                  ">": (self.code(literal, "right"), None), ">=": (self.code(literal), None)}[op]
+        low, high = bounds
+        return (self.codes >= low) if high is None else (present & (self.codes < high))
+
+    def substr(self, start: int, stop: int | None) -> "DictVector":
+        """SUBSTR applied to the dictionary only, then re-encoded (e.g. dates to months)."""
+        key = (id(self.dictionary), start, stop)
+        with _substr_lock:
+            entry = _substr_cache.get(key)
+        if entry is None:
+            mapped = [value[start:stop] for value in self.dictionary.tolist()]
+            codes, uniques = pd.factorize(pd.Series(mapped, dtype=object), sort=True)
+            lookup = np.append(codes, -1).astype(np.int64)   # code -1 (NULL) stays -1
+            # Holding the source dictionary keeps its id() from being reused while cached
+            entry = (self.dictionary, lookup, np.asarray(uniques, dtype=str))
+            with _substr_lock:
+                if key not in _substr_cache and len(_substr_cache) >= SUBSTR_CACHE_ENTRIES:
+                    _substr_cache.pop(next(iter(_substr_cache)))
+                _substr_cache[key] = entry
+        _, lookup, dictionary = entry
+        return DictVector(lookup[self.codes], dictionary)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+def _is_text(value) -> bool:
+    return isinstance(value, (DictVector, str)) or (isinstance(value, np.ndarray) and value.dtype == object)
+
+
+def _dense(value) -> np.ndarray:
+    return value.decode() if isinstance(value, DictVector) else value
+
+
+def _sql_round(value, digits: int = 0):
+    """ROUND() with SQLite's half-away-from-zero rule; always REAL."""
+    scale = 10.0 ** digits
+    return np.sign(value) * np.floor(np.abs(np.asarray(value, dtype=np.float64)) * scale + 0.5) / scale
+
+
+def _like_regex(pattern: str) -> re.Pattern:
+    parts = [".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern]
+    return re.compile("".join(parts), re.IGNORECASE | re.DOTALL)
+
+
+###########################################################################
+##                             ENGINE
+###########################################################################
+
+
+class ColumnarEngine:
+    """Vectorized evaluator for AggregateQuery trees over the memory-mapped export."""
+
+    def __init__(self, db_path: Path = DB_PATH, data_dir: Path = COLUMNAR_DIR):
+        self.db_path = Path(db_path)
+        self.data_dir = Path(data_dir)
+        self._manifest: dict | None = None
+        self._arrays: dict[tuple[str, str], object] = {}
+        self._key_lookup: dict[str, np.ndarray] = {}
+        self._fresh_for = None
+        self._lock = threading.Lock()
+        self._stats = {"answered": 0, "unsupported": 0, "stale": 0, "seconds": 0.0}
+
+    ######################### Storage ####################################
+    def is_fresh(self) -> bool:
+        """True if the export matches sales.db (re-checked only when the db files change)."""
+        signature = db_signature(self.db_path)
+        with self._lock:
+            if signature == self._fresh_for:
+                return True
+            # Something changed: drop the mapped arrays and re-read the (possibly rebuilt) export
+            self._manifest, self._arrays, self._key_lookup = None, {}, {}
+            path = self.data_dir / "manifest.json"
+            if not path.exists():
+                return False
+            manifest = self._manifest = json.loads(path.read_text(encoding="utf-8"))
+            conn = sqlite3.connect(f"file:{self.db_path.as_posix()}?mode=ro", uri=True)
+            try:
+                fresh = _fingerprint(conn) == manifest["fingerprint"]
+            finally:
+                conn.close()
+            if fresh:
+                self._fresh_for = signature
+            return fresh
+
+    def column(self, table: str, column: str):
+        key = (table, column)
+        if key not in self._arrays:
+            kind = self._manifest["tables"][table]["columns"][column]
+            values = np.load(self.data_dir / f"{table}.{column}.npy", mmap_mode="r")
+            if kind == "dict":
+                dictionary = np.load(self.data_dir / f"{table}.{column}.dict.npy", mmap_mode="r")
+                values = DictVector(values, dictionary)
+            self._arrays[key] = values
+        return self._arrays[key]
+
+    def key_lookup(self, table: str) -> np.ndarray:
+        """Dense primary key -> row position array (-1 where no row has that key)."""
+        if table not in self._key_lookup:
+            keys = np.asarray(self.column(table, TABLE_KEYS[table]))
+            lookup = np.full(int(keys.max()) + 2 if len(keys) else 1, -1, dtype=np.int64)
+            lookup[keys] = np.arange(len(keys))
+            self._key_lookup[table] = lookup
+        return self._key_lookup[table]
+
+    ######################### Entry point ################################
+    def execute(self, sql: str) -> tuple[list[str], list[tuple]] | None:
+        """(columns, all result rows) for a supported aggregate query, or None to fall back to SQLite."""
+        query = parse_aggregate(sql)
+        if query is None:
+            self._stats["unsupported"] += 1
+            return None
+        if not self.is_fresh():
+            self._stats["stale"] += 1
+            return None
+        started = time.perf_counter()
+        try:
+            result = _Evaluation(self, query).run()
+        except (Unsupported, KeyError, TypeError, ValueError, ZeroDivisionError, FloatingPointError):
+            self._stats["unsupported"] += 1
+            return None
+        self._stats["answered"] += 1
+        self._stats["seconds"] += time.perf_counter() - started
+        return result
+
+    def stats(self) -> dict:
+        return {"loaded_columns": len(self._arrays), **self._stats}
+
+
+class _Evaluation:
+    """One query run: join resolution, WHERE mask, grouping, aggregation, ordering."""
+
+    def __init__(self, engine: ColumnarEngine, query: AggregateQuery):
+        self.engine = engine
+        self.query = query
+        tables = engine._manifest["tables"]
+        if query.table != FACT_TABLE:
+            raise Unsupported("the columnar engine only serves queries over transactions")
+        self.tables = {query.alias: query.table}
+        for join in query.joins:
+            if join.table not in tables or join.alias in self.tables:
+                raise Unsupported(f"join on {join.table}")
+            self.tables[join.alias] = join.table
+        self.columns = {alias: tables[table]["columns"] for alias, table in self.tables.items()}
+        self.positions: dict[str, np.ndarray | None] = {query.alias: None}   # fact row -> table row
+        self.rows: np.ndarray | None = None                                   # selected fact rows
+        self.join_parents: dict[str, tuple[str, str]] = {}                   # joined alias -> (alias, column) it is looked up by
+
+    ######################### Name resolution ###########################
+    def resolve(self, node: Node) -> tuple[str, str]:
+        qualifier, name = node.value
+        if qualifier is not None:
+            if qualifier not in self.tables or name not in self.columns[qualifier]:
+                raise Unsupported(f"unknown column {qualifier}.{name}")
+            return qualifier, name
+        owners = [alias for alias, columns in self.columns.items() if name in columns]
+        if len(owners) != 1:
+            raise Unsupported(f"ambiguous or unknown column {name}")
+        return owners[0], name
+
+    def canonical(self, node: Node) -> Node:
+        """The node with every column reference fully qualified, for structural comparison."""
+        if node.kind == "col":
+            return Node("col", self.resolve(node))
+        return node._replace(args=tuple(self.canonical(arg) for arg in node.args))
+
+    ######################### Joins ######################################
+    def join(self) -> None:
+        for join in self.query.joins:
+            on = join.on
+            if on.kind != "op" or on.value != "=" or on.args[0].kind != "col" or on.args[1].kind != "col":
+                raise Unsupported("join condition must be a single key equality")
+            left, right = self.resolve(on.args[0]), self.resolve(on.args[1])
+            if right[0] == join.alias:
+                left, right = right, left
+            if left != (join.alias, TABLE_KEYS[join.table]) or right[0] not in self.positions:
+                raise Unsupported("join must match the joined table's primary key against an earlier table")
+            keys = np.asarray(_dense(self.row_column(*right)))
+            lookup = self.engine.key_lookup(join.table)
+            inside = (keys >= 0) & (keys < len(lookup))
+            positions = np.full(len(keys), -1, dtype=np.int64)
+            positions[inside] = lookup[keys[inside]]
+            self.positions[join.alias] = positions
+            self.join_parents[join.alias] = right
+            if (positions < 0).any():
+                self.restrict(positions >= 0)
+
+    def restrict(self, mask: np.ndarray) -> None:
+        selected = np.flatnonzero(mask)
+        self.rows = selected if self.rows is None else self.rows[selected]
+        for alias, positions in self.positions.items():
+            if positions is not None:
+                self.positions[alias] = positions[selected]
+
+    def row_column(self, alias: str, name: str):
+        values = self.engine.column(self.tables[alias], name)
+        index = self.positions[alias] if alias != self.query.alias else self.rows
+        if index is None:
+            return values
+        return values.take(index) if isinstance(values, DictVector) else np.asarray(values)[index]
+
+    def row_count(self) -> int:
+        if self.rows is not None:
+            return len(self.rows)
+        return self.engine._manifest["tables"][FACT_TABLE]["rows"]
+
+    ######################### Row expressions ############################
+    def evaluate(self, node: Node, group=None):
+        """Evaluate an expression per row (group=None) or per group (group=_Groups)."""
+        kind = node.kind
+        if kind in ("num", "str"):
+            return node.value
+        if kind == "null":
+            return None
+        if kind == "col":
+            if group is not None:
+                return group.column(self.resolve(node))
+            return self.row_column(*self.resolve(node))
+        if kind == "agg":
+            if group is None:
+                raise Unsupported("aggregate outside a grouped context")
+            return group.aggregate(node)
+        if kind == "output":
+            if group is None:
+                raise Unsupported("result column reference outside ORDER BY")
+            return group.output(node.value)
+        if group is not None and not has_aggregate(node) and group.is_key(node):
+            return group.key_value(node)
+
+        args = [self.evaluate(arg, group) for arg in node.args]
+        if kind == "neg":
+            return -args[0]
+        if kind == "op":
+            return self.operator(node.value, args[0], args[1])
+        if kind == "in":
+            masks = [self.operator("=", args[0], item) for item in args[1:]]
+            match = np.logical_or.reduce([np.broadcast_to(m, (self._length(args[0]),)) for m in masks])
+            if node.value:
+                return self._present(args[0]) & ~match
+            return match
+        if kind == "between":
+            inside = self.operator(">=", args[0], args[1]) & self.operator("<=", args[0], args[2])
+            return (self._present(args[0]) & ~inside) if node.value else inside
+        if kind == "like":
+            if not isinstance(args[1], str):
+                raise Unsupported("LIKE with a non-literal pattern")
+            regex = _like_regex(args[1])
+            if isinstance(args[0], DictVector):
+                per_entry = np.array([bool(regex.fullmatch(value)) for value in args[0].dictionary] + [False])
+                match = per_entry[args[0].codes]
+            else:
+                match = np.array([value is not None and bool(regex.fullmatch(str(value))) for value in args[0]])
+            return (self._present(args[0]) & ~match) if node.value else match
+        if kind == "isnull":
+            missing = ~self._present(args[0])
+            return ~missing if node.value else missing
+        if kind == "case":
+            return self.case(args)
+        if kind == "func":
+            return self.function(node.value, args)
+        raise Unsupported(f"expression {kind}")
+
+    def _length(self, value) -> int:
+        if isinstance(value, (DictVector, np.ndarray)):
+            return len(value)
+        return self.row_count()
+
+    def _present(self, value) -> np.ndarray:
+        if isinstance(value, DictVector):
+            return value.codes >= 0
+        if isinstance(value, np.ndarray):
+            if value.dtype == object:
+                return np.array([v is not None for v in value], dtype=bool)
+            if value.dtype.kind == "f":
+                return ~np.isnan(value)
+            return np.ones(len(value), dtype=bool)
+        return np.full(self.row_count(), value is not None)
+
+    def operator(self, op: str, left, right):
+        if op in ("and", "or"):
+            return (left & right) if op == "and" else (left | right)
+        if left is None or right is None:
+            raise Unsupported("NULL literal in an expression")
+        if op in ("=", "!=", "<", "<=", ">", ">="):
+            if _is_text(left) != _is_text(right):
+                raise Unsupported("comparison between text and numbers")
+            if isinstance(left, DictVector) and isinstance(right, str):
+                return left.compare(op, right)
+            if isinstance(right, DictVector) and isinstance(left, str):
+                flipped = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}.get(op, op)
+                return right.compare(flipped, left)
+            left, right = _dense(left), _dense(right)
+            if _is_text(left) or _is_text(right):
+                raise Unsupported("comparison between two text expressions")
+            with np.errstate(invalid="ignore"):
+                result = {"=": np.equal, "!=": np.not_equal, "<": np.less, "<=": np.less_equal,
+                          ">": np.greater, ">=": np.greater_equal}[op](left, right)
+            # NaN != v is True in NumPy, a NULL never satisfies a comparison in SQLite
+            for operand in (left, right):
+                if isinstance(operand, np.ndarray):
+                    result = result & self._present(operand)
+            return result
+        if _is_text(left) or _is_text(right):
+            raise Unsupported(f"operator {op} on text")
+        if op == "+":
+            return np.add(left, right)
+        if op == "-":
+            return np.subtract(left, right)
+        if op == "*":
+            return np.multiply(left, right)
+        if op == "/":
+            return self.divide(left, right)
+        raise Unsupported(f"operator {op}")
+
+    @staticmethod
+    def divide(left, right):
+        """SQLite division: NULL on zero divisors, truncating integer division when both sides are integers."""
+        left_arr, right_arr = np.asarray(left), np.asarray(right)
+        if (right_arr == 0).any():
+            raise Unsupported("division by zero (NULL in SQLite)")
+        if left_arr.dtype.kind in "iu" and right_arr.dtype.kind in "iu":
+            quotient = np.trunc(left_arr / right_arr).astype(np.int64)
+        else:
+            quotient = left_arr.astype(np.float64) / right_arr
+        return quotient if quotient.ndim else quotient.item()
+
+    def case(self, args: list):
+        conditions, values, otherwise = args[0:-1:2], args[1:-1:2], args[-1]
+        if any(_is_text(v) for v in (*values, otherwise)):
+            length = max(self._length(c) for c in conditions)
+            result = np.full(length, otherwise, dtype=object) if not isinstance(otherwise, (DictVector, np.ndarray)) else _dense(otherwise).astype(object)
+            for condition, value in reversed(list(zip(conditions, values))):
+                result = np.where(condition, _dense(value), result)
+            return result
+        if otherwise is None:
+            raise Unsupported("CASE without ELSE on numbers")
+        result = otherwise
+        for condition, value in reversed(list(zip(conditions, values))):
+            result = np.where(condition, value, result)
+        return result
+
+    def function(self, name: str, args: list):
+        if name == "round":
+            digits = args[1] if len(args) > 1 else 0
+            if not isinstance(digits, int) or _is_text(args[0]):
+                raise Unsupported("ROUND() arguments")
+            rounded = _sql_round(args[0], digits)
+            return rounded if np.ndim(rounded) else float(rounded)
+        if name == "abs":
+            if _is_text(args[0]):
+                raise Unsupported("ABS() on text")
+            return np.abs(args[0])
+        if name == "substr":
+            if not isinstance(args[0], DictVector) or not all(isinstance(a, int) for a in args[1:]) or args[1] < 1:
+                raise Unsupported("SUBSTR() is served on text columns with literal positive offsets")
+            start = args[1] - 1
+            stop = start + args[2] if len(args) > 2 else None
+            return args[0].substr(start, stop)
+        raise Unsupported(f"function {name}")
+
+    ######################### Query ######################################
+    def run(self) -> tuple[list[str], list[tuple]]:
+        query = self.query
+        self.join()
+        if query.where is not None:
+            mask = self.evaluate(query.where)
+            if not isinstance(mask, np.ndarray) or mask.dtype != bool:
+                raise Unsupported("WHERE must be a boolean condition")
+            self.restrict(mask)
+
+        groups = _Groups(self, [self.canonical(node) for node in query.group_by])
+        outputs = [self.evaluate(self.canonical(item.expr), groups) for item in query.items]
+        groups.outputs = outputs
+        keep = np.arange(groups.count)
+        if query.having is not None:
+            keep = np.flatnonzero(np.broadcast_to(self.evaluate(self.canonical(query.having), groups), (groups.count,)))
+
+        if query.order_by:
+            sort_keys = []
+            for expr, descending in reversed(query.order_by):
+                value = np.broadcast_to(_dense(self.evaluate(self.canonical(expr), groups)), (groups.count,))[keep]
+                rank = _sort_rank(value)
+                sort_keys.append(-rank if descending else rank)
+            keep = keep[np.lexsort(sort_keys)]
+        keep = keep[query.offset:]
+        if query.limit is not None:
+            keep = keep[:query.limit]
+
+        columns = [np.broadcast_to(_dense(value), (groups.count,)) if np.ndim(_dense(value)) else np.full(groups.count, value, dtype=object)
+                   for value in outputs]
+        rows = [tuple(_python_value(column[i]) for column in columns) for i in keep]
+        return [item.name for item in query.items], rows
+
+
+class _Groups:
+    """Group ids for the selected rows plus per-group aggregate and key evaluation."""
+
+    def __init__(self, evaluation: _Evaluation, keys: list[Node]):
+        self.evaluation = evaluation
+        self.keys = keys
+        self.outputs: list = []
+        n = evaluation.row_count()
+        if not keys:
+            self.ids, self.count = np.zeros(n, dtype=np.int64), 1
+            self.first = np.zeros(1 if n else 0, dtype=np.int64)
+            return
+        factor_codes, sizes = [], []
+        for key in keys:
+            value = evaluation.evaluate(key)
+            if not isinstance(value, (DictVector, np.ndarray)):
+                value = np.full(n, value, dtype=object)
+            codes, size = _factorize(value)
+            factor_codes.append(codes)
+            sizes.append(size)
+        if np.prod(sizes, dtype=float) < 2 ** 62:
+            combined = np.ravel_multi_index(factor_codes, sizes) if len(keys) > 1 else factor_codes[0]
+            uniques, self.ids = np.unique(combined, return_inverse=True)
+        else:
+            uniques, self.ids = np.unique(np.stack(factor_codes, axis=1), axis=0, return_inverse=True)
+        self.ids = self.ids.reshape(-1)
+        self.count = len(uniques)
+        _, self.first = np.unique(self.ids, return_index=True)
+
+    ######################### Non-aggregated columns ######################
+    def is_key(self, node: Node) -> bool:
+        return node in self.keys
+
+    def key_value(self, node: Node):
+        return self._first(self.evaluation.evaluate(node))
+
+    def _first(self, value):
+        if isinstance(value, DictVector):
+            return value.take(self.first)
+        if isinstance(value, np.ndarray):
+            return value[self.first]
+        return value
+
+    def column(self, ref: tuple[str, str]):
+        """A bare column in a grouped query: a group key, or fixed by one (the joined row's key is grouped)."""
+        alias, name = ref
+        node = Node("col", ref)
+        if node in self.keys:
+            return self.key_value(node)
+        if not self.keys:
+            raise Unsupported("bare column in an aggregate-only query")
+        if not self._determined(alias):
+            raise Unsupported(f"bare column {alias}.{name} is not determined by the GROUP BY")
+        return self.key_value(node)
+
+    def _determined(self, alias: str) -> bool:
+        """True if one row of `alias` per group is fixed: its key, or the column it was joined by, is grouped
+        (transitively, so GROUP BY e.employee_id fixes the store joined on e.store_id)."""
+        evaluation = self.evaluation
+        if Node("col", (alias, TABLE_KEYS[evaluation.tables[alias]])) in self.keys:
+            return True
+        parent = evaluation.join_parents.get(alias)
+        if parent is None:
+            return False
+        return Node("col", parent) in self.keys or self._determined(parent[0])
+
+    def output(self, index: int):
+        return self.outputs[index]
+
+    ######################### Aggregates ###################################
+    def aggregate(self, node: Node):
+        function, distinct = node.value
+        arg = node.args[0]
+        if arg.kind == "star":
+            return np.bincount(self.ids, minlength=self.count)
+        value = self.evaluation.evaluate(arg)
+        n = self.evaluation.row_count()
+        if not isinstance(value, (DictVector, np.ndarray)):
+            value = np.full(n, value)
+        present = self.evaluation._present(value)
+        ids = self.ids[present]
+
+        if function == "count":
+            if not distinct:
+                return np.bincount(ids, minlength=self.count)
+            codes, size = _factorize(value)
+            pairs = np.unique(ids.astype(np.int64) * size + codes[present])
+            return np.bincount(pairs // size, minlength=self.count)
+        if distinct:
+            raise Unsupported(f"{function.upper()}(DISTINCT ...)")
+
+        if function in ("min", "max"):
+            if isinstance(value, DictVector):
+                codes = pd.Series(value.codes[present]).groupby(ids)
+                picked = (codes.min() if function == "min" else codes.max()).reindex(range(self.count))
+                result = np.full(self.count, None, dtype=object)
+                found = picked.notna().to_numpy()
+                result[found] = value.dictionary[picked[found].astype(np.int64).to_numpy()]
+                return result
+            if _is_text(value):
+                raise Unsupported("MIN/MAX on text expressions")
+            grouped = pd.Series(np.asarray(value)[present]).groupby(ids)
+            picked = (grouped.min() if function == "min" else grouped.max()).reindex(range(self.count))
+            return _nullable(picked.to_numpy(), picked.notna().to_numpy(), integer=np.asarray(value).dtype.kind in "iub")
+
+        if _is_text(value):
+            raise Unsupported(f"{function.upper()}() on text")
+        numbers = np.asarray(value)[present]
+        counts = np.bincount(ids, minlength=self.count)
+        if numbers.dtype.kind in "iub":
+            sums = pd.Series(numbers.astype(np.int64)).groupby(ids).sum().reindex(range(self.count), fill_value=0).to_numpy()
+        else:
+            sums = np.bincount(ids, weights=numbers, minlength=self.count)
+        if function == "total":
+            return sums.astype(np.float64)
+        if function == "avg":
+            return _nullable(sums / np.maximum(counts, 1), counts > 0, integer=False)
+        return _nullable(sums, counts > 0, integer=numbers.dtype.kind in "iub")
+
+
+###########################################################################
+##                            HELPERS
+###########################################################################
+
+
+def _factorize(value) -> tuple[np.ndarray, int]:
+    """Sorted codes (NULL first) and cardinality for grouping / DISTINCT."""
+    if isinstance(value, DictVector):
+        return value.codes.astype(np.int64) + 1, len(value.dictionary) + 1
+    codes, uniques = pd.factorize(pd.Series(value), sort=True, use_na_sentinel=True)
+    return codes.astype(np.int64) + 1, len(uniques) + 1
+
+
+def _sort_rank(value: np.ndarray) -> np.ndarray:
+    """Numeric sort key with SQLite's ordering: NULLs first, then numbers, then text."""
+    if value.dtype.kind in "iub":
+        return value.astype(np.float64)
+    if value.dtype.kind == "f":
+        return np.where(np.isnan(value), -np.inf, value)
+    if any(v is not None and not isinstance(v, str) for v in value):
+        if any(isinstance(v, str) for v in value):
+            raise Unsupported("ORDER BY over mixed text and numbers")
+        numbers = np.array([np.nan if v is None else float(v) for v in value])
+        return np.where(np.isnan(numbers), -np.inf, numbers)
+    codes, _ = _factorize(value)
+    return codes.astype(np.float64)
+
+
+def _nullable(values: np.ndarray, present: np.ndarray, integer: bool) -> np.ndarray:
+    if present.all():
+        return values.astype(np.int64) if integer else values.astype(np.float64)
+    result = np.full(len(values), None, dtype=object)
+    result[present] = [int(v) if integer else float(v) for v in values[present]]
+    return result
+
+
+def _python_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (np.integer, int)) or (isinstance(value, np.bool_)):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.str_):
+        return str(value)
+    return value
+
+
+###########################################################################
+##                         SHARED ENGINE
+###########################################################################
+
+_engine: ColumnarEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> ColumnarEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = ColumnarEngine()
+    return _engine
+
+
+def columnar_stats() -> dict:
+    return get_engine().stats()
+
+
+###########################################################################
+##                            BENCHMARK
+###########################################################################
+
+
+def _bench_queries() -> list[str]:
+    """Golden bucket SQL over transactions (the shapes the agent actually sends)."""
+    steps = [step for example in json.loads(GOLDEN_BUCKET_PATH.read_text(encoding="utf-8")) for step in example.get("steps", [])]
+    queries = [step["sql"] for step in steps if "sql" in step]
+    return [sql for sql in dict.fromkeys(queries) if "transactions" in sql and "{" not in sql]
+
+
+def _compare_rows(left: list[tuple], right: list[tuple]) -> str:
+    def normalize(row):
+        return tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+    left, right = [normalize(row) for row in left], [normalize(row) for row in right]
+    if left == right:
+        return "yes"
+    # ORDER BY ties come back in unspecified order, and with LIMIT the tied rows kept may differ
+    if sorted(left, key=repr) == sorted(right, key=repr):
+        return "yes (tie order)"
+    return "[red]NO[/]"
+
+
+def _median_ms(function) -> float:
+    timings = []
+    for _ in range(BENCH_RUNS):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+
+def benchmark() -> None:
+    engine = get_engine()
+    table = Table(title=f"Columnar engine vs SQLite (median of {BENCH_RUNS}, ms)")
+    for column in ("Query", "SQLite", "Columnar", "Speedup", "Same rows"):
+        table.add_column(column, justify="left" if column == "Query" else "right")
+    with get_pool().connection() as conn:
+        for sql in _bench_queries():
+            sqlite_rows = conn.execute(sql).fetchall()
+            result = engine.execute(sql)
+            sqlite_ms = _median_ms(lambda: conn.execute(sql).fetchall())
+            label = sql if len(sql) <= 70 else sql[:67] + "..."
+            if result is None:
+                table.add_row(label, f"{sqlite_ms:.1f}", "fallback", "", "")
+                continue
+            columnar_ms = _median_ms(lambda: engine.execute(sql))
+            same = _compare_rows(sqlite_rows, result[1])
+            table.add_row(label, f"{sqlite_ms:.1f}", f"{columnar_ms:.1f}", f"{sqlite_ms / columnar_ms:.1f}x", same)
+    console.print(table)
+    console.print(engine.stats())
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar export of sales.db and vectorized aggregate engine")
+    parser.add_argument("--build", action="store_true", help="(re)export the tables to db/columnar")
+    parser.add_argument("--bench", action="store_true", help="compare against SQLite on the golden bucket queries")
+    args = parser.parse_args()
+
+    if args.build or not (COLUMNAR_DIR / "manifest.json").exists():
+        report = Table(title="Columnar export")
+        for column in ("Table", "Rows", "MB", "Seconds"):
+            report.add_column(column, justify="left" if column == "Table" else "right")
+        for name, rows, size, seconds in build_columnar():
+            report.add_row(name, f"{rows:,}", f"{size / 1e6:.1f}", f"{seconds:.2f}")
+        console.print(report)
+    if args.bench:
+        benchmark()
@@ -0,0 +1,276 @@
+"""Compact physical layout for transactions: repeated strings stored as integer codes.
+
+currency, currency_symbol, transaction_type, payment_method, size, color and
+sku are moved into lookup tables (lookup_<column>: id, value) and
+transactions_compact stores only their ids. A view named transactions puts
+the original columns back, in the original order, so query_sql, the rollups
+and the golden bucket SQL run unchanged. INSERT / UPDATE / DELETE on the view
+are routed to the compact table by INSTEAD OF triggers. Rebuild the rollups
+(rollups.py) after converting in either direction.
+
+The layout trades CPU for I/O: scans read a much smaller table, but grouping
+by an encoded column decodes it row by row. It pays off once sales.db no
+longer fits in the page cache / OS file cache.
+
+Convert (prints size / scan-time deltas):  uv run python src/compact_layout.py
+Back to the plain table:                   uv run python src/compact_layout.py --expand
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import argparse
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy import CheckConstraint
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateTable
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from index_advisor import build_indexes
+from models import TransactionDB
+from rollups import ROLLUP_META
+from sql_pool import DB_PATH
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+COMPACT_TABLE = "transactions_compact"
+ENCODED_COLUMNS = ("currency", "currency_symbol", "transaction_type", "payment_method", "size", "color", "sku")
+JOINED_COLUMNS = ("transaction_type",)   # filtered by nearly every agent query
+SCAN_QUERIES = {
+    "payment x currency": "SELECT payment_method, currency, COUNT(*), SUM(line_total) FROM transactions GROUP BY payment_method, currency",
+    "size x color (Sale)": "SELECT size, color, SUM(quantity) FROM transactions WHERE transaction_type = 'Sale' GROUP BY size, color",
+    "top SKUs": "SELECT sku, SUM(quantity) AS units FROM transactions GROUP BY sku ORDER BY units DESC LIMIT 10",
+    "returns by month": "SELECT sale_month, COUNT(*) FROM transactions WHERE transaction_type = 'Return' GROUP BY sale_month",
+    "full row scan": "SELECT * FROM transactions WHERE unit_price > 1e9",
+}
+TIMING_RUNS = 5
+GOLDEN_BUCKET_PATH = Path(__file__).resolve().parent.parent / "golden_bucket" / "golden_bucket.json"
+
+console = Console()
+
+
+###########################################################################
+##                             LAYOUT
+###########################################################################
+
+
+def is_compact(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT type FROM sqlite_master WHERE name = 'transactions'").fetchone() == ("view",)
+
+
+def _lookup(column: str) -> str:
+    return f"lookup_{column}"
+
+
+def _compact_ddl() -> str:
+    """transactions_compact: the model's columns with encoded ones as <column>_id, generated ones VIRTUAL."""
+    table = TransactionDB.__table__
+    definitions = []
+    for column in table.columns:
+        not_null = "" if column.nullable else " NOT NULL"
+        if column.name in ENCODED_COLUMNS:
+            definitions.append(f"{column.name}_id INTEGER{not_null} REFERENCES {_lookup(column.name)}(id)")
+        elif column.computed is not None:
+            definitions.append(f"{column.name} {column.type} GENERATED ALWAYS AS ({column.computed.sqltext}) VIRTUAL")
+        elif column.primary_key:
+            definitions.append(f"{column.name} INTEGER PRIMARY KEY")
+        else:
+            references = "".join(f" REFERENCES {fk.column.table.name}({fk.column.name})" for fk in column.foreign_keys)
+            definitions.append(f"{column.name} {column.type}{not_null}{references}")
+    definitions += [f"CONSTRAINT {constraint.name} CHECK ({constraint.sqltext})"
+                    for constraint in table.constraints if isinstance(constraint, CheckConstraint)]
+    return f"CREATE TABLE {COMPACT_TABLE} (\n    " + ",\n    ".join(definitions) + "\n)"
+
+
+def _decoded_select(names: list[str]) -> str:
+    """SELECT over the compact table returning the transactions columns `names`, in that order.
+
+    JOINED_COLUMNS are LEFT JOINed so a filter on them seeks the lookup's UNIQUE index
+    and then the compact indexes; the rest are scalar subqueries, which SQLite only
+    evaluates for queries that use the column (it keeps LEFT JOINs it could drop).
+    """
+    items = []
+    for name in names:
+        if name in JOINED_COLUMNS:
+            items.append(f"{_lookup(name)}.value AS {name}")
+        elif name in ENCODED_COLUMNS:
+            items.append(f"(SELECT value FROM {_lookup(name)} WHERE id = {COMPACT_TABLE}.{name}_id) AS {name}")
+        else:
+            items.append(f"{COMPACT_TABLE}.{name} AS {name}")
+    joins = [f"LEFT JOIN {_lookup(column)} ON {_lookup(column)}.id = {COMPACT_TABLE}.{column}_id" for column in JOINED_COLUMNS]
+    return f"SELECT {', '.join(items)}\nFROM {COMPACT_TABLE}\n" + "\n".join(joins)
+
+
+def _triggers() -> list[str]:
+    stored = [column.name for column in TransactionDB.__table__.columns if column.computed is None]
+    values = [f"(SELECT id FROM {_lookup(name)} WHERE value = NEW.{name})" if name in ENCODED_COLUMNS else f"NEW.{name}" for name in stored]
+    names = [f"{name}_id" if name in ENCODED_COLUMNS else name for name in stored]
+    new_values = "\n".join(f"    INSERT OR IGNORE INTO {_lookup(column)} (value) SELECT NEW.{column} WHERE NEW.{column} IS NOT NULL;"
+                           for column in ENCODED_COLUMNS)
+    assignments = ", ".join(f"{name} = {value}" for name, value in zip(names, values))
+    return [
+        f"CREATE TRIGGER transactions_insert INSTEAD OF INSERT ON transactions BEGIN\n{new_values}\n"
+        f"    INSERT INTO {COMPACT_TABLE} ({', '.join(names)}) VALUES ({', '.join(values)});\nEND",
+        f"CREATE TRIGGER transactions_update INSTEAD OF UPDATE ON transactions BEGIN\n{new_values}\n"
+        f"    UPDATE {COMPACT_TABLE} SET {assignments} WHERE id = OLD.id;\nEND",
+        f"CREATE TRIGGER transactions_delete INSTEAD OF DELETE ON transactions BEGIN\n"
+        f"    DELETE FROM {COMPACT_TABLE} WHERE id = OLD.id;\nEND",
+    ]
+
+
+def _compact_indexes() -> list[str]:
+    """The model's transactions indexes, on the compact table and its id columns."""
+    statements = []
+    for index in TransactionDB.__table__.indexes:
+        columns = [f"{column.name}_id" if column.name in ENCODED_COLUMNS else column.name for column in index.columns]
+        name = index.name.replace("ix_transactions_", f"ix_{COMPACT_TABLE}_", 1)
+        statements.append(f"CREATE INDEX {name} ON {COMPACT_TABLE} ({', '.join(columns)})")
+    return statements
+
+
+def compact(db_path: Path = DB_PATH) -> None:
+    """Convert transactions to the compact layout in one transaction, then VACUUM."""
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    try:
+        if is_compact(conn):
+            raise RuntimeError(f"{db_path} already uses the compact layout")
+        present = [row[1] for row in conn.execute("PRAGMA table_xinfo(transactions)")]
+        expected = [column.name for column in TransactionDB.__table__.columns]
+        if sorted(present) != sorted(expected):
+            raise RuntimeError("transactions does not match models.py, run migrations.py first")
+
+        stored = [column.name for column in TransactionDB.__table__.columns if column.computed is None]
+        conn.execute("BEGIN")
+        for column in ENCODED_COLUMNS:
+            conn.execute(f"CREATE TABLE {_lookup(column)} (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+            conn.execute(f"INSERT INTO {_lookup(column)} (value) SELECT DISTINCT {column} FROM transactions WHERE {column} IS NOT NULL ORDER BY 1")
+        conn.execute(_compact_ddl())
+        names = [f"{name}_id" if name in ENCODED_COLUMNS else name for name in stored]
+        selects = [f"{_lookup(name)}.id" if name in ENCODED_COLUMNS else f"t.{name}" for name in stored]
+        joins = " ".join(f"LEFT JOIN {_lookup(column)} ON {_lookup(column)}.value = t.{column}" for column in ENCODED_COLUMNS)
+        conn.execute(f"INSERT INTO {COMPACT_TABLE} ({', '.join(names)}) SELECT {', '.join(selects)} FROM transactions t {joins} ORDER BY t.id")
+        conn.execute("DROP TABLE transactions")
+        conn.execute(f"CREATE VIEW transactions AS\n{_decoded_select(present)}")
+        for statement in _triggers() + _compact_indexes():
+            conn.execute(statement)
+        conn.execute("ANALYZE")
+        conn.execute("COMMIT")
+        conn.execute("VACUUM")
+        _note_rollups(conn)
+    finally:
+        conn.close()
+
+
+def _note_rollups(conn: sqlite3.Connection) -> None:
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (ROLLUP_META,)).fetchone():
+        console.print("[yellow]The rollups were built on the previous layout, rebuild them: uv run python src/rollups.py[/]")
+
+
+def expand(db_path: Path = DB_PATH) -> None:
+    """Back to the plain transactions table from models.py (indexes rebuilt), then VACUUM."""
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    try:
+        if not is_compact(conn):
+            raise RuntimeError(f"{db_path} does not use the compact layout")
+        stored = [column.name for column in TransactionDB.__table__.columns if column.computed is None]
+        conn.execute("BEGIN")
+        conn.execute("DROP VIEW transactions")
+        conn.execute(str(CreateTable(TransactionDB.__table__).compile(dialect=sqlite_dialect.dialect())))
+        conn.execute(f"INSERT INTO transactions ({', '.join(stored)}) SELECT {', '.join(stored)} FROM ({_decoded_select(stored)}) ORDER BY id")
+        conn.execute(f"DROP TABLE {COMPACT_TABLE}")
+        for column in ENCODED_COLUMNS:
+            conn.execute(f"DROP TABLE {_lookup(column)}")
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    build_indexes(db_path)
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    conn.execute("VACUUM")
+    _note_rollups(conn)
+    conn.close()
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+
+def _used_bytes(conn: sqlite3.Connection) -> int:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0] - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return pages * page_size
+
+
+def _table_bytes(conn: sqlite3.Connection) -> int | None:
+    """Bytes of the transactions rows themselves (plain or compact table + lookups), None without dbstat."""
+    try:
+        return conn.execute(
+            f"SELECT SUM(pgsize) FROM dbstat WHERE name IN ('transactions', '{COMPACT_TABLE}') OR name LIKE 'lookup\\_%' ESCAPE '\\'"
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def _normalized(rows: list[tuple]) -> list[tuple]:
+    """Rows rounded and sorted: a different plan may sum floats in another order or break ties differently."""
+    return sorted((tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows), key=repr)
+
+
+def _measure(db_path: Path, queries: list[str]) -> tuple[int, int | None, dict[str, float], list[list[tuple]]]:
+    """(bytes in use, transactions bytes, median ms per SCAN_QUERIES entry, normalized results of `queries`)."""
+    conn = sqlite3.connect(f"file:{db_path.as_posix()}?mode=ro", uri=True)
+    try:
+        timings = {}
+        for label, sql in SCAN_QUERIES.items():
+            runs = []
+            for _ in range(TIMING_RUNS):
+                started = time.perf_counter()
+                conn.execute(sql).fetchall()
+                runs.append(time.perf_counter() - started)
+            timings[label] = sorted(runs)[len(runs) // 2] * 1000
+        results = [_normalized(conn.execute(sql).fetchall()) for sql in queries]
+        return _used_bytes(conn), _table_bytes(conn), timings, results
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert sales.db transactions to / from the dictionary-encoded layout")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help="database to convert")
+    parser.add_argument("--expand", action="store_true", help="restore the plain transactions table")
+    args = parser.parse_args()
+
+    steps = [step for example in json.loads(GOLDEN_BUCKET_PATH.read_text(encoding="utf-8")) for step in example.get("steps", [])]
+    golden = [sql for sql in dict.fromkeys(step["sql"] for step in steps if "sql" in step) if "{" not in sql]
+
+    before_bytes, before_table, before_ms, before_rows = _measure(args.db, golden)
+    started = time.perf_counter()
+    (expand if args.expand else compact)(args.db)
+    console.print(f"[green]{'Expanded' if args.expand else 'Compacted'} {args.db.name} in {time.perf_counter() - started:.1f}s[/]")
+    after_bytes, after_table, after_ms, after_rows = _measure(args.db, golden)
+
+    table = Table(title="Plain vs compact layout" if not args.expand else "Compact vs plain layout")
+    for column in ("", "Before", "After", "Delta"):
+        table.add_column(column, justify="left" if not column else "right")
+    table.add_row("database size (MB)", f"{before_bytes / 1e6:.1f}", f"{after_bytes / 1e6:.1f}", f"{(after_bytes - before_bytes) / before_bytes:+.0%}")
+    if before_table and after_table:
+        table.add_row("transactions rows (MB)", f"{before_table / 1e6:.1f}", f"{after_table / 1e6:.1f}", f"{(after_table - before_table) / before_table:+.0%}")
+    for label in SCAN_QUERIES:
+        delta = (after_ms[label] - before_ms[label]) / before_ms[label]
+        table.add_row(f"{label} (ms)", f"{before_ms[label]:.1f}", f"{after_ms[label]:.1f}", f"{delta:+.0%}")
+    console.print(table)
+    same = sum(before == after for before, after in zip(before_rows, after_rows))
+    console.print(f"Golden bucket queries with identical results: [{'green' if same == len(golden) else 'red'}]{same}/{len(golden)}[/]")
@@ -0,0 +1,189 @@
+"""Two-level cache for query embeddings: an in-process LRU in front of a sidecar SQLite file.
+
+The planner asks query_rag nearly the same question many times per thread and
+across threads. Questions are normalized (case, whitespace, trailing
+punctuation) and keyed together with the embedding model, so a repeat never
+reaches the embedding API. Vectors are stored as float32 blobs in
+db/rag_cache.db (a sidecar, ingest.py recreates rag.db from scratch), which
+survives restarts and is shared by every process. embed_queries serves a
+list of questions from the cache and sends only the misses, in one batched
+embedding request.
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import inspect
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+EMBEDDING_CACHE_FILE = Path(__file__).resolve().parent.parent / "db" / "rag_cache.db"
+EMBEDDING_CACHE_MAX_ENTRIES = 4096      # in-process LRU size, the sidecar file is unbounded
+_SPACE_RE = re.compile(r"\s+")
+_TRAILING_RE = re.compile(r"[\s?!.]+$")
+
+
+###########################################################################
+##                            CACHE
+###########################################################################
+
+
+def normalize_query(text: str) -> str:
+    """'  What material is the Silk Retro Coat made of? ' -> 'what material is the silk retro coat made of'."""
+    return _TRAILING_RE.sub("", _SPACE_RE.sub(" ", text.strip()).casefold())
+
+
+def model_name(embeddings: Embeddings) -> str:
+    return str(getattr(embeddings, "model", None) or type(embeddings).__name__)
+
+
+def embed_query_batch(embeddings: Embeddings, texts: list[str]) -> list[list[float]]:
+    """Query embeddings for several texts in one request where the client supports it.
+
+    Gemini's embed_documents takes a task_type, so queries go out as one batch
+    with the query task type and come back identical to embed_query's. Other
+    clients get one embed_query per text (their embed_documents may embed
+    differently).
+    """
+    if len(texts) == 1:
+        return [embeddings.embed_query(texts[0])]
+    if "task_type" in inspect.signature(embeddings.embed_documents).parameters:
+        return embeddings.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings client; embed_query goes memory LRU -> sidecar table -> API. Documents are not cached."""
+
+    def __init__(self, inner: Embeddings, cache_file: Path | str = EMBEDDING_CACHE_FILE, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.inner = inner
+        self.model = model_name(inner)
+        self.cache_file = Path(cache_file)
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "batch_requests": 0, "api_seconds": 0.0}
+
+    def _db(self) -> sqlite3.Connection:
+        """Sidecar connection, opened on first use. Caller holds the lock."""
+        if self._conn is None:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.cache_file), check_same_thread=False, timeout=5.0)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    model TEXT NOT NULL, text TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL,
+                    created REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (model, text)
+                ) WITHOUT ROWID
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key: str, vector: list[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key: str) -> list[float] | None:
+        """Vector for `key` from memory, else from the sidecar table. Caller holds the lock."""
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return vector
+        conn = self._db()
+        row = conn.execute("SELECT vector FROM query_embeddings WHERE model = ? AND text = ?", (self.model, key)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE query_embeddings SET hits = hits + 1 WHERE model = ? AND text = ?", (self.model, key))
+        conn.commit()
+        vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+        self._remember(key, vector)
+        self._stats["disk_hits"] += 1
+        return vector
+
+    def _store(self, keys: list[str], vectors: list[list[float]], elapsed: float) -> list[list[float]]:
+        """Write API results to both levels. Caller holds the lock."""
+        arrays = [np.asarray(vector, dtype=np.float32) for vector in vectors]
+        now = time.time()
+        self._db().executemany(
+            "INSERT OR REPLACE INTO query_embeddings (model, text, dim, vector, created) VALUES (?, ?, ?, ?, ?)",
+            [(self.model, key, len(array), array.tobytes(), now) for key, array in zip(keys, arrays)],
+        )
+        self._conn.commit()
+        for key, array in zip(keys, arrays):
+            # The float32 round-trip keeps a miss and a later hit bit-identical
+            self._remember(key, array.tolist())
+        self._stats["misses"] += len(keys)
+        self._stats["api_seconds"] += elapsed
+        return [self._memory[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._lookup(key)
+            if vector is not None:
+                return vector
+
+        # Outside the lock: other questions keep being served while this one waits on the API
+        started = time.perf_counter()
+        vector = self.inner.embed_query(text)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            return self._store([key], [vector], elapsed)[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """embed_query for several texts: cache hits are served, all misses go out in one batched request."""
+        keys = [normalize_query(text) for text in texts]
+        with self._lock:
+            found = {key: self._lookup(key) for key in dict.fromkeys(keys)}
+        missing: dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if found[key] is None:
+                missing.setdefault(key, text)   # the first spelling is embedded, as a single embed_query would
+        if missing:
+            started = time.perf_counter()
+            vectors = embed_query_batch(self.inner, list(missing.values()))
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                found.update(zip(missing, self._store(list(missing), vectors, elapsed)))
+                self._stats["batch_requests"] += 1
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.inner.embed_documents(texts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = lookups - self._stats["misses"]
+            stored = self._db().execute("SELECT COUNT(*) FROM query_embeddings WHERE model = ?", (self.model,)).fetchone()[0]
+            return {
+                "model": self.model,
+                "memory_entries": len(self._memory),
+                "stored_entries": stored,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                **self._stats,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,241 @@
+"""In-memory product name resolver: mentions in any of the 6 catalogue languages -> product_id.
+
+Built once from the products table (description_en/de/fr/es/pt/zh) and kept in
+memory. Descriptions are normalized (case, accents, punctuation) and indexed by
+word; catalogue words are indexed again by prefix and character trigram, so
+cut-off words ("silk ret"), typos ("jaket") and any word order still resolve.
+An exact normalized match is a dictionary hit. The index is rebuilt when
+sales.db changes.
+
+Try it:  uv run python src/entity_resolver.py "silk retro coat" "Seidenmantel"
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import bisect
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import NamedTuple
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from sql_cache import db_signature
+from sql_pool import DB_PATH, get_pool
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+DESCRIPTION_COLUMNS = {
+    "en": "description_en", "de": "description_de", "fr": "description_fr",
+    "es": "description_es", "pt": "description_pt", "zh": "description_zh",
+}
+RESOLVE_LIMIT = 5             # products returned per mention
+RESOLVE_MIN_SCORE = 0.5       # weighted Dice score below which a product is not a match
+MIN_WORD_SIMILARITY = 0.5     # trigram Dice for a misspelled word to count as a catalogue word
+MIN_PREFIX_CHARS = 3          # a mention word this long may be the start of a catalogue word ("ret" -> "retro")
+PREFIX_SIMILARITY = 0.9
+_NON_WORD_RE = re.compile(r"[\W_]+")
+_WORD_RE = re.compile(r"[\u3400-\u9fff]|[^\W\u3400-\u9fff]+")
+
+console = Console()
+
+
+###########################################################################
+##                            RESOLVER
+###########################################################################
+
+
+class ProductMatch(NamedTuple):
+    product_id: int
+    description: str      # the description that matched
+    language: str         # its language (en, de, fr, es, pt, zh)
+    score: float
+
+
+def normalize_name(text: str) -> str:
+    """'  Vestido Clásico-Floral ' -> 'vestido clasico floral' without accents, punctuation or case."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_WORD_RE.sub(" ", stripped.casefold()).strip()
+
+
+def name_words(normalized: str) -> list[str]:
+    """Words of a normalized name; Chinese is split into characters (no spaces between its words)."""
+    return _WORD_RE.findall(normalized)
+
+
+def trigrams(word: str) -> set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductResolver:
+    """Word index over distinct normalized descriptions, with trigram / prefix lookup for misspelled or cut-off words.
+
+    A mention's words are mapped onto catalogue words (exact, else a word it is
+    a prefix of, else the closest by trigram Dice), then every description
+    containing them is scored at once with NumPy: IDF-weighted Dice between the
+    mention's and the description's words.
+    """
+
+    def __init__(self, rows: list[tuple]):
+        """rows: (product_id, description_en, description_de, description_fr, description_es, description_pt, description_zh)."""
+        started = time.perf_counter()
+        self._entries: dict[str, list[tuple[int, str, str]]] = {}
+        for product_id, *descriptions in rows:
+            for language, description in zip(DESCRIPTION_COLUMNS, descriptions):
+                if description and (key := normalize_name(description)):
+                    self._entries.setdefault(key, []).append((product_id, language, description))
+        self._keys = list(self._entries)
+
+        ######################### Word postings ###########################
+        postings: dict[str, list[int]] = {}
+        entry_words = []
+        for index, key in enumerate(self._keys):
+            words = set(name_words(key))
+            entry_words.append(words)
+            for word in words:
+                postings.setdefault(word, []).append(index)
+        self._words = sorted(postings)
+        self._word_ids = {word: word_id for word_id, word in enumerate(self._words)}
+        self._postings = [np.array(postings[word], dtype=np.int32) for word in self._words]
+        self._idf = np.log1p(len(self._keys) / np.array([len(postings[word]) for word in self._words], dtype=np.float64))
+        self._entry_weight = np.array([sum(self._idf[self._word_ids[word]] for word in words) for words in entry_words])
+
+        ######################### Word trigrams ###########################
+        self._gram_postings: dict[str, list[int]] = {}
+        self._gram_sizes = []
+        for word_id, word in enumerate(self._words):
+            grams = trigrams(word)
+            self._gram_sizes.append(len(grams))
+            for gram in grams:
+                self._gram_postings.setdefault(gram, []).append(word_id)
+
+        self.products = len({product_id for product_id, *_ in rows})
+        self.build_seconds = time.perf_counter() - started
+        self._lookups = 0
+        self._lookup_seconds = 0.0
+
+    def _match_word(self, word: str) -> tuple[int, float] | None:
+        """(catalogue word id, similarity) for one mention word."""
+        if word in self._word_ids:
+            return self._word_ids[word], 1.0
+        if len(word) >= MIN_PREFIX_CHARS:
+            position = bisect.bisect_left(self._words, word)
+            if position < len(self._words) and self._words[position].startswith(word):
+                return position, PREFIX_SIMILARITY
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._gram_postings.get(gram, ()))
+        best = max(shared.items(), key=lambda item: 2 * item[1] / (len(grams) + self._gram_sizes[item[0]]), default=None)
+        if best is not None:
+            similarity = 2 * best[1] / (len(grams) + self._gram_sizes[best[0]])
+            if similarity >= MIN_WORD_SIMILARITY:
+                return best[0], similarity
+        return None
+
+    def resolve(self, mention: str, limit: int = RESOLVE_LIMIT, min_score: float = RESOLVE_MIN_SCORE) -> list[ProductMatch]:
+        """Best matching products for one mention, highest score first (one match per product, its best description)."""
+        started = time.perf_counter()
+        normalized = normalize_name(mention)
+        scored: dict[str, float] = {}
+        if normalized in self._entries:
+            scored[normalized] = 1.0
+        elif words := list(dict.fromkeys(name_words(normalized))):
+            unknown_weight = float(self._idf.max())
+            mention_weight, matches = 0.0, []
+            for word in words:
+                match = self._match_word(word)
+                mention_weight += unknown_weight if match is None else self._idf[match[0]]
+                if match is not None:
+                    matches.append(match)
+            if matches:
+                # Postings hold each description once per word, so fancy-indexed += adds exactly once
+                matched = np.zeros(len(self._keys))
+                for word_id, similarity in matches:
+                    matched[self._postings[word_id]] += similarity * self._idf[word_id]
+                candidates = np.flatnonzero(matched)
+                scores = 2 * matched[candidates] / (mention_weight + self._entry_weight[candidates])
+                top = np.flatnonzero(scores >= min_score)
+                if len(top) > limit * 4:
+                    # Several descriptions of one product can match, keep some spare before grouping by product
+                    top = top[np.argpartition(-scores[top], limit * 4)[:limit * 4]]
+                for position in top:
+                    scored[self._keys[candidates[position]]] = float(scores[position])
+
+        best: dict[int, ProductMatch] = {}
+        for key, score in scored.items():
+            for product_id, language, description in self._entries[key]:
+                if product_id not in best or score > best[product_id].score:
+                    best[product_id] = ProductMatch(product_id, description, language, round(score, 3))
+        matches = sorted(best.values(), key=lambda match: (-match.score, match.product_id))[:limit]
+        self._lookups += 1
+        self._lookup_seconds += time.perf_counter() - started
+        return matches
+
+    def stats(self) -> dict:
+        return {
+            "products": self.products,
+            "descriptions": len(self._keys),
+            "words": len(self._words),
+            "build_ms": round(self.build_seconds * 1000, 1),
+            "lookups": self._lookups,
+            "avg_lookup_us": round(self._lookup_seconds * 1e6 / self._lookups, 1) if self._lookups else 0.0,
+        }
+
+
+###########################################################################
+##                        SHARED RESOLVER
+###########################################################################
+
+_resolver: ProductResolver | None = None
+_resolver_signature: tuple | None = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver() -> ProductResolver:
+    """Process-wide resolver for sales.db, built on first use and rebuilt after the database changes."""
+    global _resolver, _resolver_signature
+    signature = db_signature(DB_PATH)
+    if _resolver is None or signature != _resolver_signature:
+        with _resolver_lock:
+            if _resolver is None or signature != _resolver_signature:
+                with get_pool().connection() as conn:
+                    rows = conn.execute(f"SELECT product_id, {', '.join(DESCRIPTION_COLUMNS.values())} FROM products").fetchall()
+                _resolver, _resolver_signature = ProductResolver(rows), signature
+    return _resolver
+
+
+def resolver_stats() -> dict:
+    return get_resolver().stats()
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    resolver = get_resolver()
+    table = Table(title="Product mentions")
+    for column in ("Mention", "Product", "Matched description", "Lang", "Score"):
+        table.add_column(column, justify="right" if column in ("Product", "Score") else "left")
+    for mention in sys.argv[1:]:
+        for match in resolver.resolve(mention):
+            table.add_row(mention, str(match.product_id), match.description, match.language, f"{match.score:.2f}")
+    console.print(table)
+    console.print(resolver.stats())
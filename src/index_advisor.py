@@ -0,0 +1,322 @@
+"""Capture the agent's SQL with its query plan, and turn full-scan patterns into indexes.
+
+Capture is opt-in: set SQL_QUERY_LOG=1 (e.g. in .env) while running the agent, then advise from the log.
+
+Run:  uv run python src/index_advisor.py            # advise + apply, with before/after timings
+      uv run python src/index_advisor.py --dry-run  # only print the proposed indexes
+      uv run python src/index_advisor.py --build    # create the indexes declared in models.py
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy import create_engine
+from sqlmodel import SQLModel
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+import models  # noqa: F401  (registers the tables on SQLModel.metadata)
+from sql_cache import from_tables, normalize_sql, sql_words, tokenize_sql
+from sql_pool import DB_PATH
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+CAPTURE_QUERIES = os.getenv("SQL_QUERY_LOG") == "1"   # query_sql appends every executed query + plan to the log
+QUERY_LOG_PATH = DB_PATH.parent / "query_log.jsonl"
+QUERY_LOG_MAX_BYTES = 20 * 1024 * 1024   # rotated to query_log.jsonl.1 beyond this
+MIN_TABLE_ROWS = 5_000                   # full scans of smaller tables are not worth an index
+MAX_INDEX_COLUMNS = 6
+MAX_NEW_INDEXES = 5                      # every extra index slows down bulk loads
+TIMING_RUNS = 3
+
+SCAN_RE = re.compile(r"^SCAN (\w+)$")
+EQUALITY_OPS = {"=", "==", "in", "is"}
+RANGE_OPS = {"<", "<=", ">", ">=", "between", "like", "glob"}
+CLAUSE_ENDS = {"group", "order", "limit", "having", "window"}
+
+console = Console()
+_log_lock = threading.Lock()
+
+
+###########################################################################
+##                          QUERY CAPTURE
+###########################################################################
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str) -> list[tuple[int, int, str]]:
+    """(id, parent, detail) rows of EXPLAIN QUERY PLAN."""
+    return [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def log_query(sql: str, executed_sql: str, plan: list[tuple[int, int, str]], elapsed_ms: float) -> None:
+    """Append one executed query and its plan to the query log."""
+    record = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sql": sql,
+        "executed_sql": executed_sql,
+        "elapsed_ms": round(elapsed_ms, 2),
+        "plan": [detail for _, _, detail in plan],
+    }
+    with _log_lock:
+        if QUERY_LOG_PATH.exists() and QUERY_LOG_PATH.stat().st_size > QUERY_LOG_MAX_BYTES:
+            QUERY_LOG_PATH.replace(QUERY_LOG_PATH.with_name(QUERY_LOG_PATH.name + ".1"))
+        with QUERY_LOG_PATH.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def load_query_log(path: Path = QUERY_LOG_PATH) -> list[dict]:
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+
+###########################################################################
+##                           ADVISOR
+###########################################################################
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1].lower() for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+
+
+def _is_column_ref(tokens, words: list[str], i: int) -> bool:
+    return 0 <= i < len(tokens) and tokens[i].kind in ("word", "quoted") and words[i] not in ("null", "true", "false")
+
+
+def _column_roles(sql: str, alias: str, columns: set[str], other_columns: set[str]) -> dict[str, list[str]]:
+    """Classify how a query uses one table's columns: equality / join / range filters, grouping, or only read."""
+    tokens = tokenize_sql(sql)
+    words = sql_words(tokens)
+    roles = {"equality": [], "join": [], "group": [], "range": [], "read": []}
+
+    clause = "select"
+    for i, token in enumerate(tokens):
+        word = words[i]
+        if word in ("where", "on"):
+            clause = "filter"
+        elif word in ("from", "join"):
+            clause = "from"
+        elif word == "group":
+            clause = "group"
+        elif word in CLAUSE_ENDS:
+            clause = "other"
+        if token.kind != "word" or word not in columns:
+            continue
+
+        qualified = i >= 2 and words[i - 1] == "." and words[i - 2] == alias
+        bare = (i == 0 or words[i - 1] != ".") and words[i + 1:i + 2] != ["."] and word not in other_columns
+        if not (qualified or bare):
+            continue
+        ref_start = i - 2 if qualified else i
+        before = words[ref_start - 1] if ref_start > 0 else ""
+        after = words[i + 1] if i + 1 < len(words) else ""
+
+        role = "read"
+        if clause == "filter":
+            if after in EQUALITY_OPS:
+                # `col = other.col` is a join, `col = 'Sale'` / `col IN (...)` an equality filter
+                role = "join" if _is_column_ref(tokens, words, i + 2) and words[i + 3:i + 4] == ["."] else "equality"
+            elif before in ("=", "=="):
+                role = "join" if _is_column_ref(tokens, words, ref_start - 2) else "equality"
+            elif after in RANGE_OPS or before in RANGE_OPS:
+                role = "range"
+        elif clause == "group":
+            role = "group"
+        if word not in roles[role]:
+            roles[role].append(word)
+    return roles
+
+
+def propose_index(conn: sqlite3.Connection, sql: str, alias: str, table: str, query_tables: list[tuple[int, str, str | None]]) -> tuple[tuple[str, ...], tuple[str, ...]] | None:
+    """(seek columns, covered columns) for an index serving one full scan.
+
+    Seek columns are ordered equality, join, group, range. The remaining columns
+    the query reads are appended (sorted) to make the index covering, if they fit.
+    """
+    columns = _table_columns(conn, table)
+    other_columns = set()
+    for _, other_table, _ in query_tables:
+        if other_table != table:
+            other_columns |= _table_columns(conn, other_table)
+    roles = _column_roles(sql, alias, columns, other_columns)
+
+    seek: list[str] = []
+    for role in ("equality", "join", "group", "range"):
+        seek += [c for c in roles[role] if c not in seek]
+    if not seek:
+        return None
+    covered = sorted(c for c in roles["read"] if c not in seek)
+    if len(seek) + len(covered) > MAX_INDEX_COLUMNS:
+        covered = []
+    return tuple(seek[:MAX_INDEX_COLUMNS]), tuple(covered)
+
+
+def _serves(index_columns: tuple[str, ...], seek: tuple[str, ...], columns: tuple[str, ...]) -> bool:
+    """True if an index on index_columns can seek on `seek` and cover all of `columns`."""
+    return index_columns[:len(seek)] == seek and set(columns) <= set(index_columns)
+
+
+def _existing_indexes(conn: sqlite3.Connection, table: str) -> list[tuple[str, ...]]:
+    indexes = []
+    for _, name, *_ in conn.execute(f"PRAGMA index_list({table})"):
+        indexes.append(tuple(row[2].lower() for row in conn.execute(f"PRAGMA index_info({name})") if row[2]))
+    return indexes
+
+
+def advise(conn: sqlite3.Connection, log: list[dict]) -> list[dict]:
+    """Rank logged full scans by (executions x table rows) and propose one index per scan pattern."""
+    patterns: Counter[str] = Counter()
+    example_sql: dict[str, str] = {}
+    for record in log:
+        key = normalize_sql(record["executed_sql"])
+        patterns[key] += 1
+        example_sql.setdefault(key, record["executed_sql"])
+
+    table_rows: dict[str, int] = {}
+    proposals: dict[tuple[str, tuple[str, ...]], dict] = {}
+    for key, count in patterns.items():
+        sql = example_sql[key]
+        try:
+            plan = explain_query_plan(conn, sql)
+        except sqlite3.Error:
+            continue
+        query_tables = from_tables(tokenize_sql(sql), sql_words(tokenize_sql(sql)))
+        aliases = {(alias or table): table for _, table, alias in query_tables}
+        for _, _, detail in plan:
+            match = SCAN_RE.match(detail)
+            if not match or match.group(1).lower() not in aliases:
+                continue
+            alias = match.group(1).lower()
+            table = aliases[alias]
+            if table not in table_rows:
+                table_rows[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            if table_rows[table] < MIN_TABLE_ROWS:
+                continue
+            proposed = propose_index(conn, sql, alias, table, query_tables)
+            if not proposed:
+                continue
+            seek, covered = proposed
+            columns = seek + covered
+            if any(_serves(existing, seek, columns) for existing in _existing_indexes(conn, table)):
+                continue
+            proposal = proposals.setdefault((table, columns), {
+                "table": table, "seek": seek, "columns": columns, "queries": [], "executions": 0, "rows": table_rows[table],
+            })
+            proposal["queries"].append(sql)
+            proposal["executions"] += count
+
+    # Fold every proposal into a wider one that already serves its seek + covered columns
+    merged: list[dict] = []
+    for proposal in sorted(proposals.values(), key=lambda p: len(p["columns"]), reverse=True):
+        wider = next((m for m in merged if m["table"] == proposal["table"] and _serves(m["columns"], proposal["seek"], proposal["columns"])), None)
+        if wider:
+            wider["queries"] += proposal["queries"]
+            wider["executions"] += proposal["executions"]
+        else:
+            merged.append(proposal)
+
+    ranked = sorted(merged, key=lambda p: p["executions"] * p["rows"], reverse=True)[:MAX_NEW_INDEXES]
+    for proposal in ranked:
+        digest = hashlib.sha1(",".join(proposal["columns"]).encode()).hexdigest()[:8]
+        proposal["name"] = f"ix_auto_{proposal['table']}_{digest}"
+        proposal["ddl"] = f"CREATE INDEX IF NOT EXISTS {proposal['name']} ON {proposal['table']} ({', '.join(proposal['columns'])})"
+    return ranked
+
+
+def _time_query(conn: sqlite3.Connection, sql: str) -> float:
+    timings = []
+    for _ in range(TIMING_RUNS):
+        started = time.perf_counter()
+        conn.execute(sql).fetchall()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+
+def apply_proposals(conn: sqlite3.Connection, proposals: list[dict]) -> list[dict]:
+    """Create each proposed index and measure its queries before and after (median ms)."""
+    report = []
+    for proposal in proposals:
+        before = [_time_query(conn, sql) for sql in proposal["queries"]]
+        conn.execute(proposal["ddl"])
+        conn.execute(f"ANALYZE {proposal['table']}")
+        conn.commit()
+        after = [_time_query(conn, sql) for sql in proposal["queries"]]
+        report.append({**proposal, "before_ms": sum(before), "after_ms": sum(after)})
+    return report
+
+
+###########################################################################
+##                         MODEL INDEXES
+###########################################################################
+
+
+def build_indexes(db_path: Path = DB_PATH) -> list[str]:
+    """Create every index declared in models.py that is missing from the database."""
+    engine = create_engine(f"sqlite:///{db_path}")
+    created = []
+    with engine.begin() as connection:
+        existing = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        tables = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in tables:
+                continue  # e.g. transactions is a view over the compact layout (compact_layout.py indexes it)
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(connection)
+                    created.append(index.name)
+        if created:
+            connection.exec_driver_sql("ANALYZE")
+    engine.dispose()
+    return created
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index builder and EXPLAIN-driven index advisor for sales.db")
+    parser.add_argument("--build", action="store_true", help="create the indexes declared in models.py")
+    parser.add_argument("--dry-run", action="store_true", help="print proposals without creating them")
+    args = parser.parse_args()
+
+    if args.build:
+        created = build_indexes()
+        console.print(f"[green]Created {len(created)} model indexes[/] {', '.join(created)}")
+
+    log = load_query_log()
+    console.print(f"Loaded [cyan]{len(log)}[/] captured queries from {QUERY_LOG_PATH.name}")
+    conn = sqlite3.connect(str(DB_PATH))
+    proposals = advise(conn, log)
+    if not proposals:
+        console.print("[green]No full scans left on large tables -- nothing to index.[/]")
+    elif args.dry_run:
+        for proposal in proposals:
+            console.print(f"[cyan]{proposal['executions']}x[/] {proposal['ddl']}")
+    else:
+        table = Table(title="Applied indexes")
+        for column in ("Index", "Executions", "Queries", "Before ms", "After ms"):
+            table.add_column(column, justify="left" if column == "Index" else "right")
+        for row in apply_proposals(conn, proposals):
+            table.add_row(row["ddl"], str(row["executions"]), str(len(row["queries"])), f"{row['before_ms']:.1f}", f"{row['after_ms']:.1f}")
+        console.print(table)
+    conn.close()
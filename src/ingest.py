@@ -1,13 +1,24 @@
-"""One-shot PDF ingestion: load all product tech sheet PDFs into sqlite-vec.
+"""One-shot PDF ingestion: load all product tech sheet PDFs into sqlite-vec, plus the FTS5 keyword index.
 
 Run:  uv run python src/ingest.py
 Idempotent: deletes and recreates rag.db on every run.
+Only rebuild the FTS5 index and product_chunks of an existing rag.db (no PDFs, no embedding calls):
+      uv run python src/ingest.py --reindex
+Add a quantized first-pass vector index (int8 / binary, optionally truncated to --dims), with or without --reindex:
+      uv run python src/ingest.py --reindex --quantize binary --dims 768
+(Re)train the IVF approximate nearest-neighbour index, with or without --reindex (a plain --reindex adds new chunks to it):
+      uv run python src/ingest.py --reindex --ivf
+Export the embeddings to a memory-mapped NumPy matrix for batched vector search (--reindex refreshes an existing export):
+      uv run python src/ingest.py --vectors
+Both also drop cached query_rag answers (answer_cache.py) whose chunks are gone or changed.
 """
 
 ###########################################################################
 ##                            IMPORTS
 ###########################################################################
 
+import argparse
+import sqlite3
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -17,6 +28,18 @@ from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from rich.console import Console
 
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from answer_cache import SemanticAnswerCache
+from embedding_cache import EMBEDDING_CACHE_FILE
+from rag_fts import build_fts_index
+from rag_ivf import IVFIndex, build_ivf_index
+from rag_products import build_product_index
+from rag_quantized import MODES, build_quantized_index, load_sqlite_vec
+from rag_vectors import RAG_VECTORS_DIR, build_vector_export
+
 load_dotenv()
 
 
@@ -37,7 +60,7 @@ console = Console()
 ###########################################################################
 
 
-def ingest_pdfs() -> None:
+def ingest_pdfs(quantize: str | None = None, dims: int | None = None, ivf: bool = False, vectors: bool = False) -> None:
     Path(RAG_DB_FILE).parent.mkdir(parents=True, exist_ok=True)
     pdf_files = sorted(PDF_DIR.glob("*.pdf")) if PDF_DIR.exists() else []
     if not pdf_files:
@@ -54,7 +77,8 @@ def ingest_pdfs() -> None:
 
     ######################### Step 2: Create vector store ##################
     embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
-    vector_store = SQLiteVec(table=RAG_TABLE, connection=None, embedding=embeddings, db_file=RAG_DB_FILE)
+    connection = SQLiteVec.create_connection(RAG_DB_FILE)
+    vector_store = SQLiteVec(table=RAG_TABLE, connection=connection, embedding=embeddings, db_file=RAG_DB_FILE)
     splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
     total_chunks = 0
 
@@ -74,7 +98,68 @@ def ingest_pdfs() -> None:
         total_chunks += len(chunks)
         console.print(f"  [dim]{pdf_path.name}[/] -> {len(chunks)} chunks")
 
-    console.print(f"\n[green]Done:[/] {len(pdf_files)} PDFs, {total_chunks} chunks -> {Path(RAG_DB_FILE).name}")
+    ######################### Step 4: Keyword + product indexes ###########
+    indexed = build_fts_index(connection, RAG_TABLE)
+    products = build_product_index(connection, RAG_TABLE)
+
+    console.print(f"\n[green]Done:[/] {len(pdf_files)} PDFs, {total_chunks} chunks -> {Path(RAG_DB_FILE).name} "
+                  f"({indexed} in the FTS5 index, {products} products in product_chunks)")
+    if quantize:
+        _quantize(connection, quantize, dims)
+    if ivf:
+        _build_ivf(connection)
+    if vectors or (RAG_VECTORS_DIR / "manifest.json").exists():
+        _export_vectors()
+    _prune_answers(connection)
+
+
+def _quantize(conn: sqlite3.Connection, mode: str, dims: int | None) -> None:
+    index = build_quantized_index(conn, RAG_TABLE, mode, dims)
+    console.print(f"[green]Quantized index:[/] {index.name} ({index.mode}, {index.dims} dims)")
+
+
+def _build_ivf(conn: sqlite3.Connection) -> None:
+    stats = build_ivf_index(conn, RAG_TABLE).stats()
+    console.print(f"[green]IVF index:[/] {stats['vectors']} chunks in {stats['lists']} lists")
+
+
+def _export_vectors() -> None:
+    manifest = build_vector_export(Path(RAG_DB_FILE), RAG_TABLE, RAG_VECTORS_DIR)
+    console.print(f"[green]NumPy export:[/] {manifest['rows']} x {manifest['dims']} embeddings in {RAG_VECTORS_DIR}")
+
+
+def _prune_answers(conn: sqlite3.Connection) -> None:
+    if not EMBEDDING_CACHE_FILE.exists():
+        return
+    cache = SemanticAnswerCache("", EMBEDDING_CACHE_FILE)
+    try:
+        console.print(f"[green]Answer cache:[/] {cache.prune(conn, RAG_TABLE)} answers over changed chunks dropped")
+    finally:
+        cache.close()
+
+
+def reindex(quantize: str | None = None, dims: int | None = None, ivf: bool = False, vectors: bool = False) -> None:
+    """Rebuild the FTS5 index, product_chunks and optionally the vector indexes / NumPy export from the chunks already in rag.db."""
+    if not Path(RAG_DB_FILE).exists():
+        console.print("[yellow]No rag.db yet -- run a full ingestion first.[/]")
+        return
+    conn = sqlite3.connect(RAG_DB_FILE)
+    try:
+        indexed = build_fts_index(conn, RAG_TABLE)
+        products = build_product_index(conn, RAG_TABLE)
+        console.print(f"[green]Done:[/] {indexed} chunks in the FTS5 index, {products} products in product_chunks of {Path(RAG_DB_FILE).name}")
+        if quantize:
+            load_sqlite_vec(conn)
+            _quantize(conn, quantize, dims)
+        if ivf:
+            _build_ivf(conn)
+        elif IVFIndex.exists(conn, RAG_TABLE):
+            console.print(f"[green]IVF index:[/] {IVFIndex(conn, RAG_TABLE).sync()} new chunks added")
+        _prune_answers(conn)
+    finally:
+        conn.close()
+    if vectors or (RAG_VECTORS_DIR / "manifest.json").exists():
+        _export_vectors()
 
 
 ###########################################################################
@@ -82,4 +167,14 @@ def ingest_pdfs() -> None:
 ###########################################################################
 
 if __name__ == "__main__":
-    ingest_pdfs()
+    parser = argparse.ArgumentParser(description="Ingest product PDFs into rag.db")
+    parser.add_argument("--reindex", action="store_true", help="only rebuild the FTS5 keyword index and product_chunks of the existing rag.db")
+    parser.add_argument("--quantize", choices=MODES, help="also build a quantized first-pass vector index (reranked exactly at query time)")
+    parser.add_argument("--dims", type=int, help="with --quantize: keep only the first N embedding dimensions (Matryoshka truncation)")
+    parser.add_argument("--ivf", action="store_true", help="also (re)train the IVF approximate nearest-neighbour index")
+    parser.add_argument("--vectors", action="store_true", help="also export the embeddings to a memory-mapped NumPy matrix (db/rag_vectors)")
+    args = parser.parse_args()
+    if args.reindex:
+        reindex(args.quantize, args.dims, args.ivf, args.vectors)
+    else:
+        ingest_pdfs(args.quantize, args.dims, args.ivf, args.vectors)
@@ -0,0 +1,278 @@
+"""Bulk loader: build sales.db from the Kaggle "Global Fashion Retail Sales" CSVs.
+
+Streams every CSV in chunks through pandas, validates each chunk column-wise
+against models.py (types, NOT NULL, CHECK constraints, known currency), converts
+amounts to USD and inserts it with executemany inside one transaction per chunk.
+The load runs with journal_mode=OFF / synchronous=OFF and without indexes;
+indexes, ANALYZE and rollups are built once at the end.
+
+Progress is committed with every chunk in load_progress, so an interrupted load
+(Ctrl-C, an exception) resumes at the last completed chunk. With the journal off
+a hard crash (kill -9, power loss) mid-chunk can corrupt the file, rerun with
+--fresh in that case.
+
+Run:  uv run python src/load_sales.py --csv-dir data/csv
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import argparse
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+import pandas as pd
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy import CheckConstraint, Float, Integer
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateTable
+from sqlmodel import SQLModel
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+import models  # noqa: F401  (registers the tables on SQLModel.metadata)
+from index_advisor import build_indexes
+from migrations import FX_RATES, load_fx_rates
+from rollups import build_rollups
+from sql_pool import DB_PATH
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+CSV_DIR = DB_PATH.parent.parent / "data" / "csv"
+CHUNK_ROWS = 100_000
+LOAD_PROGRESS = "load_progress"
+
+# Parents before children, file names as published on Kaggle
+CSV_FILES = {
+    "products": "products.csv",
+    "stores": "stores.csv",
+    "customers": "customers.csv",
+    "employees": "employees.csv",
+    "discounts": "discounts.csv",
+    "transactions": "transactions.csv",
+}
+
+# Vectorized counterpart of every CHECK constraint in models.py: True = row passes
+CHECK_RULES = {
+    "ck_products_cost": lambda df: df["production_cost"] >= 0,
+    "ck_transactions_quantity": lambda df: df["quantity"] > 0,
+}
+
+LOAD_PRAGMAS = (
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA locking_mode = EXCLUSIVE",
+)
+
+console = Console()
+
+
+###########################################################################
+##                          VALIDATION
+###########################################################################
+
+
+def csv_column_name(header: str) -> str:
+    """'Invoice ID' -> 'invoice_id', 'Date Of Birth' -> 'date_of_birth', 'ZIP Code' -> 'zip_code'."""
+    return re.sub(r"[^0-9a-z]+", "_", header.strip().lower()).strip("_")
+
+
+def load_columns(table) -> list:
+    """Columns the loader writes: everything but generated columns (and the USD amounts, derived per chunk)."""
+    return [column for column in table.columns if column.computed is None]
+
+
+def check_constraint_names(table) -> set[str]:
+    return {constraint.name for constraint in table.constraints if isinstance(constraint, CheckConstraint)}
+
+
+def prepare_chunk(table, chunk: pd.DataFrame, first_row: int) -> tuple[pd.DataFrame, dict[str, int]]:
+    """Type, validate and complete one CSV chunk. Returns (valid rows, rejected counts per reason)."""
+    chunk = chunk.rename(columns=csv_column_name)
+    pk = table.primary_key.columns[0].name
+    if pk not in chunk.columns:
+        # Surrogate keys are the 1-based CSV row number, so a replayed chunk gets the same ids
+        chunk[pk] = range(first_row + 1, first_row + len(chunk) + 1)
+    if table.name == "transactions":
+        rates = chunk["currency"].map(FX_RATES)
+        chunk["line_total_usd"] = pd.to_numeric(chunk["line_total"], errors="coerce") * rates
+        chunk["invoice_total_usd"] = pd.to_numeric(chunk["invoice_total"], errors="coerce") * rates
+
+    rejected = pd.Series(False, index=chunk.index)
+    reasons = {}
+
+    def reject(reason: str, mask: pd.Series) -> None:
+        nonlocal rejected
+        mask = mask.fillna(False).astype(bool) & ~rejected
+        if mask.any():
+            reasons[reason] = int(mask.sum())
+            rejected |= mask
+
+    columns = {}
+    for column in load_columns(table):
+        raw = chunk[column.name] if column.name in chunk.columns else pd.Series(None, index=chunk.index, dtype=object)
+        if not isinstance(column.type, (Integer, Float)):
+            values = raw.astype("string")
+        else:
+            try:
+                values = raw.astype("float64")   # C fast path, fails on the first non-numeric cell
+            except (TypeError, ValueError):
+                values = pd.to_numeric(raw, errors="coerce")
+            reject(f"{column.name}: not a number", values.isna() & raw.notna())
+            if isinstance(column.type, Integer):
+                reject(f"{column.name}: not an integer", values.notna() & (values % 1 != 0))
+                values = values.round().astype("Int64")
+        if not column.nullable:
+            reject(f"{column.name}: NULL", values.isna())
+        columns[column.name] = values
+    frame = pd.DataFrame(columns)
+
+    for name in sorted(check_constraint_names(table)):
+        reject(name, ~CHECK_RULES[name](frame))
+    if table.name == "transactions":
+        reject("currency: no fx rate", ~frame["currency"].isin(list(FX_RATES)))
+
+    frame = frame[~rejected].astype(object)
+    return frame.where(frame.notna(), None), reasons
+
+
+###########################################################################
+##                            LOADER
+###########################################################################
+
+
+def _open(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _create_schema(conn: sqlite3.Connection) -> None:
+    """Tables only: indexes are created after the load. A compact-layout transactions view counts as existing."""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing:
+            conn.execute(str(CreateTable(table).compile(dialect=sqlite_dialect.dialect())))
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LOAD_PROGRESS} (
+            table_name TEXT PRIMARY KEY, chunks_done INTEGER, rows_read INTEGER,
+            rows_loaded INTEGER, rows_rejected INTEGER, finished INTEGER, seconds REAL
+        )
+    """)
+    conn.execute("BEGIN")
+    load_fx_rates(conn)
+    conn.execute("COMMIT")
+
+
+def load_table(conn: sqlite3.Connection, table, csv_path: Path, chunk_rows: int = CHUNK_ROWS) -> dict:
+    """Stream one CSV into its table, resuming after the last committed chunk."""
+    state = conn.execute(
+        f"SELECT chunks_done, rows_read, rows_loaded, rows_rejected, finished, seconds FROM {LOAD_PROGRESS} WHERE table_name = ?",
+        (table.name,),
+    ).fetchone() or (0, 0, 0, 0, 0, 0.0)
+    chunks_done, rows_read, rows_loaded, rows_rejected, finished, seconds = state
+    report = {"table": table.name, "rows": rows_loaded, "rejected": rows_rejected, "seconds": seconds, "reasons": {}, "resumed": chunks_done > 0}
+    if finished:
+        return report
+
+    missing = sorted(check_constraint_names(table) - CHECK_RULES.keys())
+    if missing:
+        raise ValueError(f"no vectorized rule for CHECK constraints {missing}")
+    columns = [column.name for column in load_columns(table)]
+    insert = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    delete = f"DELETE FROM {table.name} WHERE {table.primary_key.columns[0].name} = ?"
+
+    reader = pd.read_csv(
+        csv_path, dtype=str, keep_default_na=False, na_values=[""], skipinitialspace=True,
+        chunksize=chunk_rows, skiprows=range(1, rows_read + 1),
+    )
+    # The first chunk of every run may have been interrupted before its progress row was committed
+    # (journal_mode OFF keeps partial inserts), including chunk 0 of a first run
+    replay = True
+    tick = time.perf_counter()
+    for chunk in reader:
+        frame, reasons = prepare_chunk(table, chunk, rows_read)
+        rows = list(frame[columns].itertuples(index=False, name=None))
+        conn.execute("BEGIN")
+        if replay:
+            pk_index = columns.index(table.primary_key.columns[0].name)
+            conn.executemany(delete, [(row[pk_index],) for row in rows])
+            replay = False
+        conn.executemany(insert, rows)
+        chunks_done, rows_read = chunks_done + 1, rows_read + len(chunk)
+        rows_loaded, rows_rejected = rows_loaded + len(rows), rows_rejected + len(chunk) - len(rows)
+        seconds, tick = seconds + time.perf_counter() - tick, time.perf_counter()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {LOAD_PROGRESS} VALUES (?, ?, ?, ?, ?, 0, ?)",
+            (table.name, chunks_done, rows_read, rows_loaded, rows_rejected, seconds),
+        )
+        conn.execute("COMMIT")
+        for reason, count in reasons.items():
+            report["reasons"][reason] = report["reasons"].get(reason, 0) + count
+        console.print(f"  [dim]{table.name} chunk {chunks_done}: {rows_loaded:,} rows, {rows_loaded / seconds:,.0f} rows/s[/]")
+
+    conn.execute(f"UPDATE {LOAD_PROGRESS} SET finished = 1 WHERE table_name = ?", (table.name,))
+    report.update(rows=rows_loaded, rejected=rows_rejected, seconds=seconds)
+    return report
+
+
+def load_sales(csv_dir: Path = CSV_DIR, db_path: Path = DB_PATH, chunk_rows: int = CHUNK_ROWS, fresh: bool = False) -> list[dict]:
+    """Load every CSV into db_path, then build indexes and rollups. Returns one report per table."""
+    db_path = Path(db_path)
+    if fresh and db_path.exists():
+        db_path.unlink()
+    conn = _open(db_path)
+    try:
+        has_progress = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (LOAD_PROGRESS,)).fetchone()
+        if not has_progress and conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table'").fetchone():
+            raise FileExistsError(f"{db_path} was not created by this loader, use --fresh to replace it")
+        _create_schema(conn)
+        tables = {table.name: table for table in SQLModel.metadata.sorted_tables}
+        reports = [load_table(conn, tables[name], Path(csv_dir) / file_name, chunk_rows) for name, file_name in CSV_FILES.items()]
+        conn.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        conn.close()
+    build_indexes(db_path)
+    build_rollups(db_path)
+    return reports
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load the Kaggle fashion retail CSVs into sales.db")
+    parser.add_argument("--csv-dir", type=Path, default=CSV_DIR, help=f"directory with {', '.join(CSV_FILES.values())}")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help="target database")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows per chunk / transaction")
+    parser.add_argument("--fresh", action="store_true", help="delete the target database first instead of resuming")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    reports = load_sales(args.csv_dir, args.db, args.chunk_rows, args.fresh)
+
+    table = Table(title=f"Loaded {args.db.name}")
+    for column in ("Table", "Rows", "Rejected", "Seconds", "Rows/s"):
+        table.add_column(column, justify="left" if column == "Table" else "right")
+    for report in reports:
+        rate = report["rows"] / report["seconds"] if report["seconds"] else 0
+        name = report["table"] + (" (resumed)" if report["resumed"] else "")
+        table.add_row(name, f"{report['rows']:,}", f"{report['rejected']:,}", f"{report['seconds']:.2f}", f"{rate:,.0f}")
+    console.print(table)
+    for report in reports:
+        for reason, count in report["reasons"].items():
+            console.print(f"[yellow]{report['table']}: rejected {count:,} rows ({reason})[/]")
+    console.print(f"[green]Done in {time.perf_counter() - started:.1f}s[/] (load, indexes, rollups)")
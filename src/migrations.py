@@ -0,0 +1,204 @@
+"""Schema migrations for an existing sales.db: bring its tables up to date with models.py.
+
+Creates missing tables (fx_rates), adds missing columns, backfills the ones
+derived at load time (USD amounts) and re-creates model indexes whose column
+list changed. Generated columns (date buckets on transactions, age / age band
+on customers) are added as VIRTUAL, the only kind SQLite's ALTER TABLE can
+add; their indexes store the computed values, so filters and GROUP BY on them
+are still served from the index.
+
+Run:  uv run python src/migrations.py
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import sqlite3
+import time
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy import create_engine
+from sqlmodel import SQLModel
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+import models  # noqa: F401  (registers the tables on SQLModel.metadata)
+from compact_layout import is_compact
+from index_advisor import build_indexes
+from sql_pool import DB_PATH
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+# 2024 average reference rates, USD per one unit of currency
+FX_RATES = {"USD": 1.0, "EUR": 1.0824, "GBP": 1.2781, "CNY": 0.1389}
+FX_SOURCE = "2024 annual average"
+
+MONTHLY_TREND_BEFORE = (
+    "SELECT SUBSTR(date, 1, 7) AS month, SUM(line_total) AS revenue FROM transactions "
+    "WHERE transaction_type = 'Sale' GROUP BY month ORDER BY month"
+)
+MONTHLY_TREND_AFTER = (
+    "SELECT sale_month, SUM(line_total) AS revenue FROM transactions "
+    "WHERE transaction_type = 'Sale' GROUP BY sale_month ORDER BY sale_month"
+)
+COUNTRY_RANKING_USD = (
+    "SELECT s.country, SUM(t.line_total_usd) AS revenue_usd FROM transactions t "
+    "JOIN stores s ON t.store_id = s.store_id WHERE t.transaction_type = 'Sale' "
+    "GROUP BY s.country ORDER BY revenue_usd DESC"
+)
+TIMING_RUNS = 5
+
+console = Console()
+
+
+###########################################################################
+##                          MIGRATIONS
+###########################################################################
+
+
+def existing_columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+
+
+def add_missing_columns(db_path: Path = DB_PATH) -> list[tuple[str, str]]:
+    """Add nullable model columns missing from existing tables (generated ones as VIRTUAL). Returns the (table, column) pairs added."""
+    conn = sqlite3.connect(str(db_path))
+    added = []
+    try:
+        for table in SQLModel.metadata.sorted_tables:
+            present = existing_columns(conn, table.name)
+            if not present:
+                continue  # a missing table is created whole by create_missing_tables()
+            for column in table.columns:
+                if column.name in present or not column.nullable:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type}"
+                if column.computed is not None:
+                    ddl += f" GENERATED ALWAYS AS ({column.computed.sqltext}) VIRTUAL"
+                conn.execute(ddl)
+                added.append((table.name, column.name))
+        conn.commit()
+    finally:
+        conn.close()
+    return added
+
+
+def create_missing_tables(db_path: Path = DB_PATH) -> list[str]:
+    engine = create_engine(f"sqlite:///{db_path}")
+    with engine.begin() as connection:
+        existing = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = [table for table in SQLModel.metadata.sorted_tables if table.name not in existing]
+        SQLModel.metadata.create_all(connection, tables=missing)
+    engine.dispose()
+    return [table.name for table in missing]
+
+
+def load_fx_rates(conn: sqlite3.Connection, rates: dict[str, float] = FX_RATES, source: str = FX_SOURCE) -> None:
+    conn.executemany(
+        "INSERT INTO fx_rates (currency, usd_rate, source) VALUES (?, ?, ?) "
+        "ON CONFLICT(currency) DO UPDATE SET usd_rate = excluded.usd_rate, source = excluded.source",
+        [(currency, rate, source) for currency, rate in rates.items()],
+    )
+
+
+def backfill_usd(db_path: Path = DB_PATH, only_missing: bool = True) -> int:
+    """Convert line_total / invoice_total to USD in one set-based UPDATE. Returns the rows updated."""
+    conn = sqlite3.connect(str(db_path))
+    try:
+        load_fx_rates(conn)
+        missing = conn.execute("SELECT DISTINCT currency FROM transactions WHERE currency NOT IN (SELECT currency FROM fx_rates)").fetchall()
+        if missing:
+            raise ValueError(f"no fx_rates entry for currencies {[row[0] for row in missing]}")
+        cursor = conn.execute(f"""
+            UPDATE transactions
+            SET line_total_usd = transactions.line_total * fx.usd_rate,
+                invoice_total_usd = transactions.invoice_total * fx.usd_rate
+            FROM fx_rates AS fx
+            WHERE fx.currency = transactions.currency
+            {"AND transactions.line_total_usd IS NULL" if only_missing else ""}
+        """)
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+def sync_changed_indexes(db_path: Path = DB_PATH) -> list[str]:
+    """Drop model indexes whose columns in the database differ from models.py (build_indexes re-creates them)."""
+    conn = sqlite3.connect(str(db_path))
+    dropped = []
+    try:
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                current = [row[2] for row in conn.execute(f"PRAGMA index_info({index.name})")]
+                if current and current != [column.name for column in index.columns]:
+                    conn.execute(f"DROP INDEX {index.name}")
+                    dropped.append(index.name)
+        conn.commit()
+    finally:
+        conn.close()
+    return dropped
+
+
+def migrate(db_path: Path = DB_PATH) -> dict[str, list]:
+    """Bring sales.db up to models.py: tables, columns, USD backfill, then indexes."""
+    conn = sqlite3.connect(str(db_path))
+    try:
+        if is_compact(conn):
+            raise RuntimeError(f"{db_path} uses the compact layout, run compact_layout.py --expand before migrating")
+    finally:
+        conn.close()
+    report = {"tables": create_missing_tables(db_path), "columns": add_missing_columns(db_path)}
+    report["usd_rows"] = [backfill_usd(db_path)]
+    report["rebuilt_indexes"] = sync_changed_indexes(db_path)
+    report["indexes"] = build_indexes(db_path)
+    return report
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+
+def _plan_and_time(conn: sqlite3.Connection, sql: str) -> tuple[str, float]:
+    plan = " / ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+    timings = []
+    for _ in range(TIMING_RUNS):
+        started = time.perf_counter()
+        conn.execute(sql).fetchall()
+        timings.append(time.perf_counter() - started)
+    return plan, sorted(timings)[len(timings) // 2] * 1000
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(str(DB_PATH))
+    before_plan, before_ms = _plan_and_time(conn, MONTHLY_TREND_BEFORE)
+    conn.close()
+
+    report = migrate()
+    console.print(f"[green]Created tables[/] {', '.join(report['tables']) or '-'}")
+    console.print(f"[green]Added columns[/] {', '.join(f'{t}.{c}' for t, c in report['columns']) or '-'}")
+    console.print(f"[green]Converted {report['usd_rows'][0]:,} transaction lines to USD[/]")
+    console.print(f"[green]Created indexes[/] {', '.join(report['indexes']) or '-'} "
+                  f"(re-created with new columns: {', '.join(report['rebuilt_indexes']) or '-'})")
+
+    conn = sqlite3.connect(str(DB_PATH))
+    after_plan, after_ms = _plan_and_time(conn, MONTHLY_TREND_AFTER)
+    usd_plan, usd_ms = _plan_and_time(conn, COUNTRY_RANKING_USD)
+    conn.close()
+
+    table = Table(title="Time-series and cross-country queries")
+    for column in ("Query", "Plan", "ms"):
+        table.add_column(column, justify="right" if column == "ms" else "left")
+    table.add_row("monthly, SUBSTR(date, 1, 7) (before)", before_plan, f"{before_ms:.1f}")
+    table.add_row("monthly, sale_month", after_plan, f"{after_ms:.1f}")
+    table.add_row("country ranking, line_total_usd", usd_plan, f"{usd_ms:.1f}")
+    console.print(table)
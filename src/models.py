@@ -4,7 +4,14 @@
 
 from typing import Optional
 from sqlmodel import SQLModel, Field
-from sqlalchemy import CheckConstraint
+from sqlalchemy import CheckConstraint, Column, Computed, Index, Integer, String
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+AGE_REFERENCE_DATE = "2024-12-31"   # customers.age is the age on this date (end of the sales data)
 
 
 ###########################################################################
@@ -51,12 +58,23 @@ class CustomerDB(SQLModel, table=True):
     gender: Optional[str] = None
     date_of_birth: Optional[str] = None
     job_title: Optional[str] = None
+    # Generated columns: STORED on a fresh create_all, added as VIRTUAL to existing databases by migrations.py
+    age: Optional[int] = Field(default=None, sa_column=Column(Integer, Computed(
+        f"CAST(SUBSTR('{AGE_REFERENCE_DATE}', 1, 4) AS INTEGER) - CAST(SUBSTR(date_of_birth, 1, 4) AS INTEGER)"
+        f" - (SUBSTR(date_of_birth, 6, 5) > SUBSTR('{AGE_REFERENCE_DATE}', 6, 5))",
+        persisted=True,
+    ), index=True))
+    age_band: Optional[str] = Field(default=None, sa_column=Column(String, Computed(
+        "CASE WHEN age IS NULL THEN NULL WHEN age < 25 THEN '18-24' WHEN age < 35 THEN '25-34' "
+        "WHEN age < 45 THEN '35-44' WHEN age < 55 THEN '45-54' WHEN age < 65 THEN '55-64' ELSE '65+' END",
+        persisted=True,
+    ), index=True))
 
 
 class EmployeeDB(SQLModel, table=True):
     __tablename__ = "employees"
     employee_id: int = Field(primary_key=True)
-    store_id: int = Field(foreign_key="stores.store_id")
+    store_id: int = Field(foreign_key="stores.store_id", index=True)
     name: str
     position: str
 
@@ -74,27 +92,46 @@ class DiscountDB(SQLModel, table=True):
 
 class TransactionDB(SQLModel, table=True):
     __tablename__ = "transactions"
-    __table_args__ = (CheckConstraint("quantity > 0", name="ck_transactions_quantity"),)
+    __table_args__ = (
+        CheckConstraint("quantity > 0", name="ck_transactions_quantity"),
+        # Covering indexes for the agent's hot shape: Sale lines aggregated per product / store / month
+        Index("ix_transactions_type_product_cover", "transaction_type", "product_id", "line_total", "quantity", "line_total_usd"),
+        Index("ix_transactions_type_store_cover", "transaction_type", "store_id", "line_total", "quantity", "line_total_usd"),
+        Index("ix_transactions_type_month_cover", "transaction_type", "sale_month", "line_total", "quantity", "line_total_usd"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
-    invoice_id: str
+    invoice_id: str = Field(index=True)
     line: int
-    customer_id: int = Field(foreign_key="customers.customer_id")
-    product_id: int = Field(foreign_key="products.product_id")
+    customer_id: int = Field(foreign_key="customers.customer_id", index=True)
+    product_id: int = Field(foreign_key="products.product_id", index=True)
     size: Optional[str] = None
     color: Optional[str] = None
     unit_price: float
     quantity: int
-    date: str
+    date: str = Field(index=True)
     discount: float
     line_total: float
-    store_id: int = Field(foreign_key="stores.store_id")
-    employee_id: int = Field(foreign_key="employees.employee_id")
+    store_id: int = Field(foreign_key="stores.store_id", index=True)
+    employee_id: int = Field(foreign_key="employees.employee_id", index=True)
     currency: str
     currency_symbol: str
     sku: str
     transaction_type: str
     payment_method: str
     invoice_total: float
-
-
-
+    # Converted with fx_rates at load time (migrations.py backfills existing databases)
+    line_total_usd: Optional[float] = None
+    invoice_total_usd: Optional[float] = None
+    # Generated columns: STORED on a fresh create_all, added as VIRTUAL to existing databases by migrations.py
+    sale_day: Optional[str] = Field(default=None, sa_column=Column(String, Computed("SUBSTR(date, 1, 10)", persisted=True), index=True))
+    sale_month: Optional[str] = Field(default=None, sa_column=Column(String, Computed("SUBSTR(date, 1, 7)", persisted=True), index=True))
+    sale_week: Optional[str] = Field(default=None, sa_column=Column(String, Computed("strftime('%Y-W%W', date)", persisted=True), index=True))
+    hour: Optional[int] = Field(default=None, sa_column=Column(Integer, Computed("CAST(SUBSTR(date, 12, 2) AS INTEGER)", persisted=True), index=True))
+
+
+class FxRateDB(SQLModel, table=True):
+    __tablename__ = "fx_rates"
+    __table_args__ = (CheckConstraint("usd_rate > 0", name="ck_fx_rates_rate"),)
+    currency: str = Field(primary_key=True)
+    usd_rate: float     # USD per one unit of the currency
+    source: str
@@ -0,0 +1,661 @@
+"""Optional partitioned copy of transactions with pruning and scatter-gather aggregation.
+
+transactions is split into one SQLite file per month, quarter, year or store
+country under db/partitions/ (same schema and indexes as models.py, dimension
+tables come from sales.db, ATTACHed read-only as "dim"). For an aggregate query
+over transactions:
+
+  1. prune: WHERE conjuncts on date / sale_day / sale_month / SUBSTR(date, ...),
+     the store country and store_id are checked against every partition's day
+     range, countries and stores, disjoint partitions are skipped
+  2. scatter: each remaining partition runs a partial aggregate (SUM, COUNT,
+     MIN, MAX, and AVG as SUM + COUNT) grouped by the query's keys, in a thread pool
+  3. gather: the partial rows are merged in an in-memory table by a second
+     GROUP BY, then HAVING, ORDER BY and LIMIT run on the merged groups, so a
+     top-k is always taken over complete totals
+
+Everything else (non-aggregates, COUNT(DISTINCT), stale partitions) runs on
+sales.db, which stays the source of truth.
+
+Build / refresh after every data load:  uv run python src/partitions.py --build --by month
+Benchmark against SQLite per scheme:    uv run python src/partitions.py --bench
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import argparse
+import json
+import math
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from models import TransactionDB
+from sql_cache import db_signature
+from sql_pool import DB_PATH, SQL_CACHE_SIZE_KB, SQL_MMAP_SIZE, get_pool
+from sql_shapes import AggregateQuery, Node, Unsupported, parse_aggregate, to_sql
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+PARTITION_ENGINE = False                 # answer aggregate queries from the partitions (opt-in)
+PARTITION_DIR = DB_PATH.parent / "partitions"
+PARTITION_WORKERS = 8
+SCHEMES = {                              # partition key expression over transactions t (stores s joined)
+    "month": "SUBSTR(t.date, 1, 7)",
+    "quarter": "SUBSTR(t.date, 1, 4) || '-Q' || ((CAST(SUBSTR(t.date, 6, 2) AS INTEGER) + 2) / 3)",
+    "year": "SUBSTR(t.date, 1, 4)",
+    "country": "s.country",
+}
+DATE_COLUMNS = {"date": None, "sale_day": 10, "sale_month": 7}   # column -> length of the date prefix it holds
+MERGE_FUNCTIONS = {"sum": "SUM", "total": "TOTAL", "min": "MIN", "max": "MAX", "count": "SUM"}
+BENCH_SCHEMES = ("year", "quarter", "month", "country")
+BENCH_QUERIES = {
+    "revenue by month": "SELECT sale_month, SUM(line_total) AS revenue FROM transactions WHERE transaction_type = 'Sale' GROUP BY sale_month ORDER BY sale_month",
+    "top 10 products": (
+        "SELECT p.description_en, SUM(t.quantity) AS units, AVG(t.unit_price) AS avg_price FROM transactions t "
+        "JOIN products p ON t.product_id = p.product_id WHERE t.transaction_type = 'Sale' "
+        "GROUP BY p.product_id ORDER BY units DESC LIMIT 10"
+    ),
+    "one month by country": (
+        "SELECT s.country, SUM(t.line_total_usd) AS revenue_usd, COUNT(*) AS line_count FROM transactions t "
+        "JOIN stores s ON t.store_id = s.store_id WHERE t.sale_day BETWEEN '2024-03-01' AND '2024-03-31' "
+        "GROUP BY s.country ORDER BY revenue_usd DESC"
+    ),
+    "one country by category": (
+        "SELECT p.category, SUM(t.line_total) AS revenue, MAX(t.unit_price) AS max_price FROM transactions t "
+        "JOIN stores s ON t.store_id = s.store_id JOIN products p ON t.product_id = p.product_id "
+        "WHERE s.country = 'Germany' AND t.transaction_type = 'Sale' GROUP BY p.category ORDER BY revenue DESC"
+    ),
+    "top 20 customers": (
+        "SELECT customer_id, SUM(line_total) AS spent FROM transactions WHERE transaction_type = 'Sale' "
+        "GROUP BY customer_id ORDER BY spent DESC LIMIT 20"
+    ),
+}
+BENCH_RUNS = 5
+
+console = Console()
+
+
+###########################################################################
+##                             BUILD
+###########################################################################
+
+
+def _fingerprint(conn: sqlite3.Connection) -> list:
+    # The measure totals catch in-place UPDATEs, which keep the row count and max id
+    rows, max_id, line_total, quantity = conn.execute(
+        "SELECT COUNT(*), COALESCE(MAX(id), 0), TOTAL(line_total), TOTAL(quantity) FROM transactions"
+    ).fetchone()
+    columns = len(conn.execute("PRAGMA table_xinfo(transactions)").fetchall())
+    return [rows, max_id, columns, line_total, quantity]
+
+
+def _build_partition(db_path: Path, path: Path, by: str, key: str, columns: list[str]) -> dict:
+    dialect = sqlite_dialect.dialect()
+    table = TransactionDB.__table__
+    conn = sqlite3.connect(f"file:{path.as_posix()}", uri=True, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("ATTACH DATABASE ? AS src", (f"file:{Path(db_path).as_posix()}?mode=ro",))
+        conn.execute(str(CreateTable(table).compile(dialect=dialect)))
+        column_list = ", ".join(columns)
+        conn.execute(f"""
+            INSERT INTO transactions ({column_list})
+            SELECT {", ".join(f"t.{column}" for column in columns)}
+            FROM src.transactions t JOIN src.stores s ON t.store_id = s.store_id
+            WHERE {SCHEMES[by]} = ?
+            ORDER BY t.id
+        """, (key,))
+        for index in table.indexes:
+            conn.execute(str(CreateIndex(index).compile(dialect=dialect)))
+        conn.execute("ANALYZE main")
+        rows, min_day, max_day = conn.execute("SELECT COUNT(*), MIN(SUBSTR(date, 1, 10)), MAX(SUBSTR(date, 1, 10)) FROM transactions").fetchone()
+        stores = [row[0] for row in conn.execute("SELECT DISTINCT store_id FROM transactions ORDER BY store_id")]
+        countries = [row[0] for row in conn.execute(
+            "SELECT DISTINCT s.country FROM transactions t JOIN src.stores s ON t.store_id = s.store_id ORDER BY 1"
+        )]
+    finally:
+        conn.close()
+    return {"key": key, "file": path.name, "rows": rows, "min_day": min_day, "max_day": max_day, "countries": countries, "stores": stores}
+
+
+def build_partitions(by: str = "month", db_path: Path = DB_PATH, out_dir: Path = PARTITION_DIR) -> list[dict]:
+    """Split transactions into one file per partition key (built in parallel). Returns the partition manifest entries."""
+    staging = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    conn = sqlite3.connect(str(db_path))
+    try:
+        fingerprint = _fingerprint(conn)
+        keys = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT {SCHEMES[by]} FROM transactions t JOIN stores s ON t.store_id = s.store_id ORDER BY 1"
+        )]
+    finally:
+        conn.close()
+    columns = [column.name for column in TransactionDB.__table__.columns if column.computed is None]
+    slugs = {key: "".join(ch if ch.isalnum() else "_" for ch in str(key)) for key in keys}
+
+    with ThreadPoolExecutor(PARTITION_WORKERS) as pool:
+        partitions = list(pool.map(
+            lambda key: _build_partition(db_path, staging / f"transactions_{slugs[key]}.db", by, key, columns), keys
+        ))
+
+    manifest = {"by": by, "fingerprint": fingerprint, "partitions": partitions}
+    (staging / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    shutil.rmtree(out_dir, ignore_errors=True)
+    staging.rename(out_dir)
+    return partitions
+
+
+###########################################################################
+##                            PRUNING
+###########################################################################
+
+
+def _integer(value) -> int | None:
+    """The integer a literal compares equal to in an INTEGER column, None when that is not clear."""
+    if isinstance(value, str):
+        try:
+            value = float(value) if value.strip() == value and value else None
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and math.isfinite(value) and value == int(value):
+        return int(value)
+    return None
+
+
+class _Pruner:
+    """Date range and store / country sets implied by the top-level AND conjuncts of a WHERE clause."""
+
+    def __init__(self, query: AggregateQuery):
+        self.tables = {query.alias: query.table, **{join.alias: join.table for join in query.joins}}
+        self.low: str | None = None        # date prefixes: '2024-03' covers the whole month
+        self.high: str | None = None
+        self.countries: set[str] | None = None
+        self.stores: set[int] | None = None
+        conjuncts, pending = [], [query.where] if query.where is not None else []
+        while pending:
+            node = pending.pop()
+            if node.kind == "op" and node.value == "and":
+                pending += node.args
+            else:
+                conjuncts.append(node)
+        for node in conjuncts:
+            self.constrain(node)
+
+    def _owner(self, node: Node) -> str | None:
+        """Table a column reference belongs to, if it can be told without the schema."""
+        qualifier, name = node.value
+        if qualifier is not None:
+            return self.tables.get(qualifier)
+        if name in DATE_COLUMNS or (name == "store_id" and "stores" not in self.tables.values()):
+            return "transactions"
+        if name == "country" and "customers" not in self.tables.values():
+            return "stores"
+        return None
+
+    def _target(self, node: Node) -> tuple[str, int | None] | None:
+        """('date', prefix length) / ('country', None) / ('store', None) for a prunable expression."""
+        if node.kind == "col":
+            owner, name = self._owner(node), node.value[1]
+            if owner == "transactions" and name in DATE_COLUMNS:
+                return "date", DATE_COLUMNS[name]
+            if owner == "transactions" and name == "store_id":
+                return "store", None
+            if owner == "stores" and name == "country":
+                return "country", None
+        if node.kind == "func" and node.value == "substr" and len(node.args) == 3:
+            inner, start, length = node.args
+            target = self._target(inner)
+            if target and target[0] == "date" and start == Node("num", 1) and length.kind == "num":
+                return "date", length.value
+        return None
+
+    def _restrict(self, target: tuple[str, int | None], op: str, values: list) -> None:
+        kind = target[0]
+        if kind == "store":
+            # store_id has INTEGER affinity: SQLite matches '5' and 5.0 to 5, anything else is not pruned on
+            values = [_integer(value) for value in values]
+            if None in values:
+                return
+        if kind == "date":
+            values = [str(value)[:10] for value in values]
+            if op in ("=", ">", ">=", "between", "in"):
+                low = min(values)
+                self.low = low if self.low is None else max(self.low, low)
+            if op in ("=", "<", "<=", "between", "in"):
+                high = max(values)
+                self.high = high if self.high is None else min(self.high, high)
+        elif op in ("=", "in"):
+            found = set(values)
+            if kind == "country":
+                self.countries = found if self.countries is None else self.countries & found
+            else:
+                self.stores = found if self.stores is None else self.stores & found
+
+    def constrain(self, node: Node) -> None:
+        literal = {"str", "num"}
+        if node.kind == "op" and node.value in ("=", "<", "<=", ">", ">="):
+            left, right = node.args
+            op = node.value
+            if right.kind not in literal:
+                left, right = right, left
+                op = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}.get(op, op)
+            target = self._target(left)
+            if target and right.kind in literal:
+                self._restrict(target, op, [right.value])
+        elif node.kind == "between" and not node.value:
+            target = self._target(node.args[0])
+            if target and all(arg.kind in literal for arg in node.args[1:]):
+                self._restrict(target, "between", [arg.value for arg in node.args[1:]])
+        elif node.kind == "in" and not node.value:
+            target = self._target(node.args[0])
+            if target and all(arg.kind in literal for arg in node.args[1:]):
+                self._restrict(target, "in", [arg.value for arg in node.args[1:]])
+        elif node.kind == "like" and not node.value and node.args[1].kind == "str":
+            target = self._target(node.args[0])
+            prefix = node.args[1].value.split("%")[0].split("_")[0]
+            if target and target[0] == "date" and prefix:
+                self._restrict(target, "between", [prefix, prefix])
+
+    def keeps(self, partition: dict) -> bool:
+        if not partition["rows"]:
+            return False
+        if self.low is not None and partition["max_day"][:len(self.low)] < self.low:
+            return False
+        if self.high is not None and partition["min_day"][:len(self.high)] > self.high:
+            return False
+        if self.countries is not None and not self.countries & set(partition["countries"]):
+            return False
+        if self.stores is not None and not self.stores & set(partition["stores"]):
+            return False
+        return True
+
+
+###########################################################################
+##                        SCATTER / GATHER
+###########################################################################
+
+
+def _strip(node: Node) -> Node:
+    """The node with column qualifiers removed, for matching t.store_id against store_id."""
+    if node.kind == "col":
+        return Node("col", (None, node.value[1]))
+    return node._replace(args=tuple(_strip(arg) for arg in node.args))
+
+
+class ScatterPlan:
+    """Partial query run on every partition and the final query merging their rows."""
+
+    def __init__(self, query: AggregateQuery):
+        if query.table != "transactions":
+            raise Unsupported("only queries over transactions are partitioned")
+        self.query = query
+        self.keys = list(query.group_by)
+        self.tables = {query.alias: query.table, **{join.alias: join.table for join in query.joins}}
+        self.join_parents: dict[str, tuple[str, str]] = {}    # joined alias -> (alias, column) it is looked up by
+        for join in query.joins:
+            on = join.on
+            if on.kind == "op" and on.value == "=" and all(arg.kind == "col" for arg in on.args):
+                left, right = (self._resolve(arg) for arg in on.args)
+                if right == (join.alias, _primary_key(join.table)):
+                    left, right = right, left
+                if left == (join.alias, _primary_key(join.table)) and right is not None:
+                    self.join_parents[join.alias] = right
+        self.partials: list[str] = []          # partial aggregate expressions, column a{i}
+        self._partial_index: dict[str, int] = {}
+
+        items = [f"{self.merge(item.expr)} AS {_alias(item.name)}" for item in query.items]
+        final = [f"SELECT {', '.join(items)} FROM partials"]
+        if self.keys:
+            final.append("GROUP BY " + ", ".join(f"g{i}" for i in range(len(self.keys))))
+        if query.having is not None:
+            final.append(f"HAVING {self.merge(query.having)}")
+        if query.order_by:
+            terms = [(str(expr.value + 1) if expr.kind == "output" else self.merge(expr)) + (" DESC" if desc else "")
+                     for expr, desc in query.order_by]
+            final.append("ORDER BY " + ", ".join(terms))
+        if query.limit is not None:
+            final.append(f"LIMIT {query.limit} OFFSET {query.offset}")
+        self.final_sql = " ".join(final)
+        self.columns = [f"g{i}" for i in range(len(self.keys))] + [f"a{i}" for i in range(len(self.partials))]
+
+        selects = [f"{to_sql(key)} AS g{i}" for i, key in enumerate(self.keys)]
+        selects += [f"{partial} AS a{i}" for i, partial in enumerate(self.partials)]
+        partial = [f"SELECT {', '.join(selects) or 'COUNT(*)'} FROM transactions AS {_alias(query.alias)}"]
+        partial += [f"JOIN {join.table} AS {_alias(join.alias)} ON {to_sql(join.on)}" for join in query.joins]
+        if query.where is not None:
+            partial.append(f"WHERE {to_sql(query.where)}")
+        if self.keys:
+            partial.append("GROUP BY " + ", ".join(str(i + 1) for i in range(len(self.keys))))
+        self.partial_sql = " ".join(partial)
+
+    def _partial(self, expression: str) -> str:
+        if expression not in self._partial_index:
+            self._partial_index[expression] = len(self.partials)
+            self.partials.append(expression)
+        return f"a{self._partial_index[expression]}"
+
+    def _resolve(self, node: Node) -> tuple[str, str] | None:
+        """(alias, column) a column reference belongs to, None when unknown or ambiguous."""
+        qualifier, name = node.value
+        if qualifier is not None:
+            return (qualifier, name) if name in _table_columns(self.tables.get(qualifier)) else None
+        owners = [alias for alias, table in self.tables.items() if name in _table_columns(table)]
+        return (owners[0], name) if len(owners) == 1 else None
+
+    def _determined(self, alias: str) -> bool:
+        """True if one row of `alias` per group is fixed: its key, or the column it was joined by, is grouped
+        (transitively, so GROUP BY t.product_id fixes the product joined on it)."""
+        grouped = {self._resolve(key) for key in self.keys if key.kind == "col"}
+        if (alias, _primary_key(self.tables[alias])) in grouped:
+            return True
+        parent = self.join_parents.get(alias)
+        if parent is None:
+            return False
+        return parent in grouped or self._determined(parent[0])
+
+    def _key(self, node: Node) -> int | None:
+        if node in self.keys:
+            return self.keys.index(node)
+        stripped = [i for i, key in enumerate(self.keys) if _strip(key) == _strip(node)]
+        return stripped[0] if len(stripped) == 1 else None
+
+    def merge(self, node: Node) -> str:
+        """SQL over the partials table computing `node` for a merged group."""
+        key = self._key(node)
+        if key is not None:
+            return f"g{key}"
+        if node.kind == "agg":
+            name, distinct = node.value
+            if distinct:
+                raise Unsupported(f"{name.upper()}(DISTINCT) does not merge across partitions")
+            arg = to_sql(node.args[0])
+            if name == "avg":
+                total, count = self._partial(f"TOTAL({arg})"), self._partial(f"COUNT({arg})")
+                return f"(SUM({total}) / NULLIF(SUM({count}), 0))"
+            partial = self._partial(f"{name.upper()}({arg})")
+            return f"COALESCE(SUM({partial}), 0)" if name == "count" else f"{MERGE_FUNCTIONS[name]}({partial})"
+        if node.kind == "col" and self.keys:
+            # Bare column: SQLite takes it from the row behind a MIN/MAX, only a grouped row key makes that one value
+            owner = self._resolve(node)
+            if owner is None or not self._determined(owner[0]):
+                raise Unsupported(f"bare column {to_sql(node)} is not determined by the GROUP BY")
+            return f"MIN({self._partial(f'MIN({to_sql(node)})')})"
+        if node.kind in ("col", "star", "output"):
+            raise Unsupported(f"{node.kind} outside GROUP BY and aggregates")
+        return self._merge_args(node)
+
+    def _merge_args(self, node: Node) -> str:
+        """Render `node` with every argument replaced by its merged SQL."""
+        merged = [self.merge(arg) for arg in node.args]
+        placeholders = tuple(Node("col", (None, f"__arg{i}")) for i in range(len(merged)))
+        sql = to_sql(node._replace(args=placeholders))
+        for i in reversed(range(len(merged))):
+            sql = sql.replace(f"__arg{i}", merged[i])
+        return sql
+
+
+def _table_columns(table: str | None) -> set[str]:
+    schema = TransactionDB.metadata.tables.get(table)
+    return set() if schema is None else {column.name for column in schema.columns}
+
+
+def _primary_key(table: str) -> str | None:
+    schema = TransactionDB.metadata.tables.get(table)
+    keys = [] if schema is None else [column.name for column in schema.primary_key.columns]
+    return keys[0] if len(keys) == 1 else None
+
+
+def _alias(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+###########################################################################
+##                             ENGINE
+###########################################################################
+
+
+class PartitionEngine:
+    """Prunes partitions for an aggregate query, fans the partial query out and merges the results."""
+
+    def __init__(self, db_path: Path = DB_PATH, data_dir: Path = PARTITION_DIR, workers: int = PARTITION_WORKERS):
+        self.db_path = Path(db_path)
+        self.data_dir = Path(data_dir)
+        self.workers = workers
+        self._manifest: dict | None = None
+        self._fresh_for = None
+        self._idle: dict[str, list[sqlite3.Connection]] = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._stats = {"answered": 0, "unsupported": 0, "stale": 0, "scanned": 0, "pruned": 0, "seconds": 0.0}
+
+    ######################### Storage ####################################
+    def is_fresh(self) -> bool:
+        """True if the partitions match sales.db (re-checked only when the db files change)."""
+        signature = db_signature(self.db_path)
+        with self._lock:
+            if signature == self._fresh_for:
+                return True
+            self._close_idle()
+            path = self.data_dir / "manifest.json"
+            if not path.exists():
+                return False
+            self._manifest = json.loads(path.read_text(encoding="utf-8"))
+            conn = sqlite3.connect(f"file:{self.db_path.as_posix()}?mode=ro", uri=True)
+            try:
+                fresh = _fingerprint(conn) == self._manifest["fingerprint"]
+            finally:
+                conn.close()
+            if fresh:
+                self._fresh_for = signature
+            return fresh
+
+    def _close_idle(self) -> None:
+        for connections in self._idle.values():
+            for conn in connections:
+                conn.close()
+        self._idle = {}
+
+    def _acquire(self, file_name: str) -> sqlite3.Connection:
+        with self._lock:
+            idle = self._idle.setdefault(file_name, [])
+            if idle:
+                return idle.pop()
+        conn = sqlite3.connect(f"file:{(self.data_dir / file_name).as_posix()}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("ATTACH DATABASE ? AS dim", (f"file:{self.db_path.as_posix()}?mode=ro",))
+        for schema in ("main", "dim"):
+            conn.execute(f"PRAGMA {schema}.mmap_size = {SQL_MMAP_SIZE}")
+            conn.execute(f"PRAGMA {schema}.cache_size = -{SQL_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _release(self, file_name: str, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._idle.setdefault(file_name, []).append(conn)
+
+    def _scan(self, file_name: str, sql: str) -> list[tuple]:
+        conn = self._acquire(file_name)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            self._release(file_name, conn)
+
+    ######################### Entry point ################################
+    def execute(self, sql: str) -> tuple[list[str], list[tuple]] | None:
+        """(columns, all result rows) for a supported aggregate query, or None to fall back to sales.db."""
+        query = parse_aggregate(sql)
+        if query is None:
+            self._stats["unsupported"] += 1
+            return None
+        try:
+            plan = ScatterPlan(query)
+        except Unsupported:
+            self._stats["unsupported"] += 1
+            return None
+        if not self.is_fresh():
+            self._stats["stale"] += 1
+            return None
+
+        started = time.perf_counter()
+        pruner = _Pruner(query)
+        files = [partition["file"] for partition in self._manifest["partitions"] if pruner.keeps(partition)]
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="partition")
+        try:
+            partial_rows = [row for rows in self._executor.map(lambda name: self._scan(name, plan.partial_sql), files) for row in rows]
+            merge = sqlite3.connect(":memory:")
+            try:
+                merge.execute(f"CREATE TABLE partials ({', '.join(plan.columns) or 'unused'})")
+                if plan.columns:
+                    merge.executemany(f"INSERT INTO partials VALUES ({', '.join('?' * len(plan.columns))})", partial_rows)
+                cursor = merge.execute(plan.final_sql)
+                columns, rows = [col[0] for col in cursor.description], cursor.fetchall()
+            finally:
+                merge.close()
+        except sqlite3.Error:
+            self._stats["unsupported"] += 1
+            return None
+
+        self._stats["answered"] += 1
+        self._stats["scanned"] += len(files)
+        self._stats["pruned"] += len(self._manifest["partitions"]) - len(files)
+        self._stats["seconds"] += time.perf_counter() - started
+        return columns, rows
+
+    def stats(self) -> dict:
+        partitions = len(self._manifest["partitions"]) if self._manifest else 0
+        return {"by": (self._manifest or {}).get("by"), "partitions": partitions, **self._stats}
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_idle()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+###########################################################################
+##                         SHARED ENGINE
+###########################################################################
+
+_engine: PartitionEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_partitions() -> PartitionEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = PartitionEngine()
+    return _engine
+
+
+def partition_stats() -> dict:
+    return get_partitions().stats()
+
+
+###########################################################################
+##                            BENCHMARK
+###########################################################################
+
+
+def _median_ms(function) -> float:
+    timings = []
+    for _ in range(BENCH_RUNS):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+
+def _same_rows(sql: str, left: list[tuple], right: list[tuple]) -> bool:
+    """Same rows in any order; with ORDER BY ... LIMIT, rows tied at the cut may differ."""
+    def normalize(rows):
+        return [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows]
+    left, right = normalize(left), normalize(right)
+    if sorted(left, key=repr) == sorted(right, key=repr):
+        return True
+    positions = [expr.value for expr, _ in parse_aggregate(sql).order_by if expr.kind == "output"]
+    return bool(positions) and [[row[i] for i in positions] for row in left] == [[row[i] for i in positions] for row in right]
+
+
+def benchmark() -> None:
+    """Every BENCH_QUERIES entry on sales.db and on each scheme in BENCH_SCHEMES (built under db/partitions.bench/)."""
+    bench_dir = PARTITION_DIR.with_name(PARTITION_DIR.name + ".bench")
+    engines = {}
+    for by in BENCH_SCHEMES:
+        count = len(build_partitions(by, out_dir=bench_dir / by))
+        engines[by] = (count, PartitionEngine(data_dir=bench_dir / by))
+
+    table = Table(title=f"Scatter-gather vs SQLite (median of {BENCH_RUNS}, ms; scanned/total partitions)")
+    table.add_column("Query")
+    table.add_column("SQLite", justify="right")
+    for by, (count, _) in engines.items():
+        table.add_column(f"{by} ({count})", justify="right")
+    with get_pool().connection() as conn:
+        for label, sql in BENCH_QUERIES.items():
+            expected = conn.execute(sql).fetchall()
+            cells = [f"{_median_ms(lambda: conn.execute(sql).fetchall()):.1f}"]
+            for by, (count, engine) in engines.items():
+                before = engine.stats()["scanned"]
+                result = engine.execute(sql)
+                if result is None:
+                    cells.append("fallback")
+                    continue
+                scanned = engine.stats()["scanned"] - before
+                mark = "" if _same_rows(sql, expected, result[1]) else " [red]DIFF[/]"
+                cells.append(f"{_median_ms(lambda: engine.execute(sql)):.1f} ({scanned}/{count}){mark}")
+            table.add_row(label, *cells)
+    console.print(table)
+    for engine in engines.values():
+        engine[1].close()
+    shutil.rmtree(bench_dir, ignore_errors=True)
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partitioned transactions with pruning and scatter-gather aggregation")
+    parser.add_argument("--build", action="store_true", help="(re)build db/partitions")
+    parser.add_argument("--by", choices=sorted(SCHEMES), default="month", help="partition key for --build")
+    parser.add_argument("--bench", action="store_true", help="compare every scheme against SQLite")
+    args = parser.parse_args()
+
+    if args.build:
+        started = time.perf_counter()
+        partitions = build_partitions(args.by)
+        report = Table(title=f"Partitions by {args.by}")
+        for column in ("Key", "Rows", "Days", "Countries"):
+            report.add_column(column, justify="right" if column == "Rows" else "left")
+        for partition in partitions:
+            report.add_row(str(partition["key"]), f"{partition['rows']:,}", f"{partition['min_day']} .. {partition['max_day']}",
+                           ", ".join(partition["countries"]))
+        console.print(report)
+        console.print(f"[green]Built {len(partitions)} partitions in {time.perf_counter() - started:.1f}s[/]")
+    if args.bench:
+        benchmark()
@@ -0,0 +1,121 @@
+"""Lexical side of RAG retrieval: an FTS5 (BM25) index over the chunks in rag.db, and rank fusion with vector hits.
+
+product_knowledge_fts indexes every chunk's text plus its source file name and
+product id, with the row ids of product_knowledge, so product IDs ("7021") and
+exact material / certification terms ("GOTS", "merino") are found even when
+their embedding is not close to the question's. ingest.py builds it; an
+existing rag.db gets it with `uv run python src/ingest.py --reindex`.
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import json
+import re
+import sqlite3
+from pathlib import PurePosixPath
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+RRF_K = 60                      # reciprocal rank fusion damping constant (score = sum of 1 / (RRF_K + rank))
+FTS_CANDIDATES = 20             # hits taken from each retriever before fusion
+MIN_IDENTIFIER_DIGITS = 3       # numbers this long written as an id ("product 7021", "#7021", "7021.pdf") are looked up as product ids
+
+STOPWORDS = frozenset("""
+    a about all an and any are as at be by can do does for from has have how i in is it its me
+    of on or product products show tell that the their them these this those to was what when
+    which who why with would you your
+""".split())
+
+_WORD_RE = re.compile(r"\w+")
+_PHRASE_RE = re.compile(r'"([^"]+)"')
+# A bare number ("100% wool", "2024", "150 euros") is only a BM25 term, fused with the vector hits
+_IDENTIFIER_RE = re.compile(
+    rf"(?:\bproducts?(?:[\s_]*ids?)?\s*[:=#]?\s*|\bids?\s*[:=#]?\s*|#)(\d{{{MIN_IDENTIFIER_DIGITS},}})\b"
+    rf"|\b(\d{{{MIN_IDENTIFIER_DIGITS},}})\.pdf\b",
+    re.IGNORECASE,
+)
+
+
+###########################################################################
+##                             INDEX
+###########################################################################
+
+
+def fts_table(table: str) -> str:
+    return f"{table}_fts"
+
+
+def build_fts_index(conn: sqlite3.Connection, table: str) -> int:
+    """(Re)create the FTS5 index for `table` from its rows. Returns the chunks indexed."""
+    fts = fts_table(table)
+    conn.execute(f"DROP TABLE IF EXISTS {fts}")
+    conn.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5(text, source, product_id, tokenize = 'porter unicode61')")
+    rows = []
+    for rowid, text, metadata in conn.execute(f"SELECT rowid, text, metadata FROM {table}"):
+        meta = json.loads(metadata or "{}") or {}
+        # 'data/pdf/7021.pdf' is indexed as its file name, so '7021' and '7021.pdf' both match
+        source = PurePosixPath(str(meta.get("source_path") or "")).name
+        product_id = meta.get("product_id")
+        rows.append((rowid, text, source, "" if product_id is None else str(product_id)))
+    conn.executemany(f"INSERT INTO {fts} (rowid, text, source, product_id) VALUES (?, ?, ?, ?)", rows)
+    conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+    conn.commit()
+    return conn.execute(f"SELECT COUNT(*) FROM {fts}").fetchone()[0]
+
+
+def has_fts_index(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts_table(table),)).fetchone() is not None
+
+
+###########################################################################
+##                             SEARCH
+###########################################################################
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def fts_queries(question: str) -> tuple[str | None, str | None]:
+    """(exact query, terms query) for FTS5 MATCH.
+
+    The exact query covers what a question can pin down on its own: product ids
+    written as such ("product 7021", "#7021", "7021.pdf") and "quoted phrases".
+    The terms query ORs the remaining significant words, for ranking by BM25.
+    """
+    ids = dict.fromkeys(match.group(1) or match.group(2) for match in _IDENTIFIER_RE.finditer(question))
+    exact = [f"{{source product_id}} : {_quote(number)}" for number in ids]
+    exact += [_quote(phrase.strip()) for phrase in _PHRASE_RE.findall(question) if phrase.strip()]
+    words = [word for word in _WORD_RE.findall(question.casefold()) if word not in STOPWORDS and len(word) > 1]
+    terms = " OR ".join(_quote(word) for word in dict.fromkeys(words))
+    return (" OR ".join(exact) or None), (terms or None)
+
+
+def lexical_search(conn: sqlite3.Connection, table: str, question: str, limit: int = FTS_CANDIDATES) -> tuple[list[int], bool]:
+    """(row ids best BM25 first, confident). Confident means the exact query (ids / quoted phrases) matched."""
+    exact, terms = fts_queries(question)
+    fts = fts_table(table)
+
+    def match(query: str) -> list[int]:
+        rows = conn.execute(f"SELECT rowid FROM {fts} WHERE {fts} MATCH ? ORDER BY bm25({fts}) LIMIT ?", (query, limit))
+        return [row[0] for row in rows]
+
+    if exact and (hits := match(exact)):
+        # Chunks of the named product that also mention the question's words come first
+        ranked = match(f"({exact}) AND ({terms})") if terms else []
+        return list(dict.fromkeys(ranked + hits))[:limit], True
+    return (match(terms) if terms else []), False
+
+
+def reciprocal_rank_fusion(rankings: list[list[int]], limit: int, k: int = RRF_K) -> list[int]:
+    """Merge best-first id lists: each id scores sum(1 / (k + rank)) over the lists it appears in."""
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda item: -scores[item])[:limit]
@@ -0,0 +1,336 @@
+"""IVF approximate nearest-neighbour index for product_knowledge, stored in rag.db next to the chunks.
+
+sqlite-vec's vec0 scans every vector per query, so latency grows linearly
+with the catalogue. IVF clusters the vectors with k-means into about
+sqrt(n) lists; a query ranks the centroids, reads only its IVF_NPROBE
+nearest lists and ranks their vectors exactly. More probes, better recall, slower query.
+
+  product_knowledge_ivf_centroids  list_id, centroid (float32 blob)
+  product_knowledge_ivf            list_id, block, rowids (int64 blob), vectors (float32 blob)
+                                   up to IVF_BLOCK_ROWS vectors per row, so a probe reads a few rows
+  product_knowledge_ivf_rows       rowid -> list_id, block
+
+New chunks are added to the list of their nearest centroid (IVFIndex.add,
+or sync() for every chunk not indexed yet); the centroids stay as trained,
+so retrain with `ingest.py --reindex --ivf` once the catalogue has grown a
+lot (stats() reports how uneven the lists have become).
+
+Build:      uv run python src/ingest.py --reindex --ivf
+Benchmark:  uv run python src/rag_ivf.py     (synthetic clustered vectors, 10K / 100K / 1M, latency and recall@k per nprobe)
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import argparse
+import sqlite3
+import tempfile
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+IVF_NPROBE = 8                      # lists read per query
+IVF_TRAIN_POINTS_PER_LIST = 40      # k-means training sample size per list
+IVF_KMEANS_ITERATIONS = 10
+IVF_BATCH_ROWS = 8192               # vectors assigned per batch
+IVF_BLOCK_ROWS = 64                 # vectors per stored block of a list (one SQLite row)
+BENCHMARK_SIZES = (10_000, 100_000, 1_000_000)
+BENCHMARK_DIMS = 128
+BENCHMARK_QUERIES = 100
+BENCHMARK_K = 10
+BENCHMARK_NPROBES = (1, 4, 8, 16, 32, 64, 128)
+
+console = Console()
+
+
+###########################################################################
+##                            K-MEANS
+###########################################################################
+
+
+def default_lists(count: int) -> int:
+    return max(1, int(round(np.sqrt(count))))
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, count: int = 1) -> np.ndarray:
+    """Indices of the `count` nearest centroids (L2) of each row, nearest first."""
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 does not change the ranking
+    distances = (centroids * centroids).sum(axis=1) - 2 * vectors @ centroids.T
+    if count == 1:
+        return distances.argmin(axis=1)[:, None]
+    nearest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+    order = np.take_along_axis(distances, nearest, axis=1).argsort(axis=1)
+    return np.take_along_axis(nearest, order, axis=1)
+
+
+def kmeans(vectors: np.ndarray, lists: int, iterations: int = IVF_KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means from `lists` random rows. Empty clusters are restarted on a random row."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=lists, replace=False)].copy()
+    for _ in range(iterations):
+        assigned = np.concatenate([
+            nearest_centroids(vectors[start:start + IVF_BATCH_ROWS], centroids)[:, 0]
+            for start in range(0, len(vectors), IVF_BATCH_ROWS)
+        ])
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assigned, vectors)
+        counts = np.bincount(assigned, minlength=lists)
+        empty = counts == 0
+        centroids = sums / np.maximum(counts, 1)[:, None]
+        centroids[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+    return centroids.astype(np.float32)
+
+
+###########################################################################
+##                             INDEX
+###########################################################################
+
+
+class IVFIndex:
+    """Inverted-file index over one table's embeddings: centroids in memory, lists in SQLite as blocks of vectors."""
+
+    def __init__(self, conn: sqlite3.Connection, table: str):
+        self.conn = conn
+        self.table = table
+        self.centroids_table = f"{table}_ivf_centroids"
+        self.blocks_table = f"{table}_ivf"
+        self.rows_table = f"{table}_ivf_rows"
+        rows = conn.execute(f"SELECT centroid FROM {self.centroids_table} ORDER BY list_id").fetchall() if self.exists(conn, table) else []
+        self.centroids = np.vstack([np.frombuffer(row[0], dtype=np.float32) for row in rows]) if rows else None
+
+    @staticmethod
+    def exists(conn: sqlite3.Connection, table: str) -> bool:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f"{table}_ivf_centroids",)).fetchone() is not None
+
+    ######################### Build / update #############################
+    def train(self, sample: np.ndarray, lists: int) -> None:
+        """(Re)create the index tables with `lists` centroids trained on `sample`. The lists start empty."""
+        self.centroids = kmeans(np.asarray(sample, dtype=np.float32), min(lists, len(sample)))
+        for name in (self.centroids_table, self.blocks_table, self.rows_table):
+            self.conn.execute(f"DROP TABLE IF EXISTS {name}")
+        self.conn.execute(f"CREATE TABLE {self.centroids_table} (list_id INTEGER PRIMARY KEY, centroid BLOB NOT NULL)")
+        self.conn.execute(f"""
+            CREATE TABLE {self.blocks_table} (
+                list_id INTEGER NOT NULL, block INTEGER NOT NULL, rowids BLOB NOT NULL, vectors BLOB NOT NULL,
+                PRIMARY KEY (list_id, block)
+            )
+        """)
+        self.conn.execute(f"CREATE TABLE {self.rows_table} (rowid INTEGER PRIMARY KEY, list_id INTEGER NOT NULL, block INTEGER NOT NULL)")
+        self.conn.executemany(f"INSERT INTO {self.centroids_table} VALUES (?, ?)",
+                              [(list_id, centroid.tobytes()) for list_id, centroid in enumerate(self.centroids)])
+        self.conn.commit()
+
+    def _write(self, list_id: int, block: int, rowids: np.ndarray, vectors: np.ndarray) -> None:
+        self.conn.execute(f"INSERT OR REPLACE INTO {self.blocks_table} VALUES (?, ?, ?, ?)",
+                          (list_id, block, rowids.astype(np.int64).tobytes(), np.ascontiguousarray(vectors, dtype=np.float32).tobytes()))
+        self.conn.executemany(f"INSERT OR REPLACE INTO {self.rows_table} VALUES (?, ?, ?)",
+                              [(int(rowid), list_id, block) for rowid in rowids])
+
+    def _read(self, rowids: bytes, vectors: bytes) -> tuple[np.ndarray, np.ndarray]:
+        ids = np.frombuffer(rowids, dtype=np.int64)
+        return ids, np.frombuffer(vectors, dtype=np.float32).reshape(len(ids), -1)
+
+    def _flush(self, list_id: int, rowids: list[np.ndarray], vectors: list[np.ndarray]) -> None:
+        """Append to a list: topped up into its last block when that one is not full, then new full blocks."""
+        rowids, vectors = np.concatenate(rowids), np.concatenate(vectors)
+        tail = self.conn.execute(f"SELECT block, rowids, vectors FROM {self.blocks_table} WHERE list_id = ? ORDER BY block DESC LIMIT 1",
+                                 (list_id,)).fetchone()
+        block = 0
+        if tail is not None:
+            tail_ids, tail_vectors = self._read(tail[1], tail[2])
+            if len(tail_ids) < IVF_BLOCK_ROWS:
+                block, rowids, vectors = tail[0], np.concatenate([tail_ids, rowids]), np.concatenate([tail_vectors, vectors])
+            else:
+                block = tail[0] + 1
+        for start in range(0, len(rowids), IVF_BLOCK_ROWS):
+            self._write(list_id, block, rowids[start:start + IVF_BLOCK_ROWS], vectors[start:start + IVF_BLOCK_ROWS])
+            block += 1
+
+    def add_batches(self, batches: Iterable[tuple[list[int], np.ndarray]]) -> int:
+        """Put each vector into the list of its nearest centroid (replacing an earlier entry for the same rowid). Returns the vectors added.
+
+        Each list is buffered until it fills a block, so a full build writes every block once.
+        """
+        if self.centroids is None:
+            raise RuntimeError(f"{self.table} has no IVF index, train it first")
+        pending: dict[int, tuple[list[np.ndarray], list[np.ndarray]]] = {}
+        added = 0
+        for rowids, vectors in batches:
+            self.remove(rowids)
+            rowids, vectors = np.asarray(rowids, dtype=np.int64), np.asarray(vectors, dtype=np.float32)
+            assigned = nearest_centroids(vectors, self.centroids)[:, 0]
+            order = np.argsort(assigned, kind="stable")
+            lists, starts = np.unique(assigned[order], return_index=True)
+            for list_id, members in zip(lists.tolist(), np.split(order, starts[1:])):
+                ids, vecs = pending.setdefault(list_id, ([], []))
+                ids.append(rowids[members])
+                vecs.append(vectors[members])
+                if sum(map(len, ids)) >= IVF_BLOCK_ROWS:
+                    self._flush(list_id, ids, vecs)
+                    del pending[list_id]
+            added += len(rowids)
+        for list_id, (ids, vecs) in pending.items():
+            self._flush(list_id, ids, vecs)
+        self.conn.commit()
+        return added
+
+    def add(self, rowids: list[int], vectors: np.ndarray) -> None:
+        self.add_batches([(rowids, vectors)])
+
+    def remove(self, rowids: list[int]) -> None:
+        """Take row ids out of their blocks (blocks left empty are deleted)."""
+        located: dict[tuple[int, int], set[int]] = {}
+        for start in range(0, len(rowids), 500):
+            chunk = [int(rowid) for rowid in rowids[start:start + 500]]
+            for rowid, list_id, block in self.conn.execute(
+                f"SELECT rowid, list_id, block FROM {self.rows_table} WHERE rowid IN ({', '.join('?' * len(chunk))})", chunk
+            ):
+                located.setdefault((list_id, block), set()).add(rowid)
+        for (list_id, block), gone in located.items():
+            ids, vectors = self._read(*self.conn.execute(
+                f"SELECT rowids, vectors FROM {self.blocks_table} WHERE list_id = ? AND block = ?", (list_id, block)).fetchone())
+            keep = ~np.isin(ids, list(gone))
+            self.conn.executemany(f"DELETE FROM {self.rows_table} WHERE rowid = ?", [(rowid,) for rowid in gone])
+            if keep.any():
+                self._write(list_id, block, ids[keep], vectors[keep])
+            else:
+                self.conn.execute(f"DELETE FROM {self.blocks_table} WHERE list_id = ? AND block = ?", (list_id, block))
+        self.conn.commit()
+
+    def sync(self) -> int:
+        """Add the table's chunks that are not in the index yet, drop entries whose chunk is gone. Returns the chunks added."""
+        gone = [row[0] for row in self.conn.execute(f"SELECT rowid FROM {self.rows_table} WHERE rowid NOT IN (SELECT rowid FROM {self.table})")]
+        self.remove(gone)
+        return self.add_batches(table_vectors(self.conn, self.table, f"rowid NOT IN (SELECT rowid FROM {self.rows_table})"))
+
+    ######################### Search #####################################
+    def search(self, embedding: list[float] | np.ndarray, k: int, nprobe: int = IVF_NPROBE) -> list[int]:
+        """Row ids of the k nearest vectors (L2) within the `nprobe` lists nearest to the query."""
+        query = np.asarray(embedding, dtype=np.float32)
+        probes = nearest_centroids(query[None, :], self.centroids, min(nprobe, len(self.centroids)))[0]
+        blocks = self.conn.execute(
+            f"SELECT rowids, vectors FROM {self.blocks_table} WHERE list_id IN ({', '.join('?' * len(probes))})",
+            probes.tolist(),
+        ).fetchall()
+        if not blocks:
+            return []
+        rowids = np.frombuffer(b"".join(block[0] for block in blocks), dtype=np.int64)
+        vectors = np.frombuffer(b"".join(block[1] for block in blocks), dtype=np.float32).reshape(len(rowids), -1)
+        distances = (vectors * vectors).sum(axis=1) - 2 * vectors @ query
+        nearest = np.argpartition(distances, k - 1)[:k] if len(rowids) > k else np.arange(len(rowids))
+        return rowids[nearest[np.argsort(distances[nearest], kind="stable")]].tolist()
+
+    def stats(self) -> dict:
+        sizes = np.array([row[0] for row in self.conn.execute(f"SELECT COUNT(*) FROM {self.rows_table} GROUP BY list_id")])
+        return {
+            "lists": 0 if self.centroids is None else len(self.centroids),
+            "vectors": int(sizes.sum()) if len(sizes) else 0,
+            "dims": 0 if self.centroids is None else self.centroids.shape[1],
+            "nprobe": IVF_NPROBE,
+            # 1.0 = every list the same size; grows as new chunks pile onto a few centroids
+            "largest_list_vs_mean": round(float(sizes.max() / sizes.mean()), 2) if len(sizes) else 0.0,
+        }
+
+
+def table_vectors(conn: sqlite3.Connection, table: str, where: str = "1") -> Iterator[tuple[list[int], np.ndarray]]:
+    """Batches of (row ids, float32 matrix) of the embeddings SQLiteVec stores in `table`."""
+    cursor = conn.execute(f"SELECT rowid, text_embedding FROM {table} WHERE {where} ORDER BY rowid")
+    while rows := cursor.fetchmany(IVF_BATCH_ROWS):
+        yield [row[0] for row in rows], np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+
+
+def build_ivf_index(conn: sqlite3.Connection, table: str, lists: int | None = None) -> IVFIndex:
+    """Train on an evenly spread sample of `table`'s embeddings, then add all of them."""
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    if not count:
+        raise RuntimeError(f"{table} has no embeddings to index")
+    lists = lists or default_lists(count)
+    step = max(1, count // (lists * IVF_TRAIN_POINTS_PER_LIST))
+    sample = np.vstack([vectors[::step] for _, vectors in table_vectors(conn, table)])
+    index = IVFIndex(conn, table)
+    index.train(sample, lists)
+    index.sync()
+    return index
+
+
+###########################################################################
+##                           BENCHMARK
+###########################################################################
+
+
+def synthetic_vectors(count: int, dims: int, topic_size: int = 100, seed: int = 0) -> np.ndarray:
+    """Unit vectors scattered around count / topic_size random centres, a stand-in for embeddings (which cluster by subject).
+
+    Topics overlap and do not line up with the IVF lists, so recall below 1 shows up at every size.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(max(1, count // topic_size), dims)).astype(np.float32)
+    vectors = np.empty((count, dims), dtype=np.float32)
+    for start in range(0, count, IVF_BATCH_ROWS):
+        size = min(IVF_BATCH_ROWS, count - start)
+        vectors[start:start + size] = centres[rng.integers(len(centres), size=size)] + rng.normal(size=(size, dims))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def benchmark(sizes=BENCHMARK_SIZES, dims: int = BENCHMARK_DIMS, queries: int = BENCHMARK_QUERIES, k: int = BENCHMARK_K,
+              nprobes=BENCHMARK_NPROBES) -> list[dict]:
+    """Build time, exact-scan latency, and IVF latency / recall@k per nprobe at each size, in a temporary SQLite file."""
+    results = []
+    for size in sizes:
+        vectors = synthetic_vectors(size + queries, dims, seed=size)
+        data, probes = vectors[:size], vectors[size:]
+        started = time.perf_counter()
+        norms = (data * data).sum(axis=1)
+        truth = [set(np.argpartition(norms - 2 * data @ query, k)[:k].tolist()) for query in probes]
+        exact_ms = (time.perf_counter() - started) * 1000 / queries
+
+        with tempfile.TemporaryDirectory() as folder:
+            conn = sqlite3.connect(Path(folder) / "ivf.db")
+            started = time.perf_counter()
+            index = IVFIndex(conn, "chunks")
+            lists = default_lists(size)
+            index.train(data[:: max(1, size // (lists * IVF_TRAIN_POINTS_PER_LIST))], lists)
+            index.add_batches((list(range(start, min(start + IVF_BATCH_ROWS, size))), data[start:start + IVF_BATCH_ROWS])
+                              for start in range(0, size, IVF_BATCH_ROWS))
+            build_seconds = time.perf_counter() - started
+            for nprobe in nprobes:
+                index.search(probes[0], k, nprobe)
+                started = time.perf_counter()
+                found = [index.search(query, k, nprobe) for query in probes]
+                ms = (time.perf_counter() - started) * 1000 / queries
+                recall = sum(len(expected.intersection(hits)) for expected, hits in zip(truth, found)) / (k * queries)
+                results.append({"vectors": size, "lists": lists, "build_s": build_seconds, "exact_ms": exact_ms,
+                                "nprobe": nprobe, "ivf_ms": ms, "recall": recall})
+            conn.close()
+    return results
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF scaling benchmark on synthetic clustered vectors")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(BENCHMARK_SIZES), help="index sizes to benchmark")
+    parser.add_argument("--dims", type=int, default=BENCHMARK_DIMS, help="vector dimensions (gemini-embedding-001: 3072)")
+    parser.add_argument("--nprobes", type=int, nargs="+", default=list(BENCHMARK_NPROBES), help="lists read per query to try")
+    parser.add_argument("-k", type=int, default=BENCHMARK_K, help="hits per query")
+    args = parser.parse_args()
+
+    table = Table(title=f"IVF vs exact scan: {args.dims} dims, {BENCHMARK_QUERIES} queries, recall@{args.k}")
+    for column in ("Vectors", "Lists", "Build (s)", "Exact in-memory scan (ms)", "nprobe", "IVF (ms)", f"Recall@{args.k}"):
+        table.add_column(column, justify="right")
+    for row in benchmark(args.sizes, args.dims, k=args.k, nprobes=args.nprobes):
+        table.add_row(f"{row['vectors']:,}", str(row["lists"]), f"{row['build_s']:.1f}", f"{row['exact_ms']:.2f}",
+                      str(row["nprobe"]), f"{row['ivf_ms']:.2f}", f"{row['recall']:.3f}")
+    console.print(table)
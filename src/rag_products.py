@@ -0,0 +1,120 @@
+"""Product-scoped chunk lookup: product_id -> chunk row ids in rag.db, tagged with the tech sheet sections they cover.
+
+Every tech sheet has the same headings (Product Overview, Material & Fabric
+Composition, Size Guide, Care Instructions, Sustainability & Origin, Style
+Notes). product_chunks maps each product to its chunks in chunk_index order and
+records which sections each chunk contains, so query_rag_products can fetch a
+product's care or material chunks by key instead of by semantic search.
+ingest.py builds it, `ingest.py --reindex` adds it to an existing rag.db.
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import json
+import re
+import sqlite3
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+PRODUCT_CHUNKS = "product_chunks"
+
+# Section key -> tech sheet heading (a line on its own)
+SECTIONS = {
+    "overview": "Product Overview",
+    "materials": "Material & Fabric Composition",
+    "size": "Size Guide",
+    "care": "Care Instructions",
+    "sustainability": "Sustainability & Origin",
+    "style": "Style Notes",
+}
+_HEADING_RE = re.compile(r"^\s*(" + "|".join(re.escape(heading) for heading in SECTIONS.values()) + r")\s*$", re.MULTILINE)
+_SECTION_BY_HEADING = {heading: key for key, heading in SECTIONS.items()}
+
+
+###########################################################################
+##                             INDEX
+###########################################################################
+
+
+def _section_at(text: str, position: int, start: str | None) -> str | None:
+    """Section in effect at `position` of a chunk that starts in section `start`."""
+    for match in _HEADING_RE.finditer(text, 0, position):
+        start = _SECTION_BY_HEADING[match.group(1)]
+    return start
+
+
+def chunk_sections(text: str, previous: tuple[str, str | None] | None = None) -> tuple[list[str], str | None]:
+    """(sections the chunk covers, section it starts in).
+
+    `previous` is (text, start section) of the chunk before it. Chunks overlap,
+    so a chunk starts in the section of the spot where its first characters
+    appear in the previous chunk.
+    """
+    start = None
+    if previous is not None:
+        previous_text, previous_start = previous
+        position = previous_text.find(text[:50])
+        start = _section_at(previous_text, position if position >= 0 else len(previous_text), previous_start)
+    first = _HEADING_RE.search(text)
+    lead = text[:first.start()] if first else text
+    covered = [start] if start and lead.strip() else []
+    covered += [_SECTION_BY_HEADING[match.group(1)] for match in _HEADING_RE.finditer(text)]
+    return list(dict.fromkeys(covered)), start
+
+
+def build_product_index(conn: sqlite3.Connection, table: str) -> int:
+    """(Re)create product_chunks from the chunk metadata of `table`. Returns the products indexed."""
+    chunks: dict[int, list[tuple[int, int, str]]] = {}
+    for rowid, text, metadata in conn.execute(f"SELECT rowid, text, metadata FROM {table}"):
+        meta = json.loads(metadata or "null") or {}
+        if meta.get("product_id") is not None:
+            chunks.setdefault(int(meta["product_id"]), []).append((int(meta.get("chunk_index") or 0), rowid, text))
+
+    rows = []
+    for product_id, product_chunks in chunks.items():
+        previous = None
+        for chunk_index, rowid, text in sorted(product_chunks):
+            sections, start = chunk_sections(text, previous)
+            rows.append((product_id, chunk_index, rowid, ",".join(sections)))
+            previous = (text, start)
+
+    conn.execute(f"DROP TABLE IF EXISTS {PRODUCT_CHUNKS}")
+    conn.execute(f"""
+        CREATE TABLE {PRODUCT_CHUNKS} (
+            product_id INTEGER NOT NULL, chunk_index INTEGER NOT NULL, chunk_rowid INTEGER NOT NULL, sections TEXT NOT NULL,
+            PRIMARY KEY (product_id, chunk_index)
+        ) WITHOUT ROWID
+    """)
+    conn.executemany(f"INSERT INTO {PRODUCT_CHUNKS} VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    return len(chunks)
+
+
+def has_product_index(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (PRODUCT_CHUNKS,)).fetchone() is not None
+
+
+###########################################################################
+##                             LOOKUP
+###########################################################################
+
+
+def product_chunk_rowids(conn: sqlite3.Connection, product_ids: list[int], section: str | None = None) -> dict[int, list[int]]:
+    """product_id -> chunk row ids in chunk order (only chunks covering `section`, when given). Unknown ids are left out."""
+    if section is not None and section not in SECTIONS:
+        raise ValueError(f"unknown section {section!r}, use one of: {', '.join(SECTIONS)}")
+    found: dict[int, list[int]] = {}
+    placeholders = ", ".join("?" * len(product_ids))
+    rows = conn.execute(
+        f"SELECT product_id, chunk_rowid, sections FROM {PRODUCT_CHUNKS} WHERE product_id IN ({placeholders}) ORDER BY product_id, chunk_index",
+        list(product_ids),
+    )
+    for product_id, rowid, sections in rows:
+        if section is None or section in sections.split(","):
+            found.setdefault(product_id, []).append(rowid)
+    return found
@@ -0,0 +1,267 @@
+"""Quantized first-pass vector index for rag.db: int8 or binary vectors, optionally Matryoshka-truncated, reranked exactly.
+
+SQLiteVec keeps every chunk's float32 embedding (3072 dims for
+gemini-embedding-001, 12 KB) in product_knowledge_vec and scans all of them
+per query. product_knowledge_vec_q holds a small copy of each vector for
+that scan:
+  int8     one byte per dimension, scaled by the corpus' largest component (4x smaller)
+  binary   one bit per dimension, the sign (32x smaller, hamming distance)
+  dims     keep only the first N dimensions, renormalized (gemini-embedding-001
+           is Matryoshka-trained, 768 / 1536 keep most of the quality)
+The scan returns RERANK_OVERSAMPLE x k candidates, which are reranked by exact
+L2 distance (the vec0 default metric) on the float32 vectors in
+product_knowledge itself, a rowid lookup. rag_runtime uses the index when rag.db has one.
+
+Build:      uv run python src/ingest.py --quantize binary --dims 768
+Benchmark:  uv run python src/rag_quantized.py     (recall@k / latency / size per setting, on a copy of rag.db in memory)
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import sqlite_vec
+from rich.console import Console
+from rich.table import Table
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+RAG_DB_FILE = str(PROJECT_ROOT / "db" / "rag.db")
+RAG_TABLE = "product_knowledge"
+QUANTIZED_INDEXES = "quantized_indexes"     # settings of each quantized index: name, mode, dims, scale
+MODES = ("int8", "binary")
+RERANK_OVERSAMPLE = {"int8": 4, "binary": 10}   # first-pass candidates per requested hit
+BENCHMARK_QUERIES = 100
+BENCHMARK_K = 5
+BENCHMARK_SETTINGS = [("int8", None), ("int8", 768), ("binary", None), ("binary", 1536), ("binary", 768), ("binary", 256)]
+_COLUMN_TYPE = {"int8": "int8", "binary": "bit"}
+_VECTOR_FUNCTION = {"int8": "vec_int8", "binary": "vec_bit"}
+
+console = Console()
+
+
+###########################################################################
+##                          QUANTIZATION
+###########################################################################
+
+
+class QuantizedIndex(NamedTuple):
+    name: str               # vec0 table
+    mode: str               # int8 | binary
+    dims: int               # dimensions kept
+    scale: float            # int8: value mapped to 127
+
+
+def quantized_table(table: str) -> str:
+    return f"{table}_vec_q"
+
+
+def truncate(vectors: np.ndarray, dims: int) -> np.ndarray:
+    """First `dims` dimensions of each row, renormalized to unit length (Matryoshka truncation)."""
+    kept = np.ascontiguousarray(vectors[:, :dims], dtype=np.float32)
+    norms = np.linalg.norm(kept, axis=1, keepdims=True)
+    return kept / np.where(norms == 0, 1, norms)
+
+
+def quantize(vectors: np.ndarray, mode: str, scale: float = 1.0) -> np.ndarray:
+    """int8: components scaled so `scale` -> 127, clipped. binary: sign bits packed 8 per byte, sqlite-vec's bit order."""
+    if mode == "int8":
+        return np.clip(np.rint(vectors / scale * 127), -127, 127).astype(np.int8)
+    if mode == "binary":
+        return np.packbits(vectors > 0, axis=1, bitorder="little")
+    raise ValueError(f"unknown quantization {mode!r}, use one of: {', '.join(MODES)}")
+
+
+def full_vectors(conn: sqlite3.Connection, table: str, rowids: list[int] | None = None) -> tuple[list[int], np.ndarray]:
+    """(row ids, float32 matrix) from the embeddings SQLiteVec stores next to each chunk, all rows when rowids is None."""
+    if rowids is None:
+        rows = conn.execute(f"SELECT rowid, text_embedding FROM {table} ORDER BY rowid").fetchall()
+    else:
+        rows = conn.execute(
+            f"SELECT rowid, text_embedding FROM {table} WHERE rowid IN ({', '.join('?' * len(rowids))})", rowids
+        ).fetchall() if rowids else []
+    if not rows:
+        return [], np.empty((0, 0), dtype=np.float32)
+    return [row[0] for row in rows], np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+
+
+###########################################################################
+##                             INDEX
+###########################################################################
+
+
+def build_quantized_index(conn: sqlite3.Connection, table: str, mode: str, dims: int | None = None, name: str | None = None) -> QuantizedIndex:
+    """(Re)create a quantized vec0 copy of `table`'s embeddings. Needs the sqlite-vec extension loaded on `conn`."""
+    rowids, vectors = full_vectors(conn, table)
+    if not rowids:
+        raise RuntimeError(f"{table} has no embeddings to quantize")
+    dims = min(dims or vectors.shape[1], vectors.shape[1])
+    if mode == "binary" and dims % 8:
+        raise ValueError("binary quantization needs a multiple of 8 dimensions")
+    vectors = truncate(vectors, dims)
+    scale = float(np.abs(vectors).max()) if mode == "int8" else 1.0
+    codes = quantize(vectors, mode, scale)
+
+    index = QuantizedIndex(name or quantized_table(table), mode, dims, scale)
+    conn.execute(f"DROP TABLE IF EXISTS {index.name}")
+    conn.execute(f"CREATE VIRTUAL TABLE {index.name} USING vec0(rowid INTEGER PRIMARY KEY, embedding {_COLUMN_TYPE[mode]}[{dims}])")
+    conn.executemany(
+        f"INSERT INTO {index.name} (rowid, embedding) VALUES (?, {_VECTOR_FUNCTION[mode]}(?))",
+        [(rowid, code.tobytes()) for rowid, code in zip(rowids, codes)],
+    )
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {QUANTIZED_INDEXES} (name TEXT PRIMARY KEY, mode TEXT NOT NULL, dims INTEGER NOT NULL, scale REAL NOT NULL)")
+    conn.execute(f"INSERT OR REPLACE INTO {QUANTIZED_INDEXES} VALUES (?, ?, ?, ?)", index)
+    conn.commit()
+    return index
+
+
+def drop_quantized_index(conn: sqlite3.Connection, name: str) -> None:
+    conn.execute(f"DROP TABLE IF EXISTS {name}")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (QUANTIZED_INDEXES,)).fetchone():
+        conn.execute(f"DELETE FROM {QUANTIZED_INDEXES} WHERE name = ?", (name,))
+    conn.commit()
+
+
+def load_quantized_index(conn: sqlite3.Connection, table: str) -> QuantizedIndex | None:
+    """The quantized index of `table`, None when rag.db has none (plain float32 search)."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (QUANTIZED_INDEXES,)).fetchone():
+        return None
+    row = conn.execute(f"SELECT name, mode, dims, scale FROM {QUANTIZED_INDEXES} WHERE name = ?", (quantized_table(table),)).fetchone()
+    return QuantizedIndex(*row) if row else None
+
+
+def index_bytes(conn: sqlite3.Connection, name: str) -> int | None:
+    """On-disk bytes of a vec0 table (its shadow tables), None without dbstat."""
+    try:
+        return conn.execute(
+            "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN (?, ?, ?, ?) OR name GLOB ?",
+            (name, f"{name}_info", f"{name}_chunks", f"{name}_rowids", f"{name}_vector_chunks[0-9]*"),
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+###########################################################################
+##                             SEARCH
+###########################################################################
+
+
+def first_pass(conn: sqlite3.Connection, index: QuantizedIndex, embedding: list[float], candidates: int) -> list[int]:
+    """Nearest row ids by the quantized vectors alone."""
+    query = truncate(np.asarray(embedding, dtype=np.float32)[None, :], index.dims)
+    code = quantize(query, index.mode, index.scale)[0]
+    rows = conn.execute(
+        f"SELECT rowid FROM {index.name} WHERE embedding MATCH {_VECTOR_FUNCTION[index.mode]}(?) AND k = ? ORDER BY distance",
+        (code.tobytes(), candidates),
+    )
+    return [row[0] for row in rows]
+
+
+def rerank(conn: sqlite3.Connection, table: str, embedding: list[float], rowids: list[int], k: int) -> list[int]:
+    """`rowids` ordered by exact L2 distance to `embedding` on the float32 vectors, best k."""
+    found, vectors = full_vectors(conn, table, rowids)
+    if not found:
+        return []
+    distances = ((vectors - np.asarray(embedding, dtype=np.float32)) ** 2).sum(axis=1)
+    return [found[i] for i in np.argsort(distances, kind="stable")[:k]]
+
+
+def quantized_search(conn: sqlite3.Connection, index: QuantizedIndex, table: str, embedding: list[float], k: int,
+                     oversample: int | None = None) -> list[int]:
+    """Top-k row ids: quantized scan for oversample x k candidates, then exact rerank."""
+    candidates = first_pass(conn, index, embedding, k * (oversample or RERANK_OVERSAMPLE[index.mode]))
+    return rerank(conn, table, embedding, candidates, k)
+
+
+###########################################################################
+##                           BENCHMARK
+###########################################################################
+
+
+def load_sqlite_vec(conn: sqlite3.Connection) -> None:
+    conn.enable_load_extension(True)
+    sqlite_vec.load(conn)
+    conn.enable_load_extension(False)
+
+
+def benchmark(db_file: str = RAG_DB_FILE, table: str = RAG_TABLE, queries: int = BENCHMARK_QUERIES, k: int = BENCHMARK_K) -> list[dict]:
+    """recall@k, latency and index size of plain float32 search and each quantized setting.
+
+    Runs on an in-memory copy of rag.db, so the file is not touched. Queries are
+    the stored vectors of `queries` chunks spread over the corpus (no embedding
+    calls); the chunk itself is left out of its own results. Ground truth is
+    exact L2 search over all float32 vectors.
+    """
+    source = sqlite3.connect(db_file)
+    conn = sqlite3.connect(":memory:")
+    source.backup(conn)
+    source.close()
+    load_sqlite_vec(conn)
+
+    rowids, vectors = full_vectors(conn, table)
+    picks = np.linspace(0, len(rowids) - 1, min(queries, len(rowids))).astype(int)
+    truth = []
+    for pick in picks:
+        distances = ((vectors - vectors[pick]) ** 2).sum(axis=1)
+        truth.append({rowids[i] for i in np.argsort(distances, kind="stable")[:k + 1]} - {rowids[pick]})
+
+    def measure(label: str, dims: int, bytes_per_vector: float, size: int | None, search) -> dict:
+        hits, started = 0, time.perf_counter()
+        for pick, expected in zip(picks, truth):
+            found = [rowid for rowid in search(vectors[pick].tolist()) if rowid != rowids[pick]][:k]
+            hits += len(expected.intersection(found))
+        return {"index": label, "dims": dims, "bytes_per_vector": bytes_per_vector, "index_bytes": size,
+                "recall": hits / (k * len(picks)), "ms_per_query": (time.perf_counter() - started) * 1000 / len(picks)}
+
+    full_dims = vectors.shape[1]
+    results = [measure("float32 (vec0)", full_dims, full_dims * 4, index_bytes(conn, f"{table}_vec"), lambda embedding: [
+        row[0] for row in conn.execute(
+            f"SELECT rowid FROM {table}_vec WHERE text_embedding MATCH ? AND k = ? ORDER BY distance",
+            (np.asarray(embedding, dtype=np.float32).tobytes(), k + 1),
+        )
+    ])]
+    name = f"{table}_vec_bench"
+    for mode, dims in BENCHMARK_SETTINGS:
+        if dims and dims >= full_dims:
+            continue
+        index = build_quantized_index(conn, table, mode, dims, name=name)
+        size = index_bytes(conn, name)
+        per_vector = index.dims if mode == "int8" else index.dims / 8
+        results.append(measure(f"{mode} first pass only", index.dims, per_vector, size,
+                               lambda embedding: first_pass(conn, index, embedding, k + 1)))
+        results.append(measure(f"{mode} + rerank", index.dims, per_vector, size,
+                               lambda embedding: quantized_search(conn, index, table, embedding, k + 1)))
+        drop_quantized_index(conn, name)
+    conn.close()
+    return results
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark quantized vector search on rag.db")
+    parser.add_argument("--db", default=RAG_DB_FILE, help="rag.db to benchmark (copied into memory)")
+    parser.add_argument("--queries", type=int, default=BENCHMARK_QUERIES, help="chunks used as queries")
+    parser.add_argument("-k", type=int, default=BENCHMARK_K, help="hits per query")
+    args = parser.parse_args()
+
+    table = Table(title=f"Vector search on {Path(args.db).name}: recall@{args.k} vs exact float32, {args.queries} queries")
+    for column in ("Index", "Dims", "Bytes / vector", "Index size (KB)", f"Recall@{args.k}", "ms / query"):
+        table.add_column(column, justify="left" if column == "Index" else "right")
+    for row in benchmark(args.db, queries=args.queries, k=args.k):
+        size = "n/a" if row["index_bytes"] is None else f"{row['index_bytes'] / 1024:,.0f}"
+        table.add_row(row["index"], str(row["dims"]), f"{row['bytes_per_vector']:g}", size, f"{row['recall']:.3f}", f"{row['ms_per_query']:.2f}")
+    console.print(table)
@@ -0,0 +1,358 @@
+"""Process-wide RAG runtime: one embedding client, one SQLiteVec store and one chat model for every query_rag call.
+
+Building them per call costs a client setup, a SQLite connection with the
+sqlite-vec extension load and a dummy embedding request (SQLiteVec probes the
+embedding size in its constructor). The runtime builds each one on first use
+and keeps it. Embedding and LLM requests run concurrently from ToolNode's
+threads; only the shared SQLite connection is serialized.
+
+Retrieval is hybrid when rag.db has its FTS5 index (rag_fts.py). The BM25
+query runs first since it takes well under a millisecond: when it pins the
+question down on its own (a product id, a quoted phrase) its hits are
+returned and no embedding is requested. Otherwise the vector hits and the
+BM25 hits are merged by reciprocal rank fusion.
+
+similarity_search_batch serves query_rag_batch: the questions' lexical
+lookups, one batched embedding request for those that need vectors, their
+vector searches and the chunk fetch each run back to back on the shared
+connection.
+
+Vector search is sqlite-vec's own float32 scan unless one of the faster
+backends is switched on below and rag.db has it, tried in this order: the
+memory-mapped NumPy export of its embeddings (rag_vectors.py,
+`ingest.py --vectors`), which ranks all of a batch's questions in one matrix
+multiply; an IVF index (rag_ivf.py, `ingest.py --ivf`), which reads only the
+lists nearest to the question; a quantized index (rag_quantized.py,
+`ingest.py --quantize`), scanned first and reranked exactly. They stay off
+until their recall has been checked against a production rag.db.
+
+query_rag answers go through answer_cache.SemanticAnswerCache: a question
+that retrieved the same chunks as an earlier, similar enough question gets
+that answer without a synthesis call. Lexical-only calls bypass it.
+
+Query embeddings go through embedding_cache.CachedEmbeddings. Every call
+records how long it spent on setup, retrieval (query embedding + vector
+search) and synthesis, see rag_stats().
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+import sqlite_vec
+from langchain.chat_models import init_chat_model
+from langchain_community.vectorstores import SQLiteVec
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from answer_cache import SemanticAnswerCache
+from embedding_cache import EMBEDDING_CACHE_FILE, CachedEmbeddings, embed_query_batch, model_name
+from rag_fts import FTS_CANDIDATES, has_fts_index, lexical_search, reciprocal_rank_fusion
+from rag_ivf import IVFIndex
+from rag_products import has_product_index, product_chunk_rowids
+from rag_quantized import QuantizedIndex, load_quantized_index, quantized_search
+from rag_vectors import VectorMatrix
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+RAG_DB_FILE = str(PROJECT_ROOT / "db" / "rag.db")
+RAG_TABLE = "product_knowledge"
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+RAG_LLM = "google_genai:gemini-2.5-flash"
+RAG_TEMPERATURE = 0.7
+RAG_RECENT_CALLS = 50          # per-call timings kept for rag_stats()
+QUERY_EMBEDDING_CACHE = True   # memory + sidecar cache in front of embed_query (embedding_cache.py)
+ANSWER_CACHE = True            # reuse query_rag answers for similar questions over the same chunks (answer_cache.py)
+HYBRID_RETRIEVAL = True        # fuse FTS5 / BM25 hits with vector hits (rag_fts.py), False: vector search only
+QUANTIZED_RETRIEVAL = False    # opt-in: use rag.db's quantized index + exact rerank when it has one (rag_quantized.py)
+IVF_RETRIEVAL = False          # opt-in: use rag.db's IVF index when it has one (rag_ivf.py), ahead of the quantized index
+NUMPY_RETRIEVAL = False        # opt-in: use the memory-mapped embedding export while it is fresh (rag_vectors.py), ahead of both
+PHASES = ("setup", "retrieval", "synthesis")
+
+
+###########################################################################
+##                            RUNTIME
+###########################################################################
+
+
+class RAGRuntime:
+    """Lazily built, shared embedding client / vector store / chat model, with per-call phase timings."""
+
+    def __init__(self, db_file: str = RAG_DB_FILE, table: str = RAG_TABLE, embeddings: Embeddings | None = None,
+                 llm_model: str = RAG_LLM, temperature: float = RAG_TEMPERATURE,
+                 cache_file: Path | str | None = EMBEDDING_CACHE_FILE if QUERY_EMBEDDING_CACHE else None):
+        self.db_file = db_file
+        self.table = table
+        self.llm_model = llm_model
+        self.temperature = temperature
+        self.cache_file = cache_file
+        self._client = embeddings
+        self._embeddings: Embeddings | None = None
+        self._store: SQLiteVec | None = None
+        self._connection: sqlite3.Connection | None = None      # the store's connection, opened here
+        self._has_fts = False
+        self._has_products = False
+        self._quantized: QuantizedIndex | None = None
+        self._ivf: IVFIndex | None = None
+        self._matrix: VectorMatrix | None = None
+        self._answers: SemanticAnswerCache | None = None
+        self._llm = None
+        self._structured: dict[type, object] = {}
+        self._init_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._recent: deque[dict] = deque(maxlen=RAG_RECENT_CALLS)
+        self._totals = {"calls": 0, "inits": 0, "lexical_only": 0, "hybrid": 0, "vector_only": 0, "product_lookup": 0, "batch": 0, "cached_answers": 0,
+                        **{f"{phase}_seconds": 0.0 for phase in PHASES}}
+
+    ######################### Shared objects #############################
+    def embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            with self._init_lock:
+                if self._embeddings is None:
+                    client = self._client or GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+                    self._embeddings = CachedEmbeddings(client, self.cache_file) if self.cache_file else client
+                    self._totals["inits"] += 1
+        return self._embeddings
+
+    def vector_store(self) -> SQLiteVec:
+        if self._store is None:
+            embeddings = self.embeddings()
+            with self._init_lock:
+                if self._store is None:
+                    # Own connection instead of SQLiteVec.create_connection(): it is shared across threads
+                    connection = sqlite3.connect(self.db_file, check_same_thread=False)
+                    connection.row_factory = sqlite3.Row
+                    connection.enable_load_extension(True)
+                    sqlite_vec.load(connection)
+                    connection.enable_load_extension(False)
+                    store = SQLiteVec(table=self.table, connection=connection, embedding=embeddings, db_file=self.db_file)
+                    self._has_fts = HYBRID_RETRIEVAL and has_fts_index(connection, self.table)
+                    self._has_products = has_product_index(connection)
+                    self._quantized = load_quantized_index(connection, self.table) if QUANTIZED_RETRIEVAL else None
+                    self._ivf = IVFIndex(connection, self.table) if IVF_RETRIEVAL and IVFIndex.exists(connection, self.table) else None
+                    matrix = VectorMatrix(self.db_file, Path(self.db_file).parent / "rag_vectors", self.table)
+                    self._matrix = matrix if NUMPY_RETRIEVAL and matrix.exists() else None
+                    self._connection = connection
+                    self._totals["inits"] += 1
+                    # Published last: callers that see a store skip the lock and read the fields above
+                    self._store = store
+        return self._store
+
+    def answer_cache(self) -> SemanticAnswerCache | None:
+        """Answer cache in the sidecar file, None when caching is off (no cache_file or ANSWER_CACHE False)."""
+        if self._answers is None and ANSWER_CACHE and self.cache_file:
+            embeddings = self.embeddings()
+            with self._init_lock:
+                if self._answers is None:
+                    inner = embeddings.inner if isinstance(embeddings, CachedEmbeddings) else embeddings
+                    self._answers = SemanticAnswerCache(f"{model_name(inner)}|{self.llm_model}", self.cache_file)
+        return self._answers
+
+    def structured_llm(self, schema: type):
+        """The chat model bound to `schema` via with_structured_output, built once per schema."""
+        if schema not in self._structured:
+            with self._init_lock:
+                if self._llm is None:
+                    self._llm = init_chat_model(self.llm_model, temperature=self.temperature)
+                    self._totals["inits"] += 1
+                if schema not in self._structured:
+                    self._structured[schema] = self._llm.with_structured_output(schema)
+        return self._structured[schema]
+
+    ######################### Timed calls ################################
+    def begin_call(self) -> dict:
+        return {**{phase: 0.0 for phase in PHASES}, "path": None}
+
+    @contextmanager
+    def timed(self, call: dict, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            call[phase] += time.perf_counter() - started
+
+    def similarity_search(self, query: str, k: int, call: dict) -> list[Document]:
+        return self.similarity_search_batch([query], k, call)[0]
+
+    def similarity_search_batch(self, queries: list[str], k: int, call: dict) -> list[list[Document]]:
+        """Top-k chunks for every query. A call with several queries is recorded under the "batch" path."""
+        with self.timed(call, "setup"):
+            self.vector_store()
+        with self.timed(call, "retrieval"):
+            lexical = [([], False)] * len(queries)
+            if self._has_fts:
+                with self._db_lock:
+                    lexical = [lexical_search(self._connection, self.table, query) for query in queries]
+            pending = [i for i, (_, confident) in enumerate(lexical) if not confident]
+            embeddings = self._embed_queries([queries[i] for i in pending])
+            if len(queries) == 1 and embeddings:
+                call["embedding"] = embeddings[0]
+            vectors = self._vector_rowids(embeddings, FTS_CANDIDATES if self._has_fts else k)
+            rankings = [ids[:k] for ids, _ in lexical]
+            for i, vector in zip(pending, vectors):
+                rankings[i] = reciprocal_rank_fusion([vector, lexical[i][0]], k) if lexical[i][0] else vector[:k]
+            if len(queries) > 1:
+                call["path"] = "batch"
+            else:
+                call["path"] = "lexical_only" if not pending else "hybrid" if lexical[0][0] else "vector_only"
+            documents = self._documents_by_id([rowid for ranking in rankings for rowid in ranking])
+            return [[documents[rowid] for rowid in ranking if rowid in documents] for ranking in rankings]
+
+    def product_documents(self, product_ids: list[int], section: str | None, call: dict) -> dict[int, list[Document]]:
+        """Chunks of each product by key (product_chunks), no embedding or vector search. Products without chunks are left out."""
+        with self.timed(call, "setup"):
+            self.vector_store()
+        with self.timed(call, "retrieval"):
+            if not self._has_products:
+                raise RuntimeError("rag.db has no product_chunks index, run `uv run python src/ingest.py --reindex`")
+            call["path"] = "product_lookup"
+            with self._db_lock:
+                rowids = product_chunk_rowids(self._connection, product_ids, section)
+            return {product_id: self._documents(ids) for product_id, ids in rowids.items()}
+
+    def _embed_queries(self, queries: list[str]) -> list[list[float]]:
+        if not queries:
+            return []
+        embeddings = self.embeddings()
+        if isinstance(embeddings, CachedEmbeddings):
+            return embeddings.embed_queries(queries)
+        return embed_query_batch(embeddings, queries)
+
+    def _vector_rowids(self, embeddings: list[list[float]], k: int) -> list[list[int]]:
+        """Nearest chunk row ids for each embedding: one pass over the NumPy export, else all searches under one hold of the connection."""
+        if self._matrix is not None and embeddings and (found := self._matrix.search(embeddings, k)) is not None:
+            return found
+        with self._db_lock:
+            if self._ivf is not None:
+                return [self._ivf.search(embedding, k) for embedding in embeddings]
+            if self._quantized is not None:
+                return [quantized_search(self._connection, self._quantized, self.table, embedding, k) for embedding in embeddings]
+            return [
+                [row[0] for row in self._connection.execute(
+                    f"SELECT rowid FROM {self.table}_vec WHERE text_embedding MATCH ? AND k = ? ORDER BY distance",
+                    (sqlite_vec.serialize_float32(embedding), k),
+                )]
+                for embedding in embeddings
+            ]
+
+    def _documents_by_id(self, rowids: list[int]) -> dict[int, Document]:
+        rowids = list(dict.fromkeys(rowids))
+        if not rowids:
+            return {}
+        with self._db_lock:
+            rows = self._connection.execute(
+                f"SELECT rowid, text, metadata FROM {self.table} WHERE rowid IN ({', '.join('?' * len(rowids))})", rowids
+            ).fetchall()
+        return {row[0]: Document(id=str(row[0]), page_content=row[1], metadata=json.loads(row[2] or "null") or {}) for row in rows}
+
+    def _documents(self, rowids: list[int]) -> list[Document]:
+        """Chunks for `rowids`, in that order."""
+        by_id = self._documents_by_id(rowids)
+        return [by_id[rowid] for rowid in rowids if rowid in by_id]
+
+    def cached_answer(self, documents: list[Document], call: dict) -> dict | None:
+        """A stored answer for a similar question over the same chunks, None on a miss or with caching off."""
+        # Lexical-only retrieval requested no embedding, and every question naming the same product
+        # gets the same chunks there, so the chunk set says nothing about what was asked
+        cache = self.answer_cache()
+        if cache is None or call["path"] == "lexical_only" or "embedding" not in call:
+            return None
+        with self.timed(call, "retrieval"):
+            answer = cache.lookup(call["embedding"], documents)
+        if answer is not None:
+            call["cached_answer"] = True
+        return answer
+
+    def store_answer(self, question: str, documents: list[Document], answer: dict, call: dict) -> None:
+        if call["path"] != "lexical_only" and "embedding" in call and self.answer_cache() is not None:
+            self._answers.store(question, call["embedding"], documents, answer, call["synthesis"])
+
+    def synthesize(self, schema: type, prompt: str, call: dict):
+        with self.timed(call, "setup"):
+            llm = self.structured_llm(schema)
+        with self.timed(call, "synthesis"):
+            return llm.invoke(prompt)
+
+    def end_call(self, call: dict) -> None:
+        with self._stats_lock:
+            self._totals["calls"] += 1
+            self._totals["cached_answers"] += bool(call.get("cached_answer"))
+            if call["path"]:
+                self._totals[call["path"]] += 1
+            for phase in PHASES:
+                self._totals[f"{phase}_seconds"] += call[phase]
+            self._recent.append({"path": call["path"], **{f"{phase}_ms": round(call[phase] * 1000, 1) for phase in PHASES}})
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            calls = self._totals["calls"]
+            averages = {f"avg_{phase}_ms": round(self._totals[f"{phase}_seconds"] * 1000 / calls, 1) if calls else 0.0 for phase in PHASES}
+            stats = {**self._totals, **averages, "vector_index": self._vector_index(),
+                     "recent": list(self._recent)}
+        if isinstance(self._embeddings, CachedEmbeddings):
+            stats["embedding_cache"] = self._embeddings.stats()
+        if self._matrix is not None:
+            stats["numpy_vectors"] = self._matrix.stats()
+        if self._answers is not None:
+            stats["answer_cache"] = self._answers.stats()
+        return stats
+
+    def _vector_index(self) -> str:
+        if self._matrix is not None and self._matrix.is_fresh():
+            return "numpy"
+        if self._ivf is not None:
+            return "ivf"
+        return self._quantized.mode if self._quantized else "float32"
+
+    def close(self) -> None:
+        with self._init_lock, self._db_lock:
+            if self._store is not None:
+                self._connection.close()
+            if isinstance(self._embeddings, CachedEmbeddings):
+                self._embeddings.close()
+            if self._answers is not None:
+                self._answers.close()
+            # Built again on next use instead of pointing at closed resources
+            self._store = self._connection = self._embeddings = self._answers = None
+            self._quantized = self._ivf = self._matrix = None
+            self._has_fts = self._has_products = False
+
+
+###########################################################################
+##                        SHARED RUNTIME
+###########################################################################
+
+_runtime: RAGRuntime | None = None
+_runtime_lock = threading.Lock()
+
+
+def get_rag_runtime() -> RAGRuntime:
+    """Process-wide runtime for rag.db, created on first use."""
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = RAGRuntime()
+    return _runtime
+
+
+def rag_stats() -> dict:
+    return get_rag_runtime().stats()
@@ -0,0 +1,258 @@
+"""Memory-mapped NumPy backend for vector search: the chunk embeddings of rag.db as one float32 .npy matrix.
+
+The export under db/rag_vectors/ holds embeddings.npy (one row per chunk, in
+rowid order), rowids.npy (the product_knowledge rowid of each row, the text
+and metadata stay in rag.db), their squared norms, and a manifest with the
+fingerprint of the table it was built from. np.load(mmap_mode="r") opens it
+without reading it, so startup is instant and every process shares the
+OS page cache. A batch of query vectors is ranked in one pass: one matrix
+multiply per block of rows plus argpartition, instead of one vec0 scan per
+question. While the export is missing or stale, retrieval stays on sqlite-vec.
+
+Build / refresh after every ingestion:  uv run python src/rag_vectors.py --build   (or ingest.py --vectors)
+Benchmark against sqlite-vec:           uv run python src/rag_vectors.py --bench
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import argparse
+import json
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from rag_ivf import table_vectors
+from rag_quantized import load_sqlite_vec
+from sql_cache import db_signature
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+RAG_DB_FILE = PROJECT_ROOT / "db" / "rag.db"
+RAG_TABLE = "product_knowledge"
+RAG_VECTORS_DIR = PROJECT_ROOT / "db" / "rag_vectors"
+MATRIX_BLOCK_ROWS = 65_536          # matrix rows multiplied at once, bounds the temporary score array
+BENCH_BATCH_SIZES = (1, 5, 10)
+BENCH_RUNS = 20
+BENCH_K = 5
+
+console = Console()
+
+
+###########################################################################
+##                            EXPORT
+###########################################################################
+
+
+def _fingerprint(conn: sqlite3.Connection, table: str) -> list[int]:
+    """(chunks, max rowid, CRC of the last embedding): changes on every ingestion, reindexing does not touch it."""
+    count, last = conn.execute(f"SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM {table}").fetchone()
+    embedding = conn.execute(f"SELECT text_embedding FROM {table} WHERE rowid = ?", (last,)).fetchone()
+    return [count, last, zlib.crc32(embedding[0]) if embedding else 0]
+
+
+def build_vector_export(db_file: Path = RAG_DB_FILE, table: str = RAG_TABLE, out_dir: Path = RAG_VECTORS_DIR) -> dict:
+    """Write the embeddings of `table` to out_dir, streamed in batches. Returns the manifest."""
+    staging = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    conn = sqlite3.connect(str(db_file))
+    try:
+        fingerprint = _fingerprint(conn, table)
+        rows, matrix, norms, rowids, filled = fingerprint[0], None, None, None, 0
+        for batch_ids, vectors in table_vectors(conn, table):
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(staging / "embeddings.npy", mode="w+", dtype=np.float32, shape=(rows, vectors.shape[1]))
+                norms = np.empty(rows, dtype=np.float32)
+                rowids = np.empty(rows, dtype=np.int64)
+            matrix[filled:filled + len(batch_ids)] = vectors
+            norms[filled:filled + len(batch_ids)] = (vectors * vectors).sum(axis=1)
+            rowids[filled:filled + len(batch_ids)] = batch_ids
+            filled += len(batch_ids)
+    finally:
+        conn.close()
+    if matrix is None:
+        shutil.rmtree(staging)
+        raise RuntimeError(f"{table} has no embeddings to export")
+    dims = matrix.shape[1]
+    matrix.flush()
+    del matrix
+    np.save(staging / "norms.npy", norms)
+    np.save(staging / "rowids.npy", rowids)
+
+    manifest = {"table": table, "fingerprint": fingerprint, "rows": filled, "dims": dims}
+    (staging / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    shutil.rmtree(out_dir, ignore_errors=True)
+    staging.rename(out_dir)
+    return manifest
+
+
+###########################################################################
+##                            MATRIX
+###########################################################################
+
+
+class VectorMatrix:
+    """Exact L2 top-k over the memory-mapped export, for many query vectors at once."""
+
+    def __init__(self, db_file: Path = RAG_DB_FILE, data_dir: Path = RAG_VECTORS_DIR, table: str = RAG_TABLE):
+        self.db_file = Path(db_file)
+        self.data_dir = Path(data_dir)
+        self.table = table
+        self._embeddings: np.ndarray | None = None
+        self._norms: np.ndarray | None = None
+        self._rowids: np.ndarray | None = None
+        self._fresh_for = None
+        self._lock = threading.Lock()
+        self._stats = {"searches": 0, "queries": 0, "stale": 0, "seconds": 0.0}
+
+    def exists(self) -> bool:
+        return (self.data_dir / "manifest.json").exists()
+
+    def is_fresh(self) -> bool:
+        """True if the export matches rag.db (re-checked only when the db file changes)."""
+        return self._arrays() is not None
+
+    def _arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+        """(embeddings, norms, rowids) taken together under the lock, None while the export is stale."""
+        signature = db_signature(self.db_file)
+        with self._lock:
+            if signature == self._fresh_for:
+                return self._embeddings, self._norms, self._rowids
+            self._embeddings = self._norms = self._rowids = None
+            path = self.data_dir / "manifest.json"
+            if not path.exists():
+                return None
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+            conn = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True)
+            try:
+                fresh = manifest["table"] == self.table and _fingerprint(conn, self.table) == manifest["fingerprint"]
+            finally:
+                conn.close()
+            if not fresh:
+                return None
+            self._embeddings = np.load(self.data_dir / "embeddings.npy", mmap_mode="r")
+            self._norms = np.load(self.data_dir / "norms.npy", mmap_mode="r")
+            self._rowids = np.load(self.data_dir / "rowids.npy", mmap_mode="r")
+            self._fresh_for = signature
+            return self._embeddings, self._norms, self._rowids
+
+    def search(self, queries: list[list[float]] | np.ndarray, k: int) -> list[list[int]] | None:
+        """Row ids of the k nearest chunks (L2) for every query, nearest first. None while the export is stale."""
+        arrays = self._arrays()
+        if arrays is None:
+            with self._lock:
+                self._stats["stale"] += 1
+            return None
+        started = time.perf_counter()
+        embeddings, norms, rowids = arrays
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(rowids))
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(rowids), MATRIX_BLOCK_ROWS):
+            block = embeddings[start:start + MATRIX_BLOCK_ROWS]
+            # |e - q|^2 = |e|^2 - 2 e.q + |q|^2, and |q|^2 does not change a query's ranking
+            scores = norms[start:start + MATRIX_BLOCK_ROWS] - 2 * queries @ block.T
+            top = np.argpartition(scores, k - 1, axis=1)[:, :k] if scores.shape[1] > k else np.tile(np.arange(scores.shape[1]), (len(queries), 1))
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            if best_rows.shape[1] > k:
+                keep = np.argpartition(best_scores, k - 1, axis=1)[:, :k]
+                best_rows, best_scores = np.take_along_axis(best_rows, keep, axis=1), np.take_along_axis(best_scores, keep, axis=1)
+        order = np.argsort(best_scores, axis=1, kind="stable")
+        result = rowids[np.take_along_axis(best_rows, order, axis=1)].tolist()
+        with self._lock:
+            self._stats["searches"] += 1
+            self._stats["queries"] += len(queries)
+            self._stats["seconds"] += time.perf_counter() - started
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            shape = None if self._embeddings is None else list(self._embeddings.shape)
+            return {"matrix": shape, **self._stats}
+
+
+###########################################################################
+##                           BENCHMARK
+###########################################################################
+
+
+def benchmark(db_file: Path = RAG_DB_FILE, table: str = RAG_TABLE, k: int = BENCH_K) -> list[tuple[str, int, float]]:
+    """(backend, questions per batch, ms per batch): one vectorized pass vs one vec0 KNN query per question."""
+    matrix = VectorMatrix(db_file, table=table)
+    if not matrix.is_fresh():
+        raise RuntimeError("the vector export is missing or stale, run with --build first")
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(matrix._rowids), size=max(BENCH_BATCH_SIZES), replace=False)
+    queries = np.asarray(matrix._embeddings[np.sort(picks)])
+
+    conn = sqlite3.connect(str(db_file))
+    try:
+        load_sqlite_vec(conn)
+    except AttributeError:
+        conn = None
+        console.print("[yellow]This Python's sqlite3 cannot load extensions, sqlite-vec is left out of the benchmark.[/]")
+
+    def timed(function) -> float:
+        function()
+        started = time.perf_counter()
+        for _ in range(BENCH_RUNS):
+            function()
+        return (time.perf_counter() - started) * 1000 / BENCH_RUNS
+
+    report = []
+    for size in BENCH_BATCH_SIZES:
+        batch = queries[:size]
+        report.append(("numpy, one pass", size, timed(lambda: matrix.search(batch, k))))
+        report.append(("numpy, per question", size, timed(lambda: [matrix.search(query, k) for query in batch])))
+        if conn is not None:
+            report.append(("sqlite-vec, per question", size, timed(lambda: [conn.execute(
+                f"SELECT rowid FROM {table}_vec WHERE text_embedding MATCH ? AND k = ? ORDER BY distance", (query.tobytes(), k)
+            ).fetchall() for query in batch])))
+    if conn is not None:
+        conn.close()
+    return report
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory-mapped NumPy export of the rag.db chunk embeddings")
+    parser.add_argument("--db", type=Path, default=RAG_DB_FILE, help="rag.db to export / benchmark")
+    parser.add_argument("--build", action="store_true", help="(re)build the export")
+    parser.add_argument("--bench", action="store_true", help="time batched NumPy search against sqlite-vec")
+    args = parser.parse_args()
+
+    if args.build or not (RAG_VECTORS_DIR / "manifest.json").exists():
+        started = time.perf_counter()
+        manifest = build_vector_export(args.db)
+        console.print(f"[green]Exported[/] {manifest['rows']} x {manifest['dims']} embeddings to {RAG_VECTORS_DIR} "
+                      f"in {time.perf_counter() - started:.1f}s")
+    if args.bench:
+        table = Table(title=f"Vector search, k={BENCH_K}, mean of {BENCH_RUNS} runs")
+        for column in ("Backend", "Questions", "ms / batch", "ms / question"):
+            table.add_column(column, justify="left" if column == "Backend" else "right")
+        for backend, size, ms in benchmark(args.db):
+            table.add_row(backend, str(size), f"{ms:.2f}", f"{ms / size:.2f}")
+        console.print(table)
@@ -0,0 +1,408 @@
+"""Pre-aggregated sales rollups in sales.db and transparent query rewriting onto them.
+
+Build / refresh after every data load:  uv run python src/rollups.py
+
+A rollup is used only while transactions still matches the row count, max id and
+line_total / quantity totals it was built from. Inserts, deletes and edits of the
+measures are caught; an UPDATE that only moves rows between products, stores,
+months or transaction types is not, so rebuild after one.
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from rich.console import Console
+from rich.table import Table
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from models import TransactionDB
+from sql_cache import Token, db_signature, from_tables, sql_words, tokenize_sql
+from sql_pool import DB_PATH
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+# Every rollup is grouped by its grain + transaction_type and carries SUM(line_total),
+# SUM(quantity), SUM(line_total_usd) once migrations.py has added it, and the number of
+# transaction lines it replaces (line_count).
+# Category and country are not separate grains: products/stores are tiny and join
+# onto the product/store rollups in microseconds.
+BASE_ROLLUP = "rollup_sales_product_store_month"
+ROLLUPS = {
+    BASE_ROLLUP: ("product_id", "store_id", "sale_month"),
+    "rollup_sales_product_month": ("product_id", "sale_month"),
+    "rollup_sales_store_month": ("store_id", "sale_month"),
+    "rollup_sales_product_store": ("product_id", "store_id"),
+    "rollup_sales_product": ("product_id",),
+    "rollup_sales_store": ("store_id",),
+    "rollup_sales_month": ("sale_month",),
+}
+ROLLUP_META = "rollup_meta"
+
+DIMENSIONS = {"product_id", "store_id", "transaction_type", "sale_month"}
+MEASURES = {"line_total", "quantity", "line_total_usd"}
+TX_COLUMNS = set(TransactionDB.model_fields)
+
+REJECTED_KEYWORDS = {"with", "union", "intersect", "except", "over", "window", "values"}
+# Outer joins count unmatched rows the rollup has no line for; NATURAL / USING join on
+# whatever columns the rollup happens to share, which is not the query's join condition
+REJECTED_JOINS = {"natural", "using", "left", "right", "full", "outer"}
+REJECTED_AGGREGATES = {"avg", "group_concat", "string_agg", "json_group_array", "json_group_object"}
+AGGREGATES = {"sum", "total", "count", "min", "max"} | REJECTED_AGGREGATES
+
+console = Console()
+
+
+###########################################################################
+##                            BUILDER
+###########################################################################
+
+
+def _source_fingerprint(conn: sqlite3.Connection) -> tuple[int, int, float, float]:
+    return tuple(conn.execute(
+        "SELECT COUNT(*), COALESCE(MAX(id), 0), TOTAL(line_total), TOTAL(quantity) FROM transactions"
+    ).fetchone())
+
+
+def _meta_columns(conn: sqlite3.Connection) -> list[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({ROLLUP_META})")]
+
+
+def build_rollups(db_path: Path = DB_PATH) -> list[tuple[str, int, float]]:
+    """(Re)build every rollup table. Returns (name, rows, seconds) per rollup."""
+    conn = sqlite3.connect(str(db_path))
+    report = []
+    try:
+        if "source_line_total" not in _meta_columns(conn):
+            conn.execute(f"DROP TABLE IF EXISTS {ROLLUP_META}")   # written before totals were fingerprinted
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ROLLUP_META} (
+                name TEXT PRIMARY KEY, grain TEXT, row_count INTEGER,
+                source_rows INTEGER, source_max_id INTEGER, source_line_total REAL, source_quantity REAL, built_at TEXT
+            )
+        """)
+        fingerprint = _source_fingerprint(conn)
+        tx_columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(transactions)")}
+        usd_sum = "SUM(line_total_usd) AS line_total_usd," if "line_total_usd" in tx_columns else ""
+
+        for name, grain in ROLLUPS.items():
+            started = time.perf_counter()
+            keys = ", ".join((*grain, "transaction_type"))
+            if name == BASE_ROLLUP:
+                # The finest grain scans transactions once, every coarser grain re-aggregates it
+                select_keys = keys.replace("sale_month", "SUBSTR(date, 1, 7) AS sale_month")
+                source, count_expr = "transactions", "COUNT(*)"
+            else:
+                select_keys, source, count_expr = keys, BASE_ROLLUP, "SUM(line_count)"
+
+            conn.execute(f"DROP TABLE IF EXISTS {name}")
+            conn.execute(f"""
+                CREATE TABLE {name} AS
+                SELECT {select_keys},
+                       SUM(line_total) AS line_total,
+                       SUM(quantity) AS quantity,
+                       {usd_sum}
+                       {count_expr} AS line_count
+                FROM {source}
+                GROUP BY {keys}
+            """)
+            conn.execute(f"CREATE INDEX ix_{name} ON {name} ({keys})")
+            row_count = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+            conn.execute(
+                f"INSERT OR REPLACE INTO {ROLLUP_META} VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+                (name, ",".join(grain), row_count, *fingerprint),
+            )
+            conn.commit()
+            report.append((name, row_count, time.perf_counter() - started))
+    finally:
+        conn.close()
+    return report
+
+
+###########################################################################
+##                         QUERY REWRITING
+###########################################################################
+
+
+class RollupPlan(NamedTuple):
+    required: set[str]                    # grain columns the rollup must have
+    edits: list[tuple[int, int, str]]     # (start, end, replacement) char spans in the original SQL
+    table_span: tuple[int, int]           # where the transactions table name sits
+    aliased: bool                         # transactions has its own alias (t) in the query
+
+
+def _matching_paren(words: list[str], open_idx: int) -> int:
+    depth = 0
+    for i in range(open_idx, len(words)):
+        if words[i] == "(":
+            depth += 1
+        elif words[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def _select_items(tokens: list[Token], words: list[str]) -> list[tuple[int, int, bool]]:
+    """(first, last, has_alias) token ranges of the top-level SELECT list."""
+    start = words.index("select") + 1
+    if start < len(words) and words[start] in ("distinct", "all"):
+        start += 1
+    items, depth, first = [], 0, start
+    for i in range(start, len(words)):
+        if words[i] == "(":
+            depth += 1
+        elif words[i] == ")":
+            depth -= 1
+        elif depth == 0 and words[i] in (",", "from"):
+            items.append((first, i - 1))
+            first = i + 1
+            if words[i] == "from":
+                break
+    result = []
+    for first, last in items:
+        has_alias = last > first and tokens[last].kind in ("word", "quoted") and words[last] != "end" and (
+            words[last - 1] in ("as", ")") or tokens[last - 1].kind in ("word", "quoted")
+        )
+        result.append((first, last, has_alias))
+    return result
+
+
+def _span(tokens: list[Token], first: int, last: int) -> tuple[int, int]:
+    return tokens[first].start, tokens[last].start + len(tokens[last].text)
+
+
+def plan_rollup_rewrite(sql: str) -> RollupPlan | None:
+    """Decide whether a query over transactions can be answered from a rollup.
+
+    A query qualifies when it aggregates, touches transactions only through
+    product_id / store_id / transaction_type / sale_month / SUBSTR(date, 1, 7), counts lines
+    with COUNT(*) and uses line_total / quantity / line_total_usd only as direct SUM() arguments
+    (or as a CASE branch inside SUM whose other branches are 0 or NULL).
+    Inner joins and filters on other tables are fine: SUM/COUNT over the rollup equals
+    SUM/COUNT over the lines it replaces for any join keyed on those columns. Outer,
+    NATURAL and USING joins are not routed.
+    """
+    tokens = tokenize_sql(sql)
+    if tokens and tokens[-1].text == ";":
+        tokens = tokens[:-1]
+    words = sql_words(tokens)
+    if words.count("select") != 1 or (REJECTED_KEYWORDS | REJECTED_JOINS) & set(words):
+        return None
+
+    ######################### Tables and aliases ##########################
+    tables = from_tables(tokens, words)
+    table_names = {alias or table for _, table, alias in tables}
+    tx_refs = [(index, alias) for index, table, alias in tables if table == "transactions"]
+    if len(tx_refs) != 1:
+        return None
+    tx_index, tx_alias = tx_refs[0]
+    qualifier = tx_alias or "transactions"
+
+    has_aggregate = any(words[i] in AGGREGATES and words[i + 1] == "(" for i in range(len(words) - 1))
+    if not (has_aggregate or "group" in words):
+        return None
+    select_items = _select_items(tokens, words)
+    if any(words[first:last + 1] == ["*"] or words[first + 1:last + 1] == [".", "*"] for first, last, _ in select_items):
+        return None  # the rollup's columns are not the transaction line's
+    output_aliases = {words[i + 1] for i in range(len(words) - 1) if words[i] == "as" and tokens[i + 1].kind == "word"}
+    output_aliases |= {words[last] for _, last, has_alias in select_items if has_alias}
+    # Where a name is an output alias rather than a column: where it is defined, and as a whole ORDER BY
+    # term (SQLite resolves a bare ORDER BY name to the alias first, everywhere else to the column)
+    alias_refs = {i + 1 for i in range(len(words) - 1) if words[i] == "as"}
+    alias_refs |= {last for _, last, has_alias in select_items if has_alias}
+    if "order" in words and words[words.index("order") + 1] == "by":
+        term = words.index("order") + 2
+        while term < len(words):
+            end = term
+            while end < len(words) and words[end] not in (",", "limit"):
+                end += 1
+            if words[term] in output_aliases and all(w in ("asc", "desc") for w in words[term + 1:end]):
+                alias_refs.add(term)
+            if end >= len(words) or words[end] == "limit":
+                break
+            term = end + 1
+
+    # Innermost enclosing function call for every token
+    enclosing, stack = [], []
+    for i, word in enumerate(words):
+        enclosing.append(stack[-1] if stack else "")
+        if word == "(":
+            stack.append(words[i - 1] if i > 0 and tokens[i - 1].kind == "word" else "")
+        elif word == ")" and stack:
+            stack.pop()
+
+    required: set[str] = set()
+    rewrites: list[tuple[int, int, str]] = []   # (first token, last token, replacement)
+
+    ######################### Aggregate calls ##############################
+    for i in range(len(words) - 1):
+        if words[i] not in AGGREGATES or words[i + 1] != "(":
+            continue
+        close = _matching_paren(words, i + 1)
+        if words[i] in REJECTED_AGGREGATES or close < 0:
+            return None
+        arg = words[i + 2:close]
+        if words[i] == "count":
+            if arg == ["*"]:
+                # COUNT(*) over no lines is 0, SUM over no rollup rows is NULL
+                rewrites.append((i, close, f"COALESCE(SUM({qualifier}.line_count), 0)"))
+            elif not arg or arg[0] != "distinct":
+                return None
+        elif words[i] in ("sum", "total"):
+            if not MEASURES & set(arg):
+                return None  # SUM over anything but a measure depends on line multiplicity
+            for k in range(i + 2, close):
+                if words[k] not in ("then", "else"):
+                    continue
+                end = k + 1
+                while end < close and words[end] not in ("when", "else", "end"):
+                    end += 1
+                branch = words[k + 1:end]
+                # A measure, 0 or NULL; any other constant (-1, 1) would need multiplying by line_count
+                measure = bool(branch) and branch[-1] in MEASURES and branch[:-1] in ([], [qualifier, "."])
+                zero = len(branch) == 1 and (branch[0] == "null" or (tokens[k + 1].kind == "number" and branch[0].strip("0.") == ""))
+                if not (measure or zero):
+                    return None
+
+    ######################### Column references ############################
+    for i, token in enumerate(tokens):
+        if token.kind != "word" or i == tx_index:
+            continue
+        word = words[i]
+        nxt = words[i + 1] if i + 1 < len(words) else ""
+        if i > 0 and words[i - 1] == ".":
+            if i < 2 or words[i - 2] != qualifier:
+                continue
+            ref_start = i - 2
+        elif nxt in (".", "(") or word not in TX_COLUMNS or i in alias_refs or word in table_names:
+            continue
+        else:
+            ref_start = i
+
+        if word in DIMENSIONS:
+            if word != "transaction_type":
+                required.add(word)
+        elif word == "date":
+            # Only the monthly bucket SUBSTR(<date>, 1, 7) can be served from sale_month
+            if words[ref_start - 2:ref_start] != ["substr", "("] or words[i + 1:i + 6] != [",", "1", ",", "7", ")"]:
+                return None
+            rewrites.append((ref_start - 2, i + 5, f"{qualifier}.sale_month"))
+            required.add("sale_month")
+        elif word in MEASURES:
+            if enclosing[i] not in ("sum", "total"):
+                return None
+            if words[ref_start - 1] not in ("(", "then", "else") or nxt not in (")", "else", "end", "when"):
+                return None
+        else:
+            return None
+
+    ######################### Edits ##########################################
+    edits = [(*_span(tokens, first, last), text) for first, last, text in rewrites]
+    for first, last, has_alias in select_items:
+        # Unaliased select items keep the column name SQLite derives from their original text
+        if not has_alias and any(first <= a and b <= last for a, b, _ in rewrites):
+            start, end = _span(tokens, first, last)
+            edits.append((end, end, ' AS "' + sql[start:end].replace('"', '""') + '"'))
+
+    return RollupPlan(required, edits, _span(tokens, tx_index, tx_index), tx_alias is not None)
+
+
+###########################################################################
+##                            ROUTER
+###########################################################################
+
+
+class RollupRouter:
+    """Routes qualifying aggregate queries to the smallest fresh rollup table."""
+
+    def __init__(self, db_path: Path = DB_PATH):
+        self.db_path = Path(db_path)
+        self._catalog: dict[str, tuple[set[str], int]] = {}
+        self._signature = None
+        self._lock = threading.Lock()
+        self._stats = {"routed": 0, "not_eligible": 0, "no_rollup": 0}
+
+    def _load_catalog(self) -> dict[str, tuple[set[str], int]]:
+        """Rollups whose source fingerprint still matches transactions (re-read when sales.db changes)."""
+        signature = db_signature(self.db_path)
+        with self._lock:
+            if signature == self._signature:
+                return self._catalog
+            catalog = {}
+            conn = sqlite3.connect(f"file:{self.db_path.as_posix()}?mode=ro", uri=True)
+            try:
+                # No meta table, or one from before totals were fingerprinted: no rollup is trusted
+                if "source_line_total" in _meta_columns(conn):
+                    source = _source_fingerprint(conn)
+                    for name, grain, row_count, *built_from in conn.execute(
+                        f"SELECT name, grain, row_count, source_rows, source_max_id, source_line_total, source_quantity FROM {ROLLUP_META}"
+                    ):
+                        if tuple(built_from) == source and name in ROLLUPS:
+                            catalog[name] = (set(grain.split(",")), row_count)
+            finally:
+                conn.close()
+            self._catalog, self._signature = catalog, signature
+            return catalog
+
+    def rewrite(self, sql: str) -> str | None:
+        """Return the query rewritten onto a rollup, or None if it must hit transactions."""
+        plan = plan_rollup_rewrite(sql)
+        if plan is None:
+            self._stats["not_eligible"] += 1
+            return None
+
+        candidates = [(rows, name) for name, (grain, rows) in self._load_catalog().items() if plan.required <= grain]
+        if not candidates:
+            self._stats["no_rollup"] += 1
+            return None
+        _, rollup = min(candidates)
+
+        table = rollup if plan.aliased else f"{rollup} AS transactions"
+        pieces, cursor = [], 0
+        for start, end, text in sorted([*plan.edits, (*plan.table_span, table)]):
+            pieces.append(sql[cursor:start])
+            pieces.append(text)
+            cursor = end
+        pieces.append(sql[cursor:])
+
+        self._stats["routed"] += 1
+        return "".join(pieces)
+
+    def stats(self) -> dict:
+        return {"rollups": sorted(self._load_catalog()), **self._stats}
+
+
+ROLLUP_ROUTER = RollupRouter()
+
+
+def rollup_stats() -> dict:
+    return ROLLUP_ROUTER.stats()
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    table = Table(title="Sales rollups")
+    table.add_column("Rollup")
+    table.add_column("Rows", justify="right")
+    table.add_column("Seconds", justify="right")
+    for name, rows, seconds in build_rollups():
+        table.add_row(name, f"{rows:,}", f"{seconds:.2f}")
+    console.print(table)
+    console.print(f"[green]Done[/] in {time.perf_counter() - started:.2f}s")
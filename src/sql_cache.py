@@ -0,0 +1,275 @@
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from sql_pool import DB_PATH
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+SQL_CACHE_MAX_BYTES = 64 * 1024 * 1024   # approximate memory budget for cached results
+SQL_CACHE_MAX_ENTRIES = 2048
+
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<ws>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+    | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<param>[?:@$][A-Za-z0-9_]*)
+    | (?P<op>\|\||<=|>=|<>|!=|==|<<|>>|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_FROM_TERMINATORS = {"where", "group", "order", "limit", "having", "window"}
+_JOIN_KEYWORDS = {"join", "inner", "left", "right", "full", "cross", "natural", "outer", "on", "using"} | _FROM_TERMINATORS
+
+
+###########################################################################
+##                         SQL TOKENIZER
+###########################################################################
+
+
+class Token(NamedTuple):
+    kind: str      # ws, comment, string, quoted, number, word, param, op
+    text: str
+    start: int     # offset into the original SQL, so callers can splice rewrites
+
+
+def tokenize_sql(sql: str, keep_trivia: bool = False) -> list[Token]:
+    """Split SQL into tokens. Whitespace and comments are dropped unless keep_trivia is set."""
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if not keep_trivia and kind in ("ws", "comment"):
+            continue
+        tokens.append(Token(kind, match.group(), match.start()))
+    return tokens
+
+
+def sql_words(tokens: list[Token]) -> list[str]:
+    """Token texts with bare words lowercased, for keyword/identifier matching."""
+    return [t.text.lower() if t.kind == "word" else t.text for t in tokens]
+
+
+def from_tables(tokens: list[Token], words: list[str]) -> list[tuple[int, str, str | None]]:
+    """(token index, table, alias) for every table in the first FROM clause (FROM lists and JOINs)."""
+    if "from" not in words:
+        return []
+    from_idx = words.index("from")
+    from_end = next((i for i in range(from_idx, len(words)) if words[i] in _FROM_TERMINATORS), len(words))
+    tables = []
+    for i in range(from_idx, from_end - 1):
+        if words[i] not in ("from", "join", ",") or tokens[i + 1].kind != "word":
+            continue
+        alias, j = None, i + 2
+        if j < from_end and words[j] == "as":
+            j += 1
+        if j < from_end and tokens[j].kind == "word" and words[j] not in _JOIN_KEYWORDS:
+            alias = words[j]
+        tables.append((i + 1, words[i + 1], alias))
+    return tables
+
+
+def _canonical_number(text: str) -> str:
+    if text[:2].lower() == "0x":
+        return str(int(text, 16))
+    if any(ch in text for ch in ".eE"):
+        return repr(float(text))
+    return str(int(text))
+
+
+def normalize_sql(sql: str) -> str:
+    """Canonical form of a query for cache keys.
+
+    Whitespace and comments collapse, keywords and bare identifiers are lowercased
+    (SQLite treats them case-insensitively), numeric literals are reformatted
+    (007 -> 7, 1.50 -> 1.5, 0x10 -> 16) and a trailing semicolon is dropped.
+    String literals and quoted identifiers keep their exact text.
+    """
+    parts = []
+    for token in tokenize_sql(sql):
+        if token.kind == "word":
+            parts.append(token.text.lower())
+        elif token.kind == "number":
+            parts.append(_canonical_number(token.text))
+        elif token.kind == "quoted":
+            parts.append('"' + token.text[1:-1] + '"')
+        else:
+            parts.append(token.text)
+    while parts and parts[-1] == ";":
+        parts.pop()
+    return " ".join(parts)
+
+
+_SELECT_LIST_END = {"from", "where", "group", "order", "limit", "having", "window", "union", "intersect", "except", ";"}
+
+
+def _header_terms(tokens: list[Token], sql: str) -> list[str]:
+    """What decides each result column name of the outer SELECT: the alias as typed, the verbatim
+    text of an unaliased expression, "" for a plain column (SQLite reports its declared name).
+    """
+    words = sql_words(tokens)
+    if "select" not in words:
+        return []
+    start = words.index("select") + 1
+    if start < len(words) and words[start] in ("distinct", "all"):
+        start += 1
+    items, depth, first = [], 0, start
+    for i in range(start, len(words) + 1):
+        word = words[i] if i < len(words) else ";"
+        if word == "(":
+            depth += 1
+        elif word == ")":
+            depth -= 1
+        elif depth == 0 and (word == "," or word in _SELECT_LIST_END):
+            items.append((first, i - 1))
+            first = i + 1
+            if word != ",":
+                break
+    terms = []
+    for first, last in items:
+        if last < first:
+            continue
+        if all(tokens[i].kind in ("word", "quoted") if (i - first) % 2 == 0 else words[i] == "." for i in range(first, last + 1)) \
+                or words[last] == "*":
+            terms.append("")
+        elif last > first and tokens[last].kind in ("word", "quoted") and words[last] != "end" and (
+            words[last - 1] in ("as", ")") or tokens[last - 1].kind in ("word", "quoted")
+        ):
+            terms.append(tokens[last].text)
+        else:
+            terms.append(sql[tokens[first].start:tokens[last].start + len(tokens[last].text)])
+    return terms
+
+
+def result_cache_key(sql: str) -> str:
+    """normalize_sql() plus what decides the result's column names, which keep their case and spelling:
+    'SUM(x) AS Revenue' and 'sum(x) as revenue' share rows but not headers.
+    """
+    return normalize_sql(sql) + "\n" + "\x1f".join(_header_terms(tokenize_sql(sql), sql))
+
+
+###########################################################################
+##                         RESULT CACHE
+###########################################################################
+
+
+def db_signature(db_path: Path = DB_PATH) -> tuple:
+    """Cheap fingerprint of the database files; any committed write changes it."""
+    signature = []
+    for suffix in ("", "-wal"):
+        try:
+            stat = os.stat(f"{db_path}{suffix}")
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _estimate_size(value) -> int:
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class SQLResultCache:
+    """LRU cache of query results keyed on result_cache_key(), bounded by an approximate byte budget.
+
+    Every entry belongs to the db_signature() it was computed under. As soon as
+    the signature moves (sales.db or its WAL was written) the whole cache is dropped.
+    """
+
+    def __init__(self, db_path: Path = DB_PATH, max_bytes: int = SQL_CACHE_MAX_BYTES, max_entries: int = SQL_CACHE_MAX_ENTRIES):
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[object, int]] = OrderedDict()
+        self._bytes = 0
+        self._signature = db_signature(self.db_path)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def signature(self) -> tuple:
+        return db_signature(self.db_path)
+
+    def _check_signature(self, signature: tuple) -> None:
+        if signature != self._signature:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._signature = signature
+
+    def get(self, key: str, signature: tuple | None = None):
+        signature = signature if signature is not None else self.signature()
+        with self._lock:
+            self._check_signature(signature)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key: str, value, signature: tuple) -> None:
+        """Store a result computed under `signature` (taken before the query ran)."""
+        size = _estimate_size(value) + sys.getsizeof(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if signature != self.signature():
+                return  # the database changed while the query was running
+            self._check_signature(signature)
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                **self._stats,
+            }
+
+
+###########################################################################
+##                         SHARED CACHE
+###########################################################################
+
+RESULT_CACHE = SQLResultCache()
+
+
+def cache_stats() -> dict:
+    return RESULT_CACHE.stats()
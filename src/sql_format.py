@@ -0,0 +1,173 @@
+"""Renderers for query_sql results: the original pipe table and a compact, token-efficient TSV.
+
+Compare both on a query:  uv run python src/sql_format.py "SELECT ..."
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import re
+import sys
+from collections import Counter
+
+from rich.console import Console
+from rich.table import Table
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+SQL_RESULT_FORMAT = "compact"     # "compact" or "table" (the original pipe-separated layout)
+FLOAT_SIG_DIGITS = 6              # significant digits kept for floats
+MIN_DECIMALS = 2                  # ... but never fewer decimals than this (cents) for values from 1 up
+MIN_DICT_RATIO = 0.5              # dictionary-encode a text column when distinct/rows is below this
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+console = Console()
+
+
+###########################################################################
+##                           ENCODERS
+###########################################################################
+
+
+def _format_number(value: float) -> str:
+    """Round floats for reading to FLOAT_SIG_DIGITS significant digits (rates, ratios, coordinates:
+    -122.4194 -> -122.419), keeping at least MIN_DECIMALS decimals and no exponent on large ones
+    (money: 1234567.891 -> 1234567.89).
+    """
+    if value != value or value in (float("inf"), float("-inf")):
+        return str(value)
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    if abs(value) < 1:
+        return f"{value:.{FLOAT_SIG_DIGITS}g}"
+    decimals = max(FLOAT_SIG_DIGITS - len(str(int(abs(value)))), MIN_DECIMALS)
+    return f"{value:.{decimals}f}".rstrip("0").rstrip(".")
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return _format_number(value)
+    return str(value).replace("\t", " ").replace("\n", " ")
+
+
+def _footer(shown: int, total: int, handle: str | None) -> str:
+    footer = f"... ({total} total rows, showing first {shown})"
+    if handle:
+        footer += f" handle={handle}: more rows with fetch_sql_page, column stats with summarize_sql_result"
+    return footer
+
+
+def format_table(columns: list[str], rows: list[tuple], total: int, handle: str | None = None) -> str:
+    """The original query_sql layout: pipe-separated values with full float precision."""
+    if not rows:
+        return "Query returned 0 rows."
+
+    result_lines = [" | ".join(columns)]
+    result_lines.append("-" * len(result_lines[0]))
+    for row in rows:
+        result_lines.append(" | ".join(str(value) for value in row))
+
+    if total > len(rows):
+        result_lines.append(_footer(len(rows), total, handle))
+
+    return "\n".join(result_lines)
+
+
+def format_compact(columns: list[str], rows: list[tuple], total: int, handle: str | None = None) -> str:
+    """TSV with rounded numbers, constant columns lifted into a header note and
+    repeated long strings replaced by short codes (~1, ~2, ...) with a legend.
+    """
+    if not rows:
+        return "Query returned 0 rows."
+
+    cells = [[_cell(value) for value in row] for row in rows]
+    notes = []
+    keep = list(range(len(columns)))
+
+    ######################### Constant columns ############################
+    if len(rows) > 1 and total == len(rows):   # a truncated result may differ beyond the shown rows
+        constant = [i for i in keep if len({row[i] for row in cells}) == 1]
+        if constant and len(constant) < len(columns):
+            notes.append("# all rows: " + ", ".join(f"{columns[i]}={cells[0][i]}" for i in constant))
+            keep = [i for i in keep if i not in constant]
+
+    ######################### Dictionary encoding ##########################
+    for i in keep:
+        values = [row[i] for row in cells]
+        if not all(isinstance(row[i], str) for row in rows):
+            continue
+        counts = Counter(values)
+        if len(counts) / len(values) >= MIN_DICT_RATIO:
+            continue
+        codes = {value: f"~{n}" for n, (value, _) in enumerate(counts.most_common(), 1)}
+        legend = f"# {columns[i]}: " + ", ".join(f"{code}={value}" for value, code in codes.items())
+        # Short values (China, Sale) already cost about as much as a code; only encode when it pays off
+        encoded = estimate_tokens(legend) + sum(estimate_tokens(code) * counts[value] for value, code in codes.items())
+        if encoded >= sum(estimate_tokens(value) * count for value, count in counts.items()):
+            continue
+        notes.append(legend)
+        for row in cells:
+            row[i] = codes[row[i]]
+
+    result_lines = notes + ["\t".join(columns[i] for i in keep)]
+    result_lines += ["\t".join(row[i] for i in keep) for row in cells]
+    if total > len(rows):
+        result_lines.append(_footer(len(rows), total, handle))
+    return "\n".join(result_lines)
+
+
+def format_result(columns: list[str], rows: list[tuple], total: int, handle: str | None = None, mode: str = SQL_RESULT_FORMAT) -> str:
+    if mode == "table":
+        return format_table(columns, rows, total, handle)
+    return format_compact(columns, rows, total, handle)
+
+
+###########################################################################
+##                          TOKEN REPORT
+###########################################################################
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count: word pieces of ~4 characters plus one per punctuation mark."""
+    return sum(max(1, len(piece) // 4) if piece[0].isalnum() else 1 for piece in TOKEN_RE.findall(text))
+
+
+def token_report(columns: list[str], rows: list[tuple], total: int) -> dict:
+    table = format_table(columns, rows, total)
+    compact = format_compact(columns, rows, total)
+    table_tokens, compact_tokens = estimate_tokens(table), estimate_tokens(compact)
+    return {
+        "table_chars": len(table),
+        "compact_chars": len(compact),
+        "table_tokens": table_tokens,
+        "compact_tokens": compact_tokens,
+        "saved_pct": round(100 * (1 - compact_tokens / table_tokens), 1) if table_tokens else 0.0,
+    }
+
+
+###########################################################################
+##                              MAIN
+###########################################################################
+
+if __name__ == "__main__":
+    from sql_pool import get_pool
+    from tools_sql import _execute
+
+    with get_pool().connection() as conn:
+        result = _execute(conn, sys.argv[1])[:3]
+    console.print(format_compact(*result), markup=False, highlight=False)
+
+    report = token_report(*result)
+    table = Table(title="query_sql output size")
+    for column in ("Format", "Chars", "~Tokens"):
+        table.add_column(column, justify="left" if column == "Format" else "right")
+    table.add_row("table", str(report["table_chars"]), str(report["table_tokens"]))
+    table.add_row("compact", str(report["compact_chars"]), str(report["compact_tokens"]))
+    console.print(table)
+    console.print(f"[green]{report['saved_pct']}% fewer tokens[/]")
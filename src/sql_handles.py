@@ -0,0 +1,216 @@
+"""Result handles: large query_sql results spilled to disk once and paged from there.
+
+A result past the display cap is written, while its cursor is being drained,
+into a throwaway SQLite file (one per handle, in a per-process temp directory).
+fetch_sql_page / summarize_sql_result then read that file instead of running
+the query again with OFFSET. Handles expire HANDLE_TTL_SECONDS after their last
+use, and the least recently used ones are dropped once the files together pass
+HANDLE_MAX_BYTES or there are more than HANDLE_MAX_COUNT of them.
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import atexit
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import chain
+from pathlib import Path
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+SPILL_RESULTS = True                      # False: rows past the display cap are only counted, as before
+HANDLE_TTL_SECONDS = 30 * 60              # a handle not used for this long is deleted
+HANDLE_MAX_BYTES = 512 * 1024 * 1024      # disk budget for all handle files together
+HANDLE_MAX_COUNT = 32
+HANDLE_MAX_ROWS = 2_000_000               # rows stored per handle, the rest is only counted
+
+
+###########################################################################
+##                            HANDLES
+###########################################################################
+
+
+@dataclass
+class ResultHandle:
+    id: str
+    path: Path
+    sql: str
+    columns: list[str]
+    stored: int          # rows in the file
+    total: int           # rows the query returned
+    bytes: int
+    last_used: float
+
+
+class HandleExpiredError(Exception):
+    """The handle does not exist (any more). The message is meant for the LLM."""
+
+
+class ResultHandleStore:
+    """Spilled results, one SQLite file each (table result: rowid = 1-based row number, c1..cN)."""
+
+    def __init__(self, ttl_seconds: float = HANDLE_TTL_SECONDS, max_bytes: int = HANDLE_MAX_BYTES,
+                 max_count: int = HANDLE_MAX_COUNT, max_rows: int = HANDLE_MAX_ROWS):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.max_rows = max_rows
+        self._dir: Path | None = None
+        self._handles: OrderedDict[str, ResultHandle] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"spilled": 0, "pages": 0, "summaries": 0, "expired": 0, "evicted": 0}
+
+    def _directory(self) -> Path:
+        with self._lock:
+            if self._dir is None:
+                self._dir = Path(tempfile.mkdtemp(prefix="sql_handles_"))
+                atexit.register(shutil.rmtree, self._dir, True)
+            return self._dir
+
+    def spill(self, sql: str, columns: list[str], rows: list[tuple], more: Iterable[list[tuple]]) -> tuple[str | None, int]:
+        """Store `rows` plus every batch of `more` in a new handle. Returns (handle id, total rows).
+
+        No handle is created when `more` is empty: the caller already holds the whole result.
+        """
+        batches = iter(more)
+        first = next(batches, [])
+        if not first:
+            return None, len(rows)
+
+        handle_id = f"r_{secrets.token_hex(4)}"
+        path = self._directory() / f"{handle_id}.db"
+        names = [f"c{i}" for i in range(1, len(columns) + 1)]
+        insert = f"INSERT INTO result ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+        conn = sqlite3.connect(str(path), isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute(f"CREATE TABLE result ({', '.join(names)})")
+            conn.execute("BEGIN")
+            stored = total = 0
+            for batch in chain([rows, first], batches):
+                total += len(batch)
+                keep = batch[:max(self.max_rows - stored, 0)]
+                if keep:
+                    conn.executemany(insert, keep)
+                    stored += len(keep)
+            conn.execute("COMMIT")
+        except BaseException:
+            # e.g. the query budget cancelled the drain: no handle, so nothing would ever delete the file
+            conn.close()
+            path.unlink(missing_ok=True)
+            raise
+        finally:
+            conn.close()
+
+        handle = ResultHandle(handle_id, path, sql, list(columns), stored, total, path.stat().st_size, time.monotonic())
+        with self._lock:
+            self._handles[handle_id] = handle
+            self._stats["spilled"] += 1
+            self._evict()
+            if handle_id not in self._handles:
+                return None, total   # bigger than the whole budget on its own
+        return handle_id, total
+
+    def _evict(self) -> None:
+        """Drop expired handles, then the least recently used ones until the budgets hold. Caller holds the lock."""
+        now = time.monotonic()
+        for handle in [h for h in self._handles.values() if now - h.last_used > self.ttl_seconds]:
+            self._drop(handle.id)
+            self._stats["expired"] += 1
+        while self._handles and (len(self._handles) > self.max_count or sum(h.bytes for h in self._handles.values()) > self.max_bytes):
+            self._drop(next(iter(self._handles)))
+            self._stats["evicted"] += 1
+
+    def _drop(self, handle_id: str) -> None:
+        handle = self._handles.pop(handle_id)
+        handle.path.unlink(missing_ok=True)
+
+    def get(self, handle_id: str) -> ResultHandle:
+        with self._lock:
+            self._evict()
+            handle = self._handles.get(handle_id.strip())
+            if handle is None:
+                raise HandleExpiredError(f"result handle {handle_id!r} is unknown or expired, run the query again")
+            handle.last_used = time.monotonic()
+            self._handles.move_to_end(handle.id)
+            return handle
+
+    def alive(self, handle_id: str) -> bool:
+        with self._lock:
+            handle = self._handles.get(handle_id)
+            return handle is not None and time.monotonic() - handle.last_used <= self.ttl_seconds
+
+    @contextmanager
+    def _reading(self, handle: ResultHandle):
+        """Read-only connection to the handle's file. An eviction between get() and here deletes the file,
+        which reads as an expired handle."""
+        try:
+            conn = sqlite3.connect(f"file:{handle.path.as_posix()}?mode=ro", uri=True)
+            try:
+                yield conn
+            finally:
+                conn.close()
+        except sqlite3.OperationalError as e:
+            raise HandleExpiredError(f"result handle {handle.id!r} expired while it was read, run the query again") from e
+
+    def page(self, handle_id: str, offset: int, limit: int) -> tuple[ResultHandle, list[tuple]]:
+        """Rows offset+1 .. offset+limit of the stored result."""
+        handle = self.get(handle_id)
+        with self._reading(handle) as conn:
+            rows = conn.execute("SELECT * FROM result WHERE rowid > ? ORDER BY rowid LIMIT ?", (max(offset, 0), limit)).fetchall()
+        with self._lock:
+            self._stats["pages"] += 1
+        return handle, rows
+
+    def summarize(self, handle_id: str, columns: list[str] | None = None) -> tuple[ResultHandle, list[tuple]]:
+        """One row per column: (column, values, nulls, distinct, min, max, sum, avg); sum / avg only for numeric columns."""
+        handle = self.get(handle_id)
+        wanted = columns or handle.columns
+        unknown = [name for name in wanted if name not in handle.columns]
+        if unknown:
+            raise ValueError(f"no column {', '.join(map(repr, unknown))} in this result, columns are: {', '.join(handle.columns)}")
+        summary = []
+        with self._reading(handle) as conn:
+            for name in wanted:
+                c = f"c{handle.columns.index(name) + 1}"
+                values, numeric, distinct, low, high, total, mean = conn.execute(f"""
+                    SELECT COUNT({c}), SUM(typeof({c}) IN ('integer', 'real')), COUNT(DISTINCT {c}),
+                           MIN({c}), MAX({c}), TOTAL({c}), AVG({c})
+                    FROM result
+                """).fetchone()
+                is_numeric = values > 0 and numeric == values
+                summary.append((name, values, handle.stored - values, distinct, low, high,
+                                total if is_numeric else None, mean if is_numeric else None))
+        with self._lock:
+            self._stats["summaries"] += 1
+        return handle, summary
+
+    def clear(self) -> None:
+        with self._lock:
+            for handle_id in list(self._handles):
+                self._drop(handle_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"handles": len(self._handles), "bytes": sum(h.bytes for h in self._handles.values()), **self._stats}
+
+
+###########################################################################
+##                         SHARED STORE
+###########################################################################
+
+RESULT_HANDLES = ResultHandleStore()
@@ -0,0 +1,144 @@
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+DB_PATH = Path(__file__).resolve().parent.parent / "db" / "sales.db"
+
+SQL_POOL_SIZE = 8                    # max open read-only connections (ToolNode runs tool calls in parallel threads)
+SQL_POOL_IMMUTABLE = False           # immutable=1 skips file locking, only safe while nothing writes sales.db
+SQL_POOL_CACHED_STATEMENTS = 256     # per-connection prepared statement cache
+SQL_MMAP_SIZE = 256 * 1024 * 1024    # bytes of the db file mapped into memory
+SQL_CACHE_SIZE_KB = 64 * 1024        # page cache per connection (negative PRAGMA value = KiB)
+
+
+###########################################################################
+##                        CONNECTION POOL
+###########################################################################
+
+
+class ReadOnlyPool:
+    """Thread-safe pool of read-only SQLite connections to a single database file.
+
+    Connections are opened lazily up to `size`, reused LIFO so the most recently
+    used (warmest) connection is handed out first, and kept open for the lifetime
+    of the process so page cache, parsed schema and prepared statements survive
+    between tool calls.
+    """
+
+    def __init__(self, db_path: Path = DB_PATH, size: int = SQL_POOL_SIZE, immutable: bool = SQL_POOL_IMMUTABLE):
+        self.db_path = Path(db_path)
+        self.size = size
+        self.immutable = immutable
+        self._idle: list[sqlite3.Connection] = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {"checkouts": 0, "hits": 0, "opened": 0, "waits": 0, "wait_seconds": 0.0}
+
+    def _uri(self) -> str:
+        uri = f"file:{self.db_path.as_posix()}?mode=ro"
+        if self.immutable:
+            uri += "&immutable=1"
+        return uri
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._uri(),
+            uri=True,
+            check_same_thread=False,
+            cached_statements=SQL_POOL_CACHED_STATEMENTS,
+        )
+        conn.execute(f"PRAGMA mmap_size = {SQL_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{SQL_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def acquire(self, timeout: float | None = None) -> sqlite3.Connection:
+        with self._cond:
+            self._stats["checkouts"] += 1
+            if self._idle:
+                self._stats["hits"] += 1
+                return self._idle.pop()
+            if self._open >= self.size:
+                self._stats["waits"] += 1
+                started = time.perf_counter()
+                if not self._cond.wait_for(lambda: self._idle, timeout=timeout):
+                    raise TimeoutError(f"No pooled connection available after {timeout}s")
+                self._stats["wait_seconds"] += time.perf_counter() - started
+                return self._idle.pop()
+            self._open += 1
+            self._stats["opened"] += 1
+
+        # Open outside the lock so a slow open doesn't block other checkouts
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: float | None = None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                **self._stats,
+            }
+
+    def close(self) -> None:
+        """Close all idle connections (checked-out ones stay open until released)."""
+        with self._cond:
+            while self._idle:
+                self._idle.pop().close()
+                self._open -= 1
+
+
+###########################################################################
+##                         SHARED POOL
+###########################################################################
+
+_pool: ReadOnlyPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ReadOnlyPool:
+    """Process-wide pool for sales.db, created on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ReadOnlyPool()
+    return _pool
+
+
+def pool_stats() -> dict:
+    return get_pool().stats()
@@ -0,0 +1,483 @@
+"""Parser for the aggregate query shapes the agent sends to query_sql.
+
+parse_aggregate() turns a single-table-plus-inner-joins SELECT with aggregates
+into an AggregateQuery tree, or returns None for anything outside that shape
+(subqueries, CTEs, outer joins, DISTINCT, window functions, ...). Engines that
+evaluate these trees fall back to SQLite for everything else.
+"""
+
+###########################################################################
+##                            IMPORTS
+###########################################################################
+
+from typing import NamedTuple
+
+from sqlmodel import SQLModel
+
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+import models  # noqa: F401  (registers the tables on SQLModel.metadata)
+from sql_cache import Token, sql_words, tokenize_sql
+
+
+###########################################################################
+##                           CONSTANTS
+###########################################################################
+
+AGGREGATE_FUNCTIONS = {"count", "sum", "total", "avg", "min", "max"}
+SCALAR_FUNCTIONS = {"round", "substr", "substring", "abs"}
+COMPARISON_OPS = {"=", "==", "!=", "<>", "<", "<=", ">", ">="}
+TABLE_COLUMNS = {name: {column.name for column in table.columns} for name, table in SQLModel.metadata.tables.items()}
+RESERVED = {
+    "select", "from", "where", "group", "by", "having", "order", "limit", "offset", "join", "inner",
+    "left", "right", "full", "cross", "natural", "outer", "on", "using", "as", "and", "or", "not",
+    "in", "between", "like", "glob", "is", "null", "case", "when", "then", "else", "end", "union",
+    "intersect", "except", "with", "over", "window", "distinct", "all", "asc", "desc", "collate",
+    "nulls", "exists", "escape", "values",
+}
+
+
+###########################################################################
+##                          QUERY TREE
+###########################################################################
+
+
+class Node(NamedTuple):
+    """One expression node.
+
+    kind     value                    args
+    col      (qualifier, name)        ()
+    num/str  literal                  ()
+    null     None                     ()
+    star     None                     ()           (only as the COUNT(*) argument)
+    agg      (function, distinct)     (arg,)
+    func     function                 (args...)
+    op       operator                 (left, right)   arithmetic, ||, comparisons, and/or
+    neg      None                     (operand,)
+    in       negated                  (operand, item, ...)
+    between  negated                  (operand, low, high)
+    like     negated                  (operand, pattern)
+    isnull   negated                  (operand,)
+    case     None                     (when, then, when, then, ..., else)  else is a null node if omitted
+    output   select item index        ()           (ORDER BY alias / position)
+    """
+    kind: str
+    value: object = None
+    args: tuple = ()
+
+
+class SelectItem(NamedTuple):
+    expr: Node
+    name: str               # result column name as SQLite reports it
+
+
+class JoinClause(NamedTuple):
+    table: str
+    alias: str
+    on: Node
+
+
+class AggregateQuery(NamedTuple):
+    table: str
+    alias: str
+    joins: list[JoinClause]
+    items: list[SelectItem]
+    where: Node | None
+    group_by: list[Node]
+    having: Node | None
+    order_by: list[tuple[Node, bool]]    # (expression, descending)
+    limit: int | None
+    offset: int
+
+
+class Unsupported(Exception):
+    """The query (or one of its expressions) is outside what the shape engine handles."""
+
+
+###########################################################################
+##                            PARSER
+###########################################################################
+
+
+def walk(node: Node):
+    """Yield a node and all its descendants."""
+    yield node
+    for arg in node.args:
+        yield from walk(arg)
+
+
+def has_aggregate(node: Node) -> bool:
+    return any(n.kind == "agg" for n in walk(node))
+
+
+class _Parser:
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.tokens: list[Token] = tokenize_sql(sql)
+        while self.tokens and self.tokens[-1].text == ";":
+            self.tokens.pop()
+        self.words = sql_words(self.tokens)
+        self.pos = 0
+
+    ######################### Token helpers ##############################
+    def peek(self, offset: int = 0) -> str:
+        i = self.pos + offset
+        return self.words[i] if i < len(self.words) else ""
+
+    def take(self, *expected: str) -> str:
+        word = self.peek()
+        if expected and word not in expected:
+            raise Unsupported(f"expected {expected}, got {word!r}")
+        if self.pos >= len(self.words):
+            raise Unsupported("unexpected end of query")
+        self.pos += 1
+        return word
+
+    def accept(self, *expected: str) -> bool:
+        if self.peek() in expected:
+            self.pos += 1
+            return True
+        return False
+
+    def identifier(self) -> str:
+        if self.pos >= len(self.tokens):
+            raise Unsupported("expected an identifier")
+        token = self.tokens[self.pos]
+        if token.kind == "quoted":
+            self.pos += 1
+            return token.text[1:-1].lower()
+        if token.kind != "word" or self.words[self.pos] in RESERVED:
+            raise Unsupported(f"expected an identifier, got {token.text!r}")
+        self.pos += 1
+        return self.words[self.pos - 1]
+
+    def integer(self) -> int:
+        token = self.tokens[self.pos] if self.pos < len(self.tokens) else None
+        if token is None or token.kind != "number" or not token.text.isdigit():
+            raise Unsupported("expected an integer")
+        self.pos += 1
+        return int(token.text)
+
+    ######################### Expressions ################################
+    def expr(self) -> Node:
+        node = self.and_expr()
+        while self.accept("or"):
+            node = Node("op", "or", (node, self.and_expr()))
+        return node
+
+    def and_expr(self) -> Node:
+        node = self.predicate()
+        while self.accept("and"):
+            node = Node("op", "and", (node, self.predicate()))
+        return node
+
+    def predicate(self) -> Node:
+        if self.peek() in ("not", "exists"):
+            raise Unsupported("NOT / EXISTS")
+        node = self.add_expr()
+        word = self.peek()
+        if word in COMPARISON_OPS:
+            self.pos += 1
+            op = {"==": "=", "<>": "!="}.get(word, word)
+            return Node("op", op, (node, self.add_expr()))
+        negated = self.accept("not")
+        if self.accept("in"):
+            self.take("(")
+            if self.peek() == "select":
+                raise Unsupported("IN subquery")
+            items = [self.add_expr()]
+            while self.accept(","):
+                items.append(self.add_expr())
+            self.take(")")
+            return Node("in", negated, (node, *items))
+        if self.accept("between"):
+            low = self.add_expr()
+            self.take("and")
+            return Node("between", negated, (node, low, self.add_expr()))
+        if self.accept("like"):
+            return Node("like", negated, (node, self.add_expr()))
+        if negated:
+            raise Unsupported(f"NOT {self.peek()}")
+        if self.accept("is"):
+            negated = self.accept("not")
+            self.take("null")
+            return Node("isnull", negated, (node,))
+        return node
+
+    def add_expr(self) -> Node:
+        node = self.mul_expr()
+        while self.peek() in ("+", "-", "||"):
+            op = self.take()
+            node = Node("op", op, (node, self.mul_expr()))
+        return node
+
+    def mul_expr(self) -> Node:
+        node = self.unary()
+        while self.peek() in ("*", "/", "%"):
+            op = self.take()
+            node = Node("op", op, (node, self.unary()))
+        return node
+
+    def unary(self) -> Node:
+        if self.accept("-"):
+            operand = self.unary()
+            if operand.kind == "num":
+                return Node("num", -operand.value)
+            return Node("neg", None, (operand,))
+        if self.accept("+"):
+            return self.unary()
+        return self.primary()
+
+    def primary(self) -> Node:
+        if self.pos >= len(self.tokens):
+            raise Unsupported("unexpected end of query")
+        token, word = self.tokens[self.pos], self.peek()
+        if token.kind == "number":
+            self.pos += 1
+            text = token.text.lower()
+            if text.startswith("0x"):
+                return Node("num", int(text, 16))
+            return Node("num", float(text) if any(ch in text for ch in ".e") else int(text))
+        if token.kind == "string":
+            self.pos += 1
+            return Node("str", token.text[1:-1].replace("''", "'"))
+        if word == "null":
+            self.pos += 1
+            return Node("null")
+        if word == "(":
+            self.pos += 1
+            if self.peek() == "select":
+                raise Unsupported("subquery")
+            node = self.expr()
+            self.take(")")
+            return node
+        if word == "case":
+            return self.case()
+        if token.kind == "word" and self.peek(1) == "(":
+            return self.call()
+        name = self.identifier()
+        if self.accept("."):
+            if self.peek() == "*":
+                raise Unsupported("table.*")
+            return Node("col", (name, self.identifier()))
+        return Node("col", (None, name))
+
+    def case(self) -> Node:
+        self.take("case")
+        operand = None if self.peek() == "when" else self.expr()
+        args = []
+        while self.accept("when"):
+            condition = self.expr()
+            if operand is not None:
+                condition = Node("op", "=", (operand, condition))
+            self.take("then")
+            args += [condition, self.expr()]
+        if not args:
+            raise Unsupported("CASE without WHEN")
+        args.append(self.expr() if self.accept("else") else Node("null"))
+        self.take("end")
+        return Node("case", None, tuple(args))
+
+    def call(self) -> Node:
+        name = self.take()
+        self.take("(")
+        if name in AGGREGATE_FUNCTIONS:
+            if self.accept("*"):
+                if name != "count":
+                    raise Unsupported(f"{name}(*)")
+                self.take(")")
+                return Node("agg", ("count", False), (Node("star"),))
+            distinct = self.accept("distinct")
+            args = [self.expr()]
+            while self.accept(","):
+                args.append(self.expr())
+            self.take(")")
+            if len(args) != 1:
+                raise Unsupported(f"multi-argument {name}()")
+            if has_aggregate(args[0]):
+                raise Unsupported("nested aggregate")
+            return Node("agg", (name, distinct), tuple(args))
+        if name not in SCALAR_FUNCTIONS:
+            raise Unsupported(f"function {name}()")
+        args = [self.expr()]
+        while self.accept(","):
+            args.append(self.expr())
+        self.take(")")
+        if self.peek() in ("over", "filter"):
+            raise Unsupported("window function")
+        return Node("func", "substr" if name == "substring" else name, tuple(args))
+
+    ######################### Clauses ####################################
+    def alias(self) -> str | None:
+        if self.accept("as"):
+            return self.identifier()
+        token = self.tokens[self.pos] if self.pos < len(self.tokens) else None
+        if token and (token.kind == "quoted" or (token.kind == "word" and self.peek() not in RESERVED)):
+            return self.identifier()
+        return None
+
+    def select_item(self) -> tuple[Node, str, str | None]:
+        if self.peek() == "*":
+            raise Unsupported("SELECT *")
+        first = self.pos
+        expr = self.expr()
+        end_token = self.tokens[self.pos - 1]
+        text = self.sql[self.tokens[first].start:end_token.start + len(end_token.text)]
+        alias = self.alias()
+        if alias:
+            name = self.tokens[self.pos - 1].text
+            name = name[1:-1] if self.tokens[self.pos - 1].kind == "quoted" else name
+        elif expr.kind == "col":
+            name = expr.value[1]
+        else:
+            name = text
+        return expr, name, alias
+
+    def table(self) -> tuple[str, str]:
+        name = self.identifier()
+        return name, self.alias() or name
+
+    def query(self) -> AggregateQuery:
+        self.take("select")
+        if self.peek() == "distinct":
+            raise Unsupported("SELECT DISTINCT")
+        self.accept("all")
+        parsed = [self.select_item()]
+        while self.accept(","):
+            parsed.append(self.select_item())
+        items = [SelectItem(expr, name) for expr, name, _ in parsed]
+        aliases = {alias: i for i, (_, _, alias) in enumerate(parsed) if alias}
+
+        self.take("from")
+        table, alias = self.table()
+        joins = []
+        while self.peek() in ("join", "inner"):
+            if self.accept("inner"):
+                self.take("join")
+            else:
+                self.take("join")
+            join_table, join_alias = self.table()
+            self.take("on")
+            joins.append(JoinClause(join_table, join_alias, self.expr()))
+        where = self.expr() if self.accept("where") else None
+        columns = set().union(*(TABLE_COLUMNS.get(name, ()) for name in (table, *(join.table for join in joins))))
+
+        group_by = []
+        if self.accept("group"):
+            self.take("by")
+            group_by = [self._output_ref(self.expr(), items, aliases, grouping=True, columns=columns)]
+            while self.accept(","):
+                group_by.append(self._output_ref(self.expr(), items, aliases, grouping=True, columns=columns))
+        having = self.expr() if self.accept("having") else None
+
+        order_by = []
+        if self.accept("order"):
+            self.take("by")
+            while True:
+                expr = self._output_ref(self.expr(), items, aliases, grouping=False)
+                descending = self.take("asc", "desc") == "desc" if self.peek() in ("asc", "desc") else False
+                order_by.append((expr, descending))
+                if not self.accept(","):
+                    break
+
+        limit, offset = None, 0
+        if self.accept("limit"):
+            limit = self.integer()
+            if self.accept("offset"):
+                offset = self.integer()
+            elif self.accept(","):
+                limit, offset = self.integer(), limit
+        if self.pos != len(self.tokens):
+            raise Unsupported(f"unexpected {self.tokens[self.pos].text!r}")
+
+        return AggregateQuery(table, alias, joins, items, where, group_by, having, order_by, limit, offset)
+
+    @staticmethod
+    def _output_ref(expr: Node, items: list[SelectItem], aliases: dict[str, int], grouping: bool,
+                    columns: set[str] = frozenset()) -> Node:
+        """Resolve GROUP BY / ORDER BY terms that name a result column by alias or position.
+
+        SQLite resolves a GROUP BY name to a column of the FROM tables before a
+        result alias, ORDER BY the other way round. A GROUP BY alias that shadows
+        a column with a different expression is left to SQLite.
+        """
+        index = None
+        if expr.kind == "num" and isinstance(expr.value, int):
+            index = expr.value - 1
+            if not 0 <= index < len(items):
+                raise Unsupported("term position out of range")
+        elif expr.kind == "col" and expr.value[0] is None and expr.value[1] in aliases:
+            index = aliases[expr.value[1]]
+            target = items[index].expr
+            if grouping and expr.value[1] in columns and not (target.kind == "col" and target.value[1] == expr.value[1]):
+                raise Unsupported(f"GROUP BY alias {expr.value[1]} shadows a column")
+        if index is None:
+            return expr
+        if grouping:
+            if has_aggregate(items[index].expr):
+                raise Unsupported("GROUP BY an aggregate")
+            return items[index].expr
+        return Node("output", index)
+
+
+###########################################################################
+##                            RENDERING
+###########################################################################
+
+
+def _quote_identifier(name: str) -> str:
+    return name if name.isidentifier() and name not in RESERVED else '"' + name.replace('"', '""') + '"'
+
+
+def to_sql(node: Node) -> str:
+    """Render an expression node back to SQLite SQL (fully parenthesized)."""
+    args = [to_sql(arg) for arg in node.args]
+    if node.kind == "col":
+        qualifier, name = node.value
+        return f"{_quote_identifier(qualifier)}.{_quote_identifier(name)}" if qualifier else _quote_identifier(name)
+    if node.kind == "num":
+        return repr(node.value) if node.value >= 0 else f"({node.value!r})"
+    if node.kind == "str":
+        return "'" + node.value.replace("'", "''") + "'"
+    if node.kind == "null":
+        return "NULL"
+    if node.kind == "star":
+        return "*"
+    if node.kind == "agg":
+        name, distinct = node.value
+        return f"{name.upper()}({'DISTINCT ' if distinct else ''}{args[0]})"
+    if node.kind == "func":
+        return f"{node.value.upper()}({', '.join(args)})"
+    if node.kind == "op":
+        return f"({args[0]} {node.value.upper()} {args[1]})"
+    if node.kind == "neg":
+        return f"(-{args[0]})"
+    negation = "NOT " if node.value else ""
+    if node.kind == "in":
+        return f"({args[0]} {negation}IN ({', '.join(args[1:])}))"
+    if node.kind == "between":
+        return f"({args[0]} {negation}BETWEEN {args[1]} AND {args[2]})"
+    if node.kind == "like":
+        return f"({args[0]} {negation}LIKE {args[1]})"
+    if node.kind == "isnull":
+        return f"({args[0]} IS {negation}NULL)"
+    if node.kind == "case":
+        whens = " ".join(f"WHEN {args[i]} THEN {args[i + 1]}" for i in range(0, len(args) - 1, 2))
+        return f"(CASE {whens} ELSE {args[-1]} END)"
+    raise Unsupported(f"cannot render {node.kind} node")
+
+
+def parse_aggregate(sql: str) -> AggregateQuery | None:
+    """Parse an aggregate SELECT (aggregates and/or GROUP BY) into a query tree, or None."""
+    try:
+        query = _Parser(sql).query()
+    except (Unsupported, IndexError, ValueError):
+        return None
+    expressions = [item.expr for item in query.items] + [expr for expr, _ in query.order_by]
+    if query.having is not None:
+        expressions.append(query.having)
+    if not query.group_by and not any(has_aggregate(expr) for expr in expressions):
+        return None
+    return query
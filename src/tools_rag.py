@@ -5,20 +5,24 @@
 import json
 from pathlib import Path
 
-from langchain.chat_models import init_chat_model
 from langchain.tools import tool
-from langchain_community.vectorstores import SQLiteVec
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from pydantic import BaseModel, Field
 
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from rag_products import SECTIONS
+from rag_runtime import get_rag_runtime
+
 
 ###########################################################################
 ##                           CONSTANTS
 ###########################################################################
 
-PROJECT_ROOT = Path(__file__).resolve().parent.parent
-RAG_DB_FILE = str(PROJECT_ROOT / "db" / "rag.db")
-RAG_TABLE = "product_knowledge"
+RAG_PRODUCTS_MAX_IDS = 25      # products answered by one query_rag_products call
+RAG_BATCH_MAX_QUESTIONS = 10   # questions answered by one query_rag_batch call
+RAG_K = 5                      # chunks retrieved per question
 
 
 ###########################################################################
@@ -31,6 +35,26 @@ class RAGResponse(BaseModel):
     used_sources: list[str] = Field(description="List of source filenames (e.g. '7021.pdf') that you actually used to form your answer. Only include sources you directly referenced.")
 
 
+class ProductAnswer(BaseModel):
+    product_id: int = Field(description="The product ID this answer is about.")
+    answer: str = Field(description="The answer for this product, based only on its own context.")
+    used_sources: list[str] = Field(description="Source filenames (e.g. '7021.pdf') used for this product's answer.")
+
+
+class ProductsRAGResponse(BaseModel):
+    products: list[ProductAnswer] = Field(description="One entry per product in the context, in the same order.")
+
+
+class BatchAnswer(BaseModel):
+    question_number: int = Field(description="The number of the question this answer is for (Q1 -> 1).")
+    answer: str = Field(description="The answer to this question, based only on the chunks listed for it.")
+    used_sources: list[str] = Field(description="Source filenames (e.g. '7021.pdf') used for this question's answer.")
+
+
+class BatchRAGResponse(BaseModel):
+    answers: list[BatchAnswer] = Field(description="One entry per question, in question order.")
+
+
 ###########################################################################
 ##                           RAG TOOL
 ###########################################################################
@@ -41,13 +65,17 @@ def query_rag(question: str) -> str:
     """Search product technical sheet PDFs for product knowledge (materials, care instructions, sizing, sustainability, style notes).
     Use this tool for questions about what products are made of, how to care for them, size guides, eco certifications, and outfit pairing suggestions.
     Do NOT use this for sales numbers, revenue, or customer data -- use query_sql instead.
-    IMPORTANT: Always use product names/descriptions in your question, NOT product IDs. Semantic search matches on text similarity, so 'silk retro coat' will find results but 'product 7021' will not."""
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
-    vector_store = SQLiteVec(table=RAG_TABLE, connection=None, embedding=embeddings, db_file=RAG_DB_FILE)
-
-    docs = vector_store.similarity_search(question, k=5)
+    Retrieval combines keyword (BM25) and semantic search: product names/descriptions, product IDs (e.g. 'product 7021') and exact terms ('"GOTS"', '"merino wool"', quote a phrase to require it) all match."""
+    runtime = get_rag_runtime()
+    call = runtime.begin_call()
+    docs = runtime.similarity_search(question, k=RAG_K, call=call)
     if not docs:
+        runtime.end_call(call)
         return "No relevant product technical sheet context found for this question."
+    # A similar enough question over the same chunks was answered before: no synthesis call
+    if (cached := runtime.cached_answer(docs, call)) is not None:
+        runtime.end_call(call)
+        return json.dumps(cached)
 
     context_blocks = []
     for doc in docs:
@@ -56,20 +84,159 @@ def query_rag(question: str) -> str:
         context_blocks.append(f"Source: {source}\n{doc.page_content}")
     context_text = "\n\n---\n\n".join(context_blocks)
 
-    llm = init_chat_model("google_genai:gemini-2.5-flash", temperature=0.7)
-    structured_llm = llm.with_structured_output(RAGResponse)
-
-    rag_response = structured_llm.invoke(
+    rag_response = runtime.synthesize(
+        RAGResponse,
         "You are a product knowledge assistant. Answer only from the provided context. "
         "If context is insufficient, say that clearly. "
         "In used_sources, list ONLY the source filenames you actually based your answer on. "
         "NEVER include folder paths, only basename values like '235664.pdf'.\n\n"
-        f"Question: {question}\n\nContext:\n{context_text}"
+        f"Question: {question}\n\nContext:\n{context_text}",
+        call,
     )
+    runtime.end_call(call)
 
     # Encode sources into the tool output so collect_results can extract them
     result = {
         "answer": rag_response.answer,
         "used_sources": rag_response.used_sources,
     }
+    runtime.store_answer(question, docs, result, call)
+    return json.dumps(result)
+
+
+###########################################################################
+##                       PRODUCT RAG TOOL
+###########################################################################
+
+
+@tool
+def query_rag_products(product_ids: list[int], question: str, section: str | None = None) -> str:
+    """Answer a product-knowledge question for a list of known product IDs, from their technical sheets, in one call.
+    Use this after query_sql returned product IDs (e.g. top sellers) and you need materials, care, sizing,
+    sustainability or style notes for each of them: the sheets are looked up by ID, no semantic search.
+
+    Args:
+        product_ids: Up to 25 product IDs.
+        question: What to answer for every product (e.g. "What is it made of?").
+        section: Optional, only use this part of each sheet: overview, materials, size, care, sustainability or style.
+
+    Returns:
+        JSON with a combined answer, used_sources, one answer per product and the IDs that have no technical sheet.
+    """
+    product_ids = list(dict.fromkeys(int(product_id) for product_id in product_ids))
+    if not product_ids:
+        return "Error: no product IDs given."
+    if len(product_ids) > RAG_PRODUCTS_MAX_IDS:
+        return f"Error: at most {RAG_PRODUCTS_MAX_IDS} product IDs per call."
+
+    runtime = get_rag_runtime()
+    call = runtime.begin_call()
+    try:
+        docs_by_product = runtime.product_documents(product_ids, section, call)
+    except (ValueError, RuntimeError) as e:
+        runtime.end_call(call)
+        return f"Error: {e}"
+    missing = [product_id for product_id in product_ids if product_id not in docs_by_product]
+    if not docs_by_product:
+        runtime.end_call(call)
+        return json.dumps({"answer": f"No product technical sheets found for product IDs {missing}.", "used_sources": [], "missing_product_ids": missing})
+
+    context_blocks = []
+    for product_id in product_ids:
+        docs = docs_by_product.get(product_id)
+        if docs:
+            source = Path(str((docs[0].metadata or {}).get("source_path", "unknown"))).name
+            context_blocks.append(f"Product ID: {product_id}\nSource: {source}\n" + "\n".join(doc.page_content for doc in docs))
+    context_text = "\n\n---\n\n".join(context_blocks)
+    scope = f" Only the '{SECTIONS[section]}' part of each sheet is included." if section else ""
+
+    rag_response = runtime.synthesize(
+        ProductsRAGResponse,
+        "You are a product knowledge assistant. Answer the question separately for every product below, "
+        "each only from that product's own context. If a product's context is insufficient, say that clearly for it. "
+        "In used_sources, list ONLY basename values like '235664.pdf'." + scope + "\n\n"
+        f"Question: {question}\n\nContext:\n{context_text}",
+        call,
+    )
+    runtime.end_call(call)
+
+    answers = [f"Product {item.product_id}: {item.answer}" for item in rag_response.products]
+    if missing:
+        answers.append(f"No technical sheet for product IDs {missing}.")
+    result = {
+        "answer": "\n".join(answers),
+        "used_sources": list(dict.fromkeys(src for item in rag_response.products for src in item.used_sources)),
+        "products": [item.model_dump() for item in rag_response.products],
+        "missing_product_ids": missing,
+    }
+    return json.dumps(result)
+
+
+###########################################################################
+##                        BATCHED RAG TOOL
+###########################################################################
+
+
+@tool
+def query_rag_batch(questions: list[str]) -> str:
+    """Answer several product-knowledge questions from the product technical sheets in one call.
+    Use this instead of several query_rag calls when you have more than one question in this step
+    (e.g. the materials of five products named in the question, or care and sizing of one product).
+    If you already have product IDs from SQL and ask the same thing for each, prefer query_rag_products.
+
+    Args:
+        questions: Up to 10 self-contained questions, each retrieved separately (e.g. ["What is the Silk Retro Coat made of?", "How do I wash product 7021?"]).
+
+    Returns:
+        JSON with a combined answer, used_sources, and one answer with its own used_sources per question.
+    """
+    questions = [question.strip() for question in questions if question.strip()]
+    if not questions:
+        return "Error: no questions given."
+    if len(questions) > RAG_BATCH_MAX_QUESTIONS:
+        return f"Error: at most {RAG_BATCH_MAX_QUESTIONS} questions per call."
+
+    runtime = get_rag_runtime()
+    call = runtime.begin_call()
+    docs_per_question = runtime.similarity_search_batch(questions, k=RAG_K, call=call)
+    if not any(docs_per_question):
+        runtime.end_call(call)
+        return json.dumps({"answer": "No relevant product technical sheet context found for these questions.", "used_sources": [], "answers": []})
+
+    # Chunks retrieved for several questions are sent once and referenced by number. Keyed on the chunk row,
+    # not its text: templated sections read the same in several product sheets
+    chunk_numbers: dict[object, int] = {}
+    chunk_blocks, question_lines = [], []
+    for number, (question, docs) in enumerate(zip(questions, docs_per_question), 1):
+        refs = []
+        for doc in docs:
+            source = Path(str((doc.metadata or {}).get("source_path", "unknown"))).name
+            key = doc.id or (source, doc.page_content)
+            if key not in chunk_numbers:
+                chunk_numbers[key] = len(chunk_numbers) + 1
+                chunk_blocks.append(f"[C{chunk_numbers[key]}] Source: {source}\n{doc.page_content}")
+            refs.append(f"C{chunk_numbers[key]}")
+        question_lines.append(f"Q{number}: {question}\nChunks: {', '.join(refs) or 'none'}")
+
+    rag_response = runtime.synthesize(
+        BatchRAGResponse,
+        "You are a product knowledge assistant. Answer every question below separately, each only from the chunks "
+        "listed for it. If a question's chunks are insufficient, say that clearly for it. "
+        "In used_sources, list ONLY basename values like '235664.pdf'.\n\n"
+        + "\n\n".join(question_lines) + "\n\nContext:\n" + "\n\n---\n\n".join(chunk_blocks),
+        call,
+    )
+    runtime.end_call(call)
+
+    by_number = {item.question_number: item for item in rag_response.answers}
+    answers = [
+        {"question": question, "answer": by_number[number].answer if number in by_number else "No answer returned.",
+         "used_sources": by_number[number].used_sources if number in by_number else []}
+        for number, question in enumerate(questions, 1)
+    ]
+    result = {
+        "answer": "\n".join(f"Q: {item['question']}\nA: {item['answer']}" for item in answers),
+        "used_sources": list(dict.fromkeys(src for item in answers for src in item["used_sources"])),
+        "answers": answers,
+    }
     return json.dumps(result)
@@ -2,16 +2,205 @@
 ##                            IMPORTS
 ###########################################################################
 
+import queue
+import re
 import sqlite3
-from pathlib import Path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
 from langchain.tools import tool
 
+###########################################################################
+##                        CUSTOM IMPORTS
+###########################################################################
+
+from columnar import COLUMNAR_ENGINE, get_engine
+from compact_layout import COMPACT_TABLE
+from entity_resolver import get_resolver
+from index_advisor import CAPTURE_QUERIES, explain_query_plan, log_query
+from partitions import PARTITION_ENGINE, get_partitions
+from rollups import ROLLUP_ROUTER
+from sql_cache import RESULT_CACHE, db_signature, from_tables, result_cache_key, sql_words, tokenize_sql
+from sql_format import format_result
+from sql_handles import RESULT_HANDLES, SPILL_RESULTS, HandleExpiredError
+from sql_pool import DB_PATH, get_pool
+
 
 ###########################################################################
 ##                           CONSTANTS
 ###########################################################################
 
-DB_PATH = Path(__file__).resolve().parent.parent / "db" / "sales.db"
+MAX_DISPLAY_ROWS = 200      # rows rendered into the tool output
+COUNT_BATCH_ROWS = 1000     # rows stepped per fetchmany() while counting past the display cap
+
+QUERY_TIMEOUT_SECONDS = 20.0            # wall time before a running query is interrupted
+QUERY_MAX_VM_STEPS = None               # optional cap on SQLite VM instructions per query
+PREFLIGHT_MAX_NESTED_SCAN_ROWS = 50_000_000   # reject plans whose nested full scans multiply past this
+PROGRESS_HANDLER_STEPS = 10_000         # VM instructions between budget checks
+
+SQL_BATCH_MAX_STATEMENTS = 10          # statements accepted by one query_sql_batch call
+SNAPSHOT_RETRIES = 3                    # attempts at pinning one snapshot on several connections
+RESOLVE_MAX_MENTIONS = 25              # product names accepted by one resolve_products call
+
+FULL_SCAN_RE = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?$")
+
+
+###########################################################################
+##                            BUDGET
+###########################################################################
+
+
+class QueryBudget(NamedTuple):
+    seconds: float | None = QUERY_TIMEOUT_SECONDS
+    vm_steps: int | None = QUERY_MAX_VM_STEPS
+    max_nested_scan_rows: int | None = PREFLIGHT_MAX_NESTED_SCAN_ROWS
+
+
+class QueryBudgetError(Exception):
+    """A query was rejected or cancelled by its budget. The message is meant for the LLM."""
+
+
+DEFAULT_BUDGET = QueryBudget()
+_table_rows: dict[tuple, int] = {}
+_table_rows_lock = threading.Lock()       # ToolNode runs query_sql calls from parallel threads
+
+
+###########################################################################
+##                           EXECUTION
+###########################################################################
+
+
+def _count_rows(conn: sqlite3.Connection, table: str) -> int:
+    key = (RESULT_CACHE.signature(), table)
+    with _table_rows_lock:
+        if key in _table_rows:
+            return _table_rows[key]
+    rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    with _table_rows_lock:
+        for stale in [k for k in _table_rows if k[0] != key[0]]:
+            del _table_rows[stale]
+        _table_rows[key] = rows
+    return rows
+
+
+def _preflight(conn: sqlite3.Connection, sql: str, budget: QueryBudget) -> None:
+    """Reject plans that nest full scans of large tables (e.g. a cartesian customers x transactions)."""
+    if not budget.max_nested_scan_rows:
+        return
+    tokens = tokenize_sql(sql)
+    aliases = {(alias or table): table for _, table, alias in from_tables(tokens, sql_words(tokens))}
+    if "transactions" in aliases.values():
+        aliases[COMPACT_TABLE] = COMPACT_TABLE   # the plan names the table behind the compact-layout view
+
+    # Loops listed under the same parent run nested inside each other, in plan order
+    scans_by_parent: dict[int, list[str]] = {}
+    for _, parent, detail in explain_query_plan(conn, sql):
+        match = FULL_SCAN_RE.match(detail)
+        if match and match.group(1).lower() in aliases:
+            scans_by_parent.setdefault(parent, []).append(aliases[match.group(1).lower()])
+
+    for tables in scans_by_parent.values():
+        if len(tables) < 2:
+            continue
+        cost = 1
+        for table in tables:
+            cost *= max(_count_rows(conn, table), 1)
+        if cost > budget.max_nested_scan_rows:
+            raise QueryBudgetError(
+                f"query rejected before running: its plan nests full scans of {' x '.join(tables)} "
+                f"(~{cost:,} row combinations). Add a join condition on key columns "
+                f"(e.g. t.customer_id = c.customer_id) or filter/aggregate before joining."
+            )
+
+
+def _execute(conn: sqlite3.Connection, sql: str, budget: QueryBudget = DEFAULT_BUDGET) -> tuple[list[str], list[tuple], int, str | None]:
+    """Run a query and return (columns, first MAX_DISPLAY_ROWS rows, total row count, result handle).
+
+    Only the displayed rows are kept in memory. Past the cap the cursor keeps
+    stepping in batches, spilled into a result handle (or only counted with
+    SPILL_RESULTS off), so memory is bounded by the cap, not the result size.
+    A progress handler interrupts the query once it exceeds its time or VM-step budget.
+    """
+    _preflight(conn, sql, budget)
+
+    deadline = time.monotonic() + budget.seconds if budget.seconds else None
+    steps = 0
+    exceeded = []
+
+    def check_budget() -> int:
+        nonlocal steps
+        steps += PROGRESS_HANDLER_STEPS
+        if deadline and time.monotonic() > deadline:
+            exceeded.append(f"the {budget.seconds:g}s time budget")
+        elif budget.vm_steps and steps > budget.vm_steps:
+            exceeded.append(f"the {budget.vm_steps:,} VM-step budget")
+        return 1 if exceeded else 0
+
+    conn.set_progress_handler(check_budget, PROGRESS_HANDLER_STEPS)
+    try:
+        cursor = conn.execute(sql)
+        columns = [col[0] for col in cursor.description or ()]
+        rows = cursor.fetchmany(MAX_DISPLAY_ROWS)
+        total, handle = len(rows), None
+
+        if total == MAX_DISPLAY_ROWS:
+            batches = iter(lambda: cursor.fetchmany(COUNT_BATCH_ROWS), [])
+            if SPILL_RESULTS:
+                handle, total = RESULT_HANDLES.spill(sql, columns, rows, batches)
+            else:
+                total += sum(len(batch) for batch in batches)
+
+        cursor.close()
+    except sqlite3.OperationalError as e:
+        if exceeded:
+            raise QueryBudgetError(
+                f"query cancelled after exceeding {exceeded[0]}. Make it cheaper: add selective "
+                f"WHERE filters, join on key columns, aggregate with GROUP BY, or add a LIMIT."
+            ) from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+    return columns, rows, total, handle
+
+
+def _run_query(conn: sqlite3.Connection, sql: str, engines: bool = True) -> tuple[list[str], list[tuple], int, str | None]:
+    """Execute one SELECT, answered from a rollup, the columnar engine or the partitions when possible, and capture it for the index advisor.
+
+    engines=False keeps the query on `conn` (rollups live in sales.db too), for callers that need its snapshot.
+    """
+    started = time.perf_counter()
+    executed_sql = ROLLUP_ROUTER.rewrite(sql) or sql
+    if executed_sql == sql and engines:
+        answered = get_engine().execute(sql) if COLUMNAR_ENGINE else None
+        if answered is None and PARTITION_ENGINE:
+            answered = get_partitions().execute(sql)
+        if answered is not None:
+            columns, rows = answered
+            handle, total = None, len(rows)
+            if SPILL_RESULTS and total > MAX_DISPLAY_ROWS:
+                handle, total = RESULT_HANDLES.spill(sql, columns, rows[:MAX_DISPLAY_ROWS], [rows[MAX_DISPLAY_ROWS:]])
+            return columns, rows[:MAX_DISPLAY_ROWS], total, handle
+    try:
+        result = _execute(conn, executed_sql)
+    except sqlite3.Error:
+        if executed_sql == sql:
+            raise
+        executed_sql = sql
+        result = _execute(conn, executed_sql)
+    if CAPTURE_QUERIES:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        try:
+            log_query(sql, executed_sql, explain_query_plan(conn, executed_sql), elapsed_ms)
+        except Exception:
+            pass  # the log only feeds the index advisor, it must never fail the query
+    return result
+
+
+def _usable(cached: tuple | None) -> bool:
+    """A cached result is only served while its result handle (if any) still exists."""
+    return cached is not None and (cached[3] is None or RESULT_HANDLES.alive(cached[3]))
 
 
 ###########################################################################
@@ -29,31 +218,221 @@ def query_sql(sql: str) -> str:
         sql: A SELECT SQL query to execute.
 
     Returns:
-        Query results as formatted text with column headers, or an error message.
+        Query results as tab-separated rows under a header line, or an error message.
+        `# all rows: col=value` notes columns that are constant across the result;
+        `# col: ~1=..., ~2=...` is the legend for codes used in that column.
+        Results over 200 rows end with a handle for fetch_sql_page / summarize_sql_result.
     """
     sql_stripped = sql.strip()
     if not sql_stripped.upper().startswith("SELECT"):
         return "Error: only SELECT queries are allowed."
 
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    cache_key = result_cache_key(sql_stripped)
+    signature = RESULT_CACHE.signature()
+    cached = RESULT_CACHE.get(cache_key, signature)
+    if _usable(cached):
+        return format_result(*cached)
+
+    with get_pool().connection() as conn:
+        try:
+            result = _run_query(conn, sql_stripped)
+        except QueryBudgetError as e:
+            # Returned as tool output so the reflect loop can rewrite the query
+            return f"Error: {e}"
+    RESULT_CACHE.put(cache_key, result, signature)
+
+    return format_result(*result)
+
+
+###########################################################################
+##                        BATCHED SQL TOOL
+###########################################################################
+
+
+def _begin_snapshot(connections: list[sqlite3.Connection]) -> bool:
+    """Open a read transaction on every connection and check they all see the same database state.
+
+    SQLite pins a reader's snapshot at its first read. If no write was committed
+    between the first and the last BEGIN (the file signature did not move), every
+    connection reads the same snapshot.
+    """
+    for _ in range(SNAPSHOT_RETRIES):
+        before = db_signature(DB_PATH)
+        for conn in connections:
+            conn.execute("BEGIN")
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        if db_signature(DB_PATH) == before:
+            return True
+        for conn in connections:
+            conn.rollback()
+    return False
+
+
+@tool
+def query_sql_batch(statements: list[str]) -> str:
+    """Execute several read-only SQL SELECT queries at once, concurrently and on one consistent snapshot.
+
+    Prefer this over multiple query_sql calls when a plan step needs several independent
+    queries (e.g. revenue by country, by category and by month). All statements see the
+    same database state. A failing statement reports its error without affecting the others.
+
+    Args:
+        statements: Up to 10 SELECT SQL queries.
+
+    Returns:
+        One section per statement, in order, headed by `-- [i/n] <ms> ms` and the SQL,
+        followed by its results in the same format as query_sql.
+    """
+    statements = [sql.strip() for sql in statements]
+    if not statements:
+        return "Error: no statements given."
+    if len(statements) > SQL_BATCH_MAX_STATEMENTS:
+        return f"Error: at most {SQL_BATCH_MAX_STATEMENTS} statements per batch."
+
+    outputs: list[str | None] = [None] * len(statements)
+    timings: list[str] = [""] * len(statements)
+    signature = RESULT_CACHE.signature()
+    pending = []
+    for i, sql in enumerate(statements):
+        if not sql.upper().startswith("SELECT"):
+            outputs[i], timings[i] = "Error: only SELECT queries are allowed.", "0.0 ms"
+            continue
+        cached = RESULT_CACHE.get(result_cache_key(sql), signature)
+        if _usable(cached):
+            outputs[i], timings[i] = format_result(*cached), "cached"
+        else:
+            pending.append(i)
+
+    # Every statement was cached or rejected: no connection needed
+    pool = get_pool()
+    connections = [pool.acquire()] if pending else []
+    try:
+        # Extra connections only if they are free right now, never wait on other tool calls
+        while 0 < len(connections) < len(pending):
+            try:
+                connections.append(pool.acquire(timeout=0))
+            except TimeoutError:
+                break
+
+        # Fall back to running everything on one connection, which is one snapshot by construction
+        if len(connections) > 1 and not _begin_snapshot(connections):
+            for conn in connections[1:]:
+                pool.release(conn)
+            connections = connections[:1]
+        if len(connections) == 1 and pending:
+            connections[0].execute("BEGIN")
+
+        work: queue.SimpleQueue[int] = queue.SimpleQueue()
+        for i in pending:
+            work.put(i)
+
+        def drain(conn: sqlite3.Connection) -> None:
+            while True:
+                try:
+                    i = work.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                try:
+                    # The columnar / partitions engines read their own files, not this snapshot
+                    result = _run_query(conn, statements[i], engines=False)
+                    RESULT_CACHE.put(result_cache_key(statements[i]), result, signature)
+                    outputs[i] = format_result(*result)
+                except Exception as e:
+                    outputs[i] = f"Error: {e}"
+                timings[i] = f"{(time.perf_counter() - started) * 1000:.1f} ms"
+
+        if connections:
+            with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+                list(executor.map(drain, connections))
+    finally:
+        for conn in connections:
+            pool.release(conn)
+
+    sections = []
+    for i, sql in enumerate(statements):
+        sections.append(f"-- [{i + 1}/{len(statements)}] {timings[i]}\n{sql}\n{outputs[i]}")
+    return "\n\n".join(sections)
+
+
+###########################################################################
+##                         RESULT HANDLES
+###########################################################################
+
+
+@tool
+def fetch_sql_page(handle: str, offset: int, limit: int = MAX_DISPLAY_ROWS) -> str:
+    """Fetch more rows of a large query_sql result from its handle, without running the query again.
 
-    cursor.execute(sql_stripped)
-    rows = cursor.fetchall()
+    Args:
+        handle: The result handle from the query_sql footer (e.g. r_1a2b3c4d).
+        offset: Rows to skip, e.g. 200 for the second page.
+        limit: Rows to return (at most 200).
 
+    Returns:
+        The rows in the same format as query_sql, headed by the row range, or an error message.
+    """
+    if offset < 0:
+        return f"Error: offset must be 0 or more, got {offset}."
+    limit = max(1, min(limit, MAX_DISPLAY_ROWS))
+    try:
+        result, rows = RESULT_HANDLES.page(handle, offset, limit)
+    except HandleExpiredError as e:
+        return f"Error: {e}"
     if not rows:
-        conn.close()
-        return "Query returned 0 rows."
+        return f"Error: offset {offset} is past the end of the result ({result.stored} rows stored)."
+    stored_note = f", {result.stored} stored" if result.stored < result.total else ""
+    header = f"# rows {offset + 1}-{offset + len(rows)} of {result.total}{stored_note}"
+    return header + "\n" + format_result(result.columns, rows, len(rows))
+
+
+@tool
+def summarize_sql_result(handle: str, columns: list[str] | None = None) -> str:
+    """Summarize the columns of a large query_sql result from its handle: counts, nulls, distinct values, min, max, sum and average.
+
+    Args:
+        handle: The result handle from the query_sql footer (e.g. r_1a2b3c4d).
+        columns: Column names to summarize, all columns when omitted.
 
-    columns = rows[0].keys()
-    result_lines = [" | ".join(columns)]
-    result_lines.append("-" * len(result_lines[0]))
-    for row in rows[:200]:
-        result_lines.append(" | ".join(str(row[col]) for col in columns))
+    Returns:
+        One row per column in the same format as query_sql (sum / avg empty for text columns), or an error message.
+    """
+    try:
+        result, summary = RESULT_HANDLES.summarize(handle, columns)
+    except (HandleExpiredError, ValueError) as e:
+        return f"Error: {e}"
+    header = f"# summary of {result.stored} rows"
+    return header + "\n" + format_result(["column", "values", "nulls", "distinct", "min", "max", "sum", "avg"], summary, len(summary))
+
+
+###########################################################################
+##                        PRODUCT RESOLVER
+###########################################################################
 
-    if len(rows) > 200:
-        result_lines.append(f"... ({len(rows)} total rows, showing first 200)")
 
-    conn.close()
-    return "\n".join(result_lines)
+@tool
+def resolve_products(mentions: list[str]) -> str:
+    """Resolve product names, in any catalogue language and possibly misspelled or cut off, to product IDs.
+
+    Args:
+        mentions: Product names as the user wrote them, e.g. ["silk retro coat", "Vestido Clásico"] (at most 25).
+
+    Returns:
+        Tab-separated rows (mention, product_id, description, language, score), best first per mention.
+        Score 1 is an exact name match. Mentions without a match are listed at the end.
+    """
+    if not mentions:
+        return "Error: no product names given."
+    if len(mentions) > RESOLVE_MAX_MENTIONS:
+        return f"Error: {len(mentions)} names given, at most {RESOLVE_MAX_MENTIONS} per call."
+    resolver = get_resolver()
+    rows, unmatched = [], []
+    for mention in dict.fromkeys(mentions):
+        matches = resolver.resolve(mention)
+        rows += [(mention, *match) for match in matches]
+        if not matches:
+            unmatched.append(mention)
+    output = format_result(["mention", "product_id", "description", "language", "score"], rows, len(rows)) if rows else ""
+    if unmatched:
+        output += ("\n" if output else "") + "# no match: " + ", ".join(unmatched)
+    return output
@@ -4,10 +4,25 @@
 
 import json
 import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.messages import AIMessage, ToolMessage
 
-from tools_rag import query_rag
+from answer_cache import SemanticAnswerCache
+from embedding_cache import CachedEmbeddings
+from rag_fts import build_fts_index, lexical_search, reciprocal_rank_fusion
+from rag_ivf import IVFIndex, build_ivf_index, synthetic_vectors
+from rag_products import build_product_index, product_chunk_rowids
+from rag_quantized import quantize, rerank, truncate
+from rag_vectors import VectorMatrix, build_vector_export
+from rag_runtime import RAGRuntime
+from agent.nodes import collect_results
+from tools_rag import BatchAnswer, BatchRAGResponse, query_rag, query_rag_batch
 
 
 ###########################################################################
@@ -57,3 +72,309 @@ def test_rag_nonsense_query():
     answer_lower = parsed["answer"].lower()
     assert any(kw in answer_lower for kw in ["no ", "not ", "insufficient", "cannot", "don't have"]), \
         f"Expected no-result response, got: {parsed['answer'][:200]}"
+
+
+def test_rag_runtime_shares_store_across_threads(tmp_path):
+    """One store and one SQLite connection serve concurrent searches, setup is paid once."""
+    runtime = RAGRuntime(db_file=str(tmp_path / "rag.db"), embeddings=DeterministicFakeEmbedding(size=16), cache_file=tmp_path / "rag_cache.db")
+    runtime.vector_store().add_texts([f"sheet {i}" for i in range(20)], [{"source_path": f"data/pdf/{i}.pdf"} for i in range(20)])
+
+    def search(question: str) -> list[str]:
+        call = runtime.begin_call()
+        docs = runtime.similarity_search(question, k=3, call=call)
+        runtime.end_call(call)
+        return [doc.page_content for doc in docs]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(search, ["sheet 7"] * 16))
+    assert results[0][0] == "sheet 7" and all(result == results[0] for result in results)
+    stats = runtime.stats()
+    assert stats["calls"] == 16 and stats["inits"] == 2 and len(stats["recent"]) == 16   # embeddings + store
+    assert stats["embedding_cache"]["misses"] == 2    # the store's dimension probe and "sheet 7"
+    runtime.close()
+
+
+def test_query_embeddings_cached_in_memory_and_on_disk(tmp_path):
+    """Normalized repeats skip the embedding API, also from a fresh process-level cache."""
+    class CountingEmbedding(DeterministicFakeEmbedding):
+        calls: int = 0
+
+        def embed_query(self, text: str) -> list[float]:
+            self.calls += 1
+            return super().embed_query(text)
+
+    inner = CountingEmbedding(size=8)
+    cache = CachedEmbeddings(inner, tmp_path / "rag_cache.db")
+    first = cache.embed_query("What material is the Silk Retro Coat made of?")
+    assert cache.embed_query("what material is the silk retro  coat made of") == first
+    cache.close()
+
+    reopened = CachedEmbeddings(inner, tmp_path / "rag_cache.db")
+    assert reopened.embed_query("WHAT MATERIAL IS THE SILK RETRO COAT MADE OF ?") == first
+    assert inner.calls == 1
+    stats = reopened.stats()
+    assert (stats["disk_hits"], stats["misses"], stats["stored_entries"], stats["hit_rate"]) == (1, 0, 1, 1.0)
+    reopened.close()
+
+
+def test_fts_matches_ids_and_exact_terms_and_fuses_with_vector_ranks():
+    """Product ids and quoted terms are confident lexical hits; plain words are ranked by BM25."""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE product_knowledge (rowid INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT, metadata BLOB, text_embedding BLOB)")
+    chunks = [
+        ("Silk retro coat. Material: 100% mulberry silk.", 7021),
+        ("Silk retro coat. Care: dry clean only, do not tumble dry.", 7021),
+        ("Merino wool sweater, GOTS certified organic dye.", 5310),
+        ("Linen summer dress. Care: machine wash cold.", 6402),
+    ]
+    conn.executemany(
+        "INSERT INTO product_knowledge (text, metadata) VALUES (?, ?)",
+        [(text, json.dumps({"source_path": f"data/pdf/{pid}.pdf", "product_id": pid})) for text, pid in chunks],
+    )
+    assert build_fts_index(conn, "product_knowledge") == 4
+
+    assert lexical_search(conn, "product_knowledge", "How do I care for product 7021?") == ([2, 1], True)
+    assert lexical_search(conn, "product_knowledge", "Is 7021.pdf machine washable?")[1]
+    # A number that is not written as an id is only a BM25 term, left for fusion with the vector hits
+    rowids, confident = lexical_search(conn, "product_knowledge", "Is the coat 100% wool?")
+    assert not confident and 1 in rowids
+    assert not lexical_search(conn, "product_knowledge", "sweaters under 150 euros in 2024")[1]
+    assert lexical_search(conn, "product_knowledge", 'Which items are "GOTS" certified?') == ([3], True)
+    rowids, confident = lexical_search(conn, "product_knowledge", "care instructions washing")
+    assert not confident and set(rowids) == {2, 4}
+    assert lexical_search(conn, "product_knowledge", "what is it") == ([], False)
+    assert reciprocal_rank_fusion([[4, 1, 2], [2, 3]], limit=3) == [2, 4, 1]
+    conn.close()
+
+
+def test_product_chunks_index_by_id_and_section():
+    """Chunks are found by product id, in order, and tagged with the sheet sections they cover (overlap-aware)."""
+    sheet = [
+        "Silk Retro Coat\nProduct Overview\nA coat.\nMaterial & Fabric Composition\nShell: 100% silk\nCare Instructions\nDry clean",
+        "Dry clean only, never tumble dry.\nSustainability & Origin\nMade in Italy",
+        "Style Notes\nWear with boots.",
+    ]
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE product_knowledge (rowid INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT, metadata BLOB, text_embedding BLOB)")
+    conn.executemany(
+        "INSERT INTO product_knowledge (text, metadata) VALUES (?, ?)",
+        [(text, json.dumps({"source_path": "data/pdf/7021.pdf", "product_id": 7021, "chunk_index": i})) for i, text in reversed(list(enumerate(sheet)))]
+        + [("Linen dress", json.dumps({"source_path": "data/pdf/6402.pdf", "product_id": 6402, "chunk_index": 0}))],
+    )
+    assert build_product_index(conn, "product_knowledge") == 2
+    assert product_chunk_rowids(conn, [7021, 6402, 1]) == {7021: [3, 2, 1], 6402: [4]}
+    assert product_chunk_rowids(conn, [7021], "care") == {7021: [3, 2]}
+    assert product_chunk_rowids(conn, [7021], "style") == {7021: [1]}
+    with pytest.raises(ValueError):
+        product_chunk_rowids(conn, [7021], "price")
+    conn.close()
+
+
+def test_batched_query_embeddings_send_only_misses_in_one_request(tmp_path):
+    """embed_queries serves cached questions and embeds the rest together, identical to embed_query."""
+    class CountingEmbedding(DeterministicFakeEmbedding):
+        calls: int = 0
+
+        def embed_query(self, text: str) -> list[float]:
+            self.calls += 1
+            return super().embed_query(text)
+
+    inner = CountingEmbedding(size=8)
+    cache = CachedEmbeddings(inner, tmp_path / "rag_cache.db")
+    cached = cache.embed_query("What is the Silk Retro Coat made of?")
+    vectors = cache.embed_queries(["what is the silk retro coat made of", "How do I wash it?", "how do i wash it", "Size guide?"])
+    assert vectors[0] == cached and vectors[1] == vectors[2] == cache.embed_query("How do I wash it")
+    assert inner.calls == 3
+    stats = cache.stats()
+    assert (stats["misses"], stats["batch_requests"], stats["stored_entries"]) == (3, 1, 3)
+    cache.close()
+
+
+def test_batched_search_matches_single_searches_and_sends_shared_chunks_once(tmp_path, monkeypatch):
+    """One embedding request for the batch; a chunk retrieved by several questions is one [C#] block in the prompt."""
+    runtime = RAGRuntime(db_file=str(tmp_path / "rag.db"), embeddings=DeterministicFakeEmbedding(size=16), cache_file=tmp_path / "rag_cache.db")
+    runtime.vector_store().add_texts([f"sheet {i}" for i in range(20)], [{"source_path": f"data/pdf/{i}.pdf"} for i in range(20)])
+    questions = ["sheet 3", "Sheet 3 ", "sheet 7"]
+
+    call = runtime.begin_call()
+    batched = runtime.similarity_search_batch(questions, k=3, call=call)
+    assert call["path"] == "batch" and runtime.embeddings().stats()["batch_requests"] == 1
+    assert [[doc.page_content for doc in docs] for docs in batched] == \
+        [[doc.page_content for doc in runtime.similarity_search(question, k=3, call=runtime.begin_call())] for question in questions]
+
+    class FakeStructuredLLM:
+        def invoke(self, prompt: str) -> BatchRAGResponse:
+            self.prompt = prompt
+            return BatchRAGResponse(answers=[BatchAnswer(question_number=1, answer="Sheet three.", used_sources=["3.pdf"]),
+                                             BatchAnswer(question_number=3, answer="Sheet seven.", used_sources=["7.pdf", "3.pdf"])])
+
+    llm = runtime._structured[BatchRAGResponse] = FakeStructuredLLM()
+    monkeypatch.setattr("tools_rag.get_rag_runtime", lambda: runtime)
+    result = json.loads(query_rag_batch.invoke({"questions": questions}))
+    blocks = re.findall(r"\[C\d+\] Source: (\S+)", llm.prompt)
+    assert len(blocks) == len(set(blocks)) and "3.pdf" in blocks
+    refs = re.findall(r"Chunks: (.*)", llm.prompt)
+    assert refs[0] == refs[1]
+    assert [item["answer"] for item in result["answers"]] == ["Sheet three.", "No answer returned.", "Sheet seven."]
+    assert result["used_sources"] == ["3.pdf", "7.pdf"]
+    runtime.close()
+
+
+def test_batch_keeps_identical_chunks_from_different_sheets_apart(monkeypatch):
+    """Templated chunks with the same text in two product sheets are two [C#] blocks, each with its own source."""
+    class StubRuntime:
+        def begin_call(self):
+            return {}
+
+        def end_call(self, call):
+            pass
+
+        def similarity_search_batch(self, questions, k, call):
+            return [[Document(id=str(i), page_content="Wash cold, dry flat.", metadata={"source_path": f"data/pdf/{source}"})]
+                    for i, source in enumerate(["7021.pdf", "5310.pdf"], 1)]
+
+        def synthesize(self, schema, prompt, call):
+            self.prompt = prompt
+            return BatchRAGResponse(answers=[])
+
+    runtime = StubRuntime()
+    monkeypatch.setattr("tools_rag.get_rag_runtime", lambda: runtime)
+    query_rag_batch.invoke({"questions": ["How do I wash 7021?", "How do I wash 5310?"]})
+    assert re.findall(r"\[C\d+\] Source: (\S+)", runtime.prompt) == ["7021.pdf", "5310.pdf"]
+    assert re.findall(r"Chunks: (.*)", runtime.prompt) == ["C1", "C2"]
+
+
+def test_collect_results_splits_batch_answers_and_takes_sources_from_the_union():
+    content = json.dumps({
+        "answer": "Q: a\nA: 1\nQ: b\nA: 2",
+        "used_sources": ["7021.pdf", "5310.pdf"],
+        "answers": [{"question": "a", "answer": "1", "used_sources": ["7021.pdf"]},
+                    {"question": "b", "answer": "2", "used_sources": ["5310.pdf", "7021.pdf"]}],
+    })
+    state = {
+        "messages": [AIMessage(content="", tool_calls=[{"name": "query_rag_batch", "args": {"questions": ["a", "b"]}, "id": "1"}]),
+                     ToolMessage(content=content, name="query_rag_batch", tool_call_id="1")],
+        "collected_results": ["[query_sql] earlier"],
+        "rag_sources": [],
+    }
+    update = collect_results(state)
+    assert update["collected_results"] == ["[query_sql] earlier", "[query_rag_batch] Q: a\nA: 1", "[query_rag_batch] Q: b\nA: 2"]
+    assert update["rag_sources"] == [{"source": "7021.pdf", "tool": "query_rag_batch"}, {"source": "5310.pdf", "tool": "query_rag_batch"}]
+
+
+def test_quantized_codes_and_exact_rerank():
+    """Matryoshka truncation renormalizes, codes have the sqlite-vec layout, rerank uses the stored float32 vectors."""
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(50, 64)).astype(np.float32)
+    truncated = truncate(vectors, 16)
+    assert truncated.shape == (50, 16) and np.allclose(np.linalg.norm(truncated, axis=1), 1, atol=1e-5)
+    assert quantize(truncated, "binary").shape == (50, 2)
+    assert quantize(np.array([[1, -1, 1, 1, -1, -1, -1, 1]], dtype=np.float32), "binary")[0, 0] == 0b10001101
+    codes = quantize(truncated, "int8", float(np.abs(truncated).max()))
+    assert codes.dtype == np.int8 and np.abs(codes).max() == 127
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE chunks (rowid INTEGER PRIMARY KEY, text_embedding BLOB)")
+    conn.executemany("INSERT INTO chunks VALUES (?, ?)", [(i + 1, vector.tobytes()) for i, vector in enumerate(vectors)])
+    exact = np.argsort(((vectors - vectors[3]) ** 2).sum(axis=1))[:5] + 1
+    assert rerank(conn, "chunks", vectors[3].tolist(), list(range(50, 0, -1)), 5) == exact.tolist()
+
+
+def test_ivf_index_searches_probed_lists_and_updates_incrementally():
+    """All lists probed = exact search; new and deleted chunks are picked up by sync() without retraining."""
+    vectors = synthetic_vectors(600, 16, topic_size=50)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE chunks (rowid INTEGER PRIMARY KEY, text_embedding BLOB)")
+    conn.executemany("INSERT INTO chunks VALUES (?, ?)", [(i + 1, vector.tobytes()) for i, vector in enumerate(vectors[:500])])
+    index = build_ivf_index(conn, "chunks")
+    assert index.stats()["vectors"] == 500 and index.stats()["lists"] == 22
+
+    def exact(query, ids):
+        distances = {rowid: float(((vectors[rowid - 1] - query) ** 2).sum()) for rowid in ids}
+        return sorted(distances, key=distances.get)[:5]
+
+    query = vectors[550]
+    assert index.search(query, 5, nprobe=22) == exact(query, range(1, 501))
+    assert set(index.search(query, 5, nprobe=1)) <= set(range(1, 501))
+
+    conn.executemany("INSERT INTO chunks VALUES (?, ?)", [(i + 1, vector.tobytes()) for i, vector in enumerate(vectors[500:], 500)])
+    conn.execute("DELETE FROM chunks WHERE rowid <= 100")
+    reopened = IVFIndex(conn, "chunks")
+    assert reopened.sync() == 100 and reopened.stats()["vectors"] == 500
+    assert reopened.search(query, 5, nprobe=22) == exact(query, range(101, 601))
+
+
+def test_numpy_export_ranks_a_batch_in_one_pass_and_goes_stale(tmp_path, monkeypatch):
+    """Batched matrix search equals exact per-question search, across row blocks; a new chunk makes the export stale."""
+    monkeypatch.setattr("rag_vectors.MATRIX_BLOCK_ROWS", 64)
+    vectors = synthetic_vectors(300, 16, topic_size=30)
+    db_file = tmp_path / "rag.db"
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE chunks (rowid INTEGER PRIMARY KEY, text_embedding BLOB)")
+    conn.executemany("INSERT INTO chunks VALUES (?, ?)", [(i + 10, vector.tobytes()) for i, vector in enumerate(vectors)])
+    conn.commit()
+    assert build_vector_export(db_file, "chunks", tmp_path / "rag_vectors")["rows"] == 300
+
+    matrix = VectorMatrix(db_file, tmp_path / "rag_vectors", "chunks")
+    queries = vectors[[3, 150, 299]] + 0.01
+    exact = [(np.argsort(((vectors - query) ** 2).sum(axis=1), kind="stable")[:5] + 10).tolist() for query in queries]
+    assert matrix.search(queries, 5) == exact
+    assert matrix.stats()["matrix"] == [300, 16]
+
+    conn.execute("INSERT INTO chunks VALUES (1000, ?)", (vectors[0].tobytes(),))
+    conn.commit()
+    assert matrix.search(queries, 5) is None and matrix.stats()["stale"] == 1
+
+
+def test_answer_cache_reuses_answers_for_similar_questions_over_the_same_chunks(tmp_path):
+    """Hit only with the same chunk set and a close embedding; prune drops answers whose chunk text changed."""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE chunks (rowid INTEGER PRIMARY KEY, text TEXT)")
+    conn.executemany("INSERT INTO chunks VALUES (?, ?)", [(1, "Wool sweater: 100% merino wool."), (2, "Hand wash cold."), (3, "Cotton tee.")])
+    docs = [Document(id=str(rowid), page_content=text) for rowid, text in conn.execute("SELECT rowid, text FROM chunks")]
+    question, paraphrase, unrelated = np.eye(8)[0], np.eye(8)[0] + 0.2 * np.eye(8)[1], np.eye(8)[2]
+
+    cache = SemanticAnswerCache("model|llm", tmp_path / "rag_cache.db")
+    cache.store("what is the wool sweater made of", question.tolist(), docs[:2], {"answer": "Merino wool.", "used_sources": ["1.pdf"]}, 2.5)
+    assert cache.lookup(paraphrase.tolist(), docs[1::-1]) == {"answer": "Merino wool.", "used_sources": ["1.pdf"]}
+    assert cache.lookup(paraphrase.tolist(), docs) is None
+    assert cache.lookup(unrelated.tolist(), docs[:2]) is None
+    assert SemanticAnswerCache("other|llm", tmp_path / "rag_cache.db").lookup(question.tolist(), docs[:2]) is None
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["hit_rate"] == pytest.approx(1 / 3) and stats["saved_seconds"] == 2.5
+
+    assert cache.prune(conn, "chunks") == 0
+    conn.execute("UPDATE chunks SET text = 'Hand wash cold, dry flat.' WHERE rowid = 2")
+    assert cache.prune(conn, "chunks") == 1 and cache.stats()["entries"] == 0
+    cache.close()
+
+
+def test_runtime_answer_cache_skips_lexical_only_calls(tmp_path):
+    """query_rag's cache hooks: a vector-retrieved answer is reused, lexical-only calls neither store nor look up."""
+    runtime = RAGRuntime(embeddings=DeterministicFakeEmbedding(size=16), cache_file=tmp_path / "rag_cache.db")
+    docs = [Document(id="7", page_content="Silk retro coat. Material: 100% mulberry silk.")]
+
+    def call_for(question: str, path: str) -> dict:
+        call = {**runtime.begin_call(), "path": path, "synthesis": 1.5}
+        if path != "lexical_only":
+            call["embedding"] = runtime.embeddings().embed_query(question)
+        return call
+
+    call = call_for("what is the silk retro coat made of", "hybrid")
+    assert runtime.cached_answer(docs, call) is None
+    runtime.store_answer("what is the silk retro coat made of", docs, {"answer": "Silk.", "used_sources": ["7.pdf"]}, call)
+    runtime.end_call(call)
+
+    call = call_for("what is the silk retro coat made of", "vector_only")
+    assert runtime.cached_answer(docs, call) == {"answer": "Silk.", "used_sources": ["7.pdf"]}
+    runtime.end_call(call)
+    assert runtime.cached_answer(docs, call_for("how do I wash the silk retro coat", "hybrid")) is None
+
+    misses = runtime.embeddings().stats()["misses"]
+    call = call_for("how do I wash product 7", "lexical_only")
+    assert runtime.cached_answer(docs, call) is None and "embedding" not in call
+    runtime.store_answer("how do I wash product 7", docs, {"answer": "Dry clean."}, call)
+    assert runtime.embeddings().stats()["misses"] == misses
+    stats = runtime.stats()
+    assert stats["cached_answers"] == 1 and stats["answer_cache"]["entries"] == 1 and stats["answer_cache"]["lookups"] == 3
+    runtime.close()
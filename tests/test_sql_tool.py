@@ -2,9 +2,53 @@
 ##                            IMPORTS
 ###########################################################################
 
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pytest
 
-from tools_sql import query_sql
+from columnar import ColumnarEngine, _Evaluation, build_columnar
+from compact_layout import COMPACT_TABLE, compact, expand, is_compact
+from entity_resolver import ProductResolver
+from index_advisor import propose_index
+from load_sales import _create_schema, _open, load_table
+from migrations import FX_RATES, add_missing_columns, backfill_usd, create_missing_tables, load_fx_rates, migrate
+from models import ProductDB, TransactionDB
+from partitions import PartitionEngine, build_partitions
+from rollups import ROLLUP_META, RollupRouter, _source_fingerprint, build_rollups, plan_rollup_rewrite
+from sql_cache import RESULT_CACHE, SQLResultCache, from_tables, normalize_sql, sql_words, tokenize_sql
+from sql_format import estimate_tokens, format_compact, format_result, format_table
+from sql_handles import RESULT_HANDLES, HandleExpiredError, ResultHandleStore
+from sql_pool import DB_PATH, get_pool
+from tools_sql import QueryBudget, QueryBudgetError, _execute, fetch_sql_page, query_sql, query_sql_batch, resolve_products, summarize_sql_result
+
+
+###########################################################################
+##                           FIXTURES
+###########################################################################
+
+
+@pytest.fixture(scope="module")
+def migrated_db(tmp_path_factory):
+    """A copy of sales.db brought up to models.py by migrations.py (generated, USD and fx_rates columns)."""
+    db_path = tmp_path_factory.mktemp("migrated") / "sales.db"
+    source, target = sqlite3.connect(f"file:{DB_PATH.as_posix()}?mode=ro", uri=True), sqlite3.connect(db_path)
+    source.backup(target)
+    source.close()
+    target.close()
+    migrate(db_path)
+    return db_path
+
+
+@pytest.fixture(scope="module")
+def rollup_db(migrated_db, tmp_path_factory):
+    """The migrated copy with every rollup built."""
+    db_path = tmp_path_factory.mktemp("rollups") / "sales.db"
+    shutil.copyfile(migrated_db, db_path)
+    build_rollups(db_path)
+    return db_path
 
 
 ###########################################################################
@@ -65,3 +109,481 @@ def test_transactions_are_2024_only():
     assert "2024" in result
     assert "2023" not in result
     assert "2025" not in result
+
+
+def test_large_result_is_capped_with_total_count():
+    total = query_sql.invoke({"sql": "SELECT COUNT(*) AS cnt FROM transactions"}).split("\n")[-1].strip()
+    result = query_sql.invoke({"sql": "SELECT id, product_id, line_total FROM transactions"})
+    lines = result.strip().split("\n")
+    assert len(lines) == 1 + 200 + 1  # header + capped rows + footer
+    assert f"({total} total rows, showing first 200)" in lines[-1]
+
+
+def test_pool_reuses_connections_across_threads():
+    pool = get_pool()
+    before = pool.stats()
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        results = list(executor.map(
+            lambda i: query_sql.invoke({"sql": f"SELECT COUNT(*) AS cnt FROM stores WHERE store_id > -{i}"}),
+            range(24),
+        ))
+    after = pool.stats()
+    assert all("35" in r for r in results)
+    assert after["open"] <= pool.size
+    assert after["checkouts"] - before["checkouts"] == 24
+    assert after["hits"] > before["hits"]
+
+
+def test_pool_connections_are_read_only():
+    with get_pool().connection() as conn:
+        with pytest.raises(Exception, match="readonly|read-only"):
+            conn.execute("CREATE TABLE should_not_exist (x INTEGER)")
+
+
+def test_normalize_sql_canonicalizes_formatting():
+    a = "SELECT  p.category, SUM(t.line_total)\nFROM transactions t -- revenue\nJOIN products p ON t.product_id = p.product_id LIMIT 010;"
+    b = "select p.CATEGORY, sum(t.line_total) from TRANSACTIONS t join products p on t.product_id = p.product_id limit 10"
+    assert normalize_sql(a) == normalize_sql(b)
+    assert normalize_sql("SELECT 1.50") == normalize_sql("SELECT 1.5")
+    assert normalize_sql("SELECT * FROM stores WHERE country = 'Germany'") != \
+        normalize_sql("SELECT * FROM stores WHERE country = 'germany'")
+
+
+def test_result_cache_hit_returns_same_output():
+    sql = "SELECT country, COUNT(*) AS n FROM stores GROUP BY country ORDER BY country"
+    first = query_sql.invoke({"sql": sql})
+    hits_before = RESULT_CACHE.stats()["hits"]
+    second = query_sql.invoke({"sql": sql.lower().replace(" ", "  ")})
+    assert second == first
+    assert RESULT_CACHE.stats()["hits"] == hits_before + 1
+    # Same rows, but the column names come from the query as typed
+    upper = query_sql.invoke({"sql": "SELECT country, COUNT(*) AS Stores FROM stores GROUP BY country ORDER BY country"})
+    lower = query_sql.invoke({"sql": "select country, count(*) as stores from stores group by country order by country"})
+    assert "Stores=" in upper and "stores=" in lower
+    assert query_sql.invoke({"sql": "SELECT sum(store_id) FROM stores"}).startswith("sum(store_id)")
+    assert query_sql.invoke({"sql": "SELECT SUM(store_id) FROM stores"}).startswith("SUM(store_id)")
+
+
+def test_result_cache_invalidates_when_db_changes(tmp_path):
+    db_file = tmp_path / "cache.db"
+    db_file.write_bytes(b"v1")
+    cache = SQLResultCache(db_path=db_file)
+    cache.put("q", (["x"], [(1,)], 1), cache.signature())
+    assert cache.get("q") is not None
+
+    db_file.write_bytes(b"v2 - new data")
+    assert cache.get("q") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_rollup_rewrite_eligibility():
+    assert plan_rollup_rewrite(
+        "SELECT p.category, SUM(t.line_total) AS revenue, COUNT(*) FROM transactions t "
+        "JOIN products p ON t.product_id = p.product_id WHERE t.transaction_type = 'Sale' GROUP BY p.category"
+    ).required == {"product_id"}
+    assert plan_rollup_rewrite(
+        "SELECT SUBSTR(t.date, 1, 7) AS month, SUM(t.quantity) FROM transactions t GROUP BY month"
+    ).required == {"sale_month"}
+    # Per-line columns, non-additive aggregates and plain row listings stay on transactions
+    assert plan_rollup_rewrite("SELECT COUNT(DISTINCT t.invoice_id) FROM transactions t") is None
+    assert plan_rollup_rewrite("SELECT AVG(t.line_total) FROM transactions t") is None
+    assert plan_rollup_rewrite("SELECT t.product_id, t.line_total FROM transactions t") is None
+    assert plan_rollup_rewrite("SELECT COUNT(*) FROM transactions JOIN stores USING (store_id)") is None
+    # An alias shadowing a measure does not make the measure's other uses rollup-safe
+    assert plan_rollup_rewrite(
+        "SELECT product_id, SUM(line_total) AS line_total, MAX(line_total) AS top_line FROM transactions GROUP BY product_id"
+    ) is None
+    # Signed or non-zero constant CASE branches, and star select items, stay on transactions
+    assert plan_rollup_rewrite("SELECT SUM(CASE WHEN transaction_type = 'Return' THEN -1 ELSE quantity END) FROM transactions") is None
+    assert plan_rollup_rewrite("SELECT *, COUNT(*) FROM transactions GROUP BY store_id") is None
+    assert plan_rollup_rewrite("SELECT t.*, COUNT(*) FROM transactions t GROUP BY t.store_id") is None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT s.country, SUM(t.line_total) AS revenue, SUM(t.quantity) AS units, COUNT(*) "
+    "FROM transactions t JOIN stores s ON t.store_id = s.store_id "
+    "WHERE t.transaction_type = 'Sale' GROUP BY s.country ORDER BY s.country",
+    # Nothing matches: COUNT(*) is 0, not NULL
+    "SELECT COUNT(*) FROM transactions WHERE product_id = -5",
+    # ORDER BY names the alias, which is the summed measure
+    "SELECT product_id, SUM(line_total) AS line_total FROM transactions GROUP BY product_id ORDER BY line_total DESC, product_id LIMIT 5",
+    "SELECT product_id, SUM(quantity) AS quantity, MAX(quantity) FROM transactions GROUP BY product_id ORDER BY product_id",
+    "SELECT store_id, SUM(CASE WHEN transaction_type = 'Return' THEN -1 ELSE quantity END) FROM transactions GROUP BY store_id ORDER BY store_id",
+    # Joins on the rollup's columns would change meaning, these stay on transactions
+    "SELECT COUNT(*) FROM transactions NATURAL JOIN stores",
+    "SELECT s.country, COUNT(*) FROM stores s LEFT JOIN transactions t ON t.store_id = s.store_id GROUP BY s.country ORDER BY s.country",
+])
+def test_rollup_routed_query_matches_base_table(sql, rollup_db):
+    conn = sqlite3.connect(rollup_db)
+    outputs = []
+    for query in (RollupRouter(rollup_db).rewrite(sql) or sql, sql):
+        cursor = conn.execute(query)
+        rows = cursor.fetchall()
+        outputs.append(format_result([col[0] for col in cursor.description], rows, len(rows)))
+    conn.close()
+    assert outputs[0] == outputs[1]
+
+
+def test_rollup_fingerprint_catches_measure_updates(tmp_path):
+    db_path = tmp_path / "sales.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE transactions (id INTEGER PRIMARY KEY, product_id INTEGER, store_id INTEGER, date VARCHAR, "
+                 "transaction_type VARCHAR, line_total FLOAT, quantity INTEGER)")
+    conn.execute("INSERT INTO transactions VALUES (1, 1, 1, '2024-03-04 10:00:00', 'Sale', 10.0, 1), (2, 2, 1, '2024-03-05 11:00:00', 'Sale', 5.0, 2)")
+    conn.commit()
+    build_rollups(db_path)
+    built_from = conn.execute(f"SELECT DISTINCT source_rows, source_max_id, source_line_total, source_quantity FROM {ROLLUP_META}").fetchall()
+    assert built_from == [_source_fingerprint(conn)]
+    # Same row count and max id, different totals: the rollups no longer match
+    conn.execute("UPDATE transactions SET line_total = 7.5 WHERE id = 2")
+    assert _source_fingerprint(conn) not in built_from
+    conn.execute("UPDATE transactions SET line_total = 5.0, quantity = 3 WHERE id = 2")
+    assert _source_fingerprint(conn) not in built_from
+    conn.close()
+
+
+def test_index_advisor_proposes_covering_index_for_hot_shape():
+    sql = (
+        "SELECT p.product_id, SUM(t.line_total) AS revenue, SUM(t.quantity) AS units FROM transactions t "
+        "JOIN products p ON t.product_id = p.product_id WHERE t.transaction_type = 'Sale' GROUP BY p.product_id"
+    )
+    tokens = tokenize_sql(sql)
+    with get_pool().connection() as conn:
+        seek, covered = propose_index(conn, sql, "t", "transactions", from_tables(tokens, sql_words(tokens)))
+    assert seek == ("transaction_type", "product_id")
+    assert covered == ("line_total", "quantity")
+
+
+def test_query_log_failure_does_not_fail_the_query(monkeypatch):
+    def broken_log(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("tools_sql.CAPTURE_QUERIES", True)
+    monkeypatch.setattr("tools_sql.log_query", broken_log)
+    RESULT_CACHE.clear()
+    with get_pool().connection() as conn:
+        thousands = conn.execute("SELECT COUNT(*) / 1000 FROM transactions").fetchone()[0]
+    assert query_sql.invoke({"sql": "SELECT COUNT(*) / 1000 FROM transactions"}).split("\n")[-1] == str(thousands)
+
+
+def test_cartesian_join_rejected_as_tool_output():
+    result = query_sql.invoke({"sql": "SELECT c.country, AVG(t.line_total) FROM customers c, transactions t GROUP BY c.country"})
+    assert result.startswith("Error: query rejected before running")
+    assert "customers" in result and "transactions" in result
+
+
+def test_runaway_query_cancelled_by_budget():
+    runaway = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT COUNT(*) FROM n"
+    with get_pool().connection() as conn:
+        with pytest.raises(QueryBudgetError, match="time budget"):
+            _execute(conn, runaway, QueryBudget(seconds=0.2))
+        with pytest.raises(QueryBudgetError, match="VM-step budget"):
+            _execute(conn, runaway, QueryBudget(seconds=None, vm_steps=100_000))
+        # The connection is usable again once the handler is removed
+        assert _execute(conn, "SELECT 1")[1] == [(1,)]
+
+
+def test_compact_format_encodes_constants_and_repeats():
+    columns = ["country", "category", "revenue"]
+    rows = [("United Kingdom", "Feminine Knitwear Cardigan", 1234.5678999), ("United Kingdom", "Masculine Denim Jacket", 0.123456789)] * 10
+    compact = format_compact(columns, rows, len(rows))
+    lines = compact.split("\n")
+    assert lines[0] == "# all rows: country=United Kingdom"
+    assert lines[1] == "# category: ~1=Feminine Knitwear Cardigan, ~2=Masculine Denim Jacket"
+    assert lines[2] == "category\trevenue"
+    assert lines[3:5] == ["~1\t1234.57", "~2\t0.123457"]
+    assert estimate_tokens(compact) < estimate_tokens(format_table(columns, rows, len(rows))) * 0.6
+
+    # Truncated: the rows past the shown ones may differ, so the column stays
+    truncated = format_compact(columns, rows, 500).split("\n")
+    assert not truncated[0].startswith("# all rows") and truncated[2] == "country\tcategory\trevenue"
+
+
+def test_compact_format_keeps_significant_digits_of_rates(tmp_path):
+    db_path = tmp_path / "rates.db"
+    create_missing_tables(db_path)
+    conn = sqlite3.connect(db_path)
+    load_fx_rates(conn)
+    cursor = conn.execute("SELECT currency, usd_rate FROM fx_rates WHERE currency IN ('EUR', 'GBP') ORDER BY 1")
+    rows = cursor.fetchall()
+    result = format_compact([col[0] for col in cursor.description], rows, len(rows))
+    conn.close()
+    assert f"EUR\t{FX_RATES['EUR']}" in result and f"GBP\t{FX_RATES['GBP']}" in result
+    assert format_compact(["lat", "ratio", "avg"], [(52.5200066, 0.3333333333, 1234.5678)], 1).endswith("\n52.52\t0.333333\t1234.57")
+    # Significant digits do not depend on magnitude: a longitude past 100 keeps its third decimal, money its cents
+    assert format_compact(["lon", "revenue"], [(-122.4194, 1234567.891)], 1).endswith("\n-122.419\t1234567.89")
+
+
+def test_batch_returns_sections_in_order_with_timings():
+    statements = [
+        "SELECT country, COUNT(*) AS stores FROM stores GROUP BY country ORDER BY country",
+        "SELECT category, COUNT(*) AS n FROM products GROUP BY category ORDER BY category",
+        "SELECT * FROM nonexistent_table_xyz",
+    ]
+    sections = query_sql_batch.invoke({"statements": statements}).split("\n\n")
+    assert len(sections) == 3
+    for i, (section, sql) in enumerate(zip(sections, statements), 1):
+        header, echoed, output = section.split("\n", 2)
+        assert header.startswith(f"-- [{i}/3]") and echoed == sql
+        if i < 3:
+            assert output == query_sql.invoke({"sql": sql})
+    assert "no such table" in sections[2]
+
+    # All cached: no connection is checked out
+    before = get_pool().stats()["checkouts"]
+    assert "-- [2/2] cached" in query_sql_batch.invoke({"statements": statements[:2]})
+    assert get_pool().stats()["checkouts"] == before
+
+
+def test_batch_reports_any_statement_error_in_its_section(monkeypatch):
+    def run(conn, sql, engines=True):
+        if "boom" in sql:
+            raise RuntimeError("boom")
+        assert not engines    # the engines would not read the batch's snapshot
+        return ["x"], [(1,)], 1, None
+
+    monkeypatch.setattr("tools_sql._run_query", run)
+    sections = query_sql_batch.invoke({"statements": ["SELECT 'boom'", "SELECT 1 AS x"]}).split("\n\n")
+    assert sections[0].endswith("Error: boom") and sections[1].endswith("\n1")
+
+
+def test_columnar_engine_matches_sqlite(tmp_path, migrated_db):
+    build_columnar(migrated_db, out_dir=tmp_path / "columnar")
+    engine = ColumnarEngine(migrated_db, data_dir=tmp_path / "columnar")
+    conn = sqlite3.connect(migrated_db)
+    sql = (
+        "SELECT SUBSTR(t.date, 1, 7) AS month, s.country, SUM(t.line_total) AS revenue, "
+        "COUNT(DISTINCT t.invoice_id) AS invoices, ROUND(AVG(t.unit_price), 2) AS avg_price "
+        "FROM transactions t JOIN stores s ON t.store_id = s.store_id "
+        "WHERE t.transaction_type = 'Sale' AND s.country IN ('France', 'Spain') GROUP BY month, s.country ORDER BY month, revenue DESC"
+    )
+    columns, rows = engine.execute(sql)
+    cursor = conn.execute(sql)
+    expected = cursor.fetchall()
+    assert columns == [col[0] for col in cursor.description]
+    assert [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows] == \
+        [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in expected]
+    assert engine.execute("SELECT DISTINCT country FROM stores") is None
+    # age is NULL without a date of birth: NULL != 30 must not match, in the engine as in SQLite
+    sql = ("SELECT c.gender, COUNT(*), MIN(c.age) FROM transactions t JOIN customers c ON t.customer_id = c.customer_id "
+           "WHERE c.age != 30 GROUP BY c.gender ORDER BY 1")
+    assert [tuple(row) for row in engine.execute(sql)[1]] == conn.execute(sql).fetchall()
+    conn.close()
+    evaluation = _Evaluation.__new__(_Evaluation)
+    ages = np.array([30.0, np.nan, 41.0])
+    assert evaluation.operator("!=", ages, 30).tolist() == [False, False, True]
+    assert evaluation.operator("!=", ages, ages[::-1]).tolist() == [True, False, True]
+    # GROUP BY date means the column to SQLite, not the alias: left to SQLite
+    assert engine.execute("SELECT SUBSTR(date, 1, 7) AS date, COUNT(*) FROM transactions GROUP BY date") is None
+
+
+def test_generated_columns_added_to_existing_database(tmp_path):
+    db_path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE customers (customer_id INTEGER PRIMARY KEY, name VARCHAR, date_of_birth VARCHAR)")
+    conn.execute("CREATE TABLE transactions (id INTEGER PRIMARY KEY, date VARCHAR, line_total FLOAT)")
+    conn.execute("INSERT INTO customers VALUES (1, 'A', '2000-12-31'), (2, 'B', '1990-06-15'), (3, 'C', NULL)")
+    conn.execute("INSERT INTO transactions VALUES (1, '2024-03-04 17:45:00', 10.0)")
+    conn.commit()
+
+    added = add_missing_columns(db_path)
+    assert ("transactions", "sale_month") in added and ("customers", "age_band") in added
+    assert add_missing_columns(db_path) == []
+    assert conn.execute("SELECT sale_day, sale_month, sale_week, hour FROM transactions").fetchone() == ("2024-03-04", "2024-03", "2024-W10", 17)
+    assert conn.execute("SELECT age, age_band FROM customers ORDER BY customer_id").fetchall() == [(24, "18-24"), (34, "25-34"), (None, None)]
+    conn.close()
+
+
+def test_usd_columns_backfilled_from_fx_rates(tmp_path):
+    db_path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE transactions (id INTEGER PRIMARY KEY, date VARCHAR, currency VARCHAR, line_total FLOAT, invoice_total FLOAT)")
+    conn.execute("INSERT INTO transactions VALUES (1, '2024-01-02 10:00:00', 'EUR', 100.0, 250.0), (2, '2024-01-02 11:00:00', 'USD', 40.0, 40.0)")
+    conn.commit()
+
+    assert "fx_rates" in create_missing_tables(db_path)
+    assert ("transactions", "line_total_usd") in add_missing_columns(db_path)
+    assert backfill_usd(db_path) == 2
+    assert backfill_usd(db_path) == 0
+    rows = conn.execute("SELECT line_total_usd, invoice_total_usd FROM transactions ORDER BY id").fetchall()
+    assert rows == [(pytest.approx(100 * FX_RATES["EUR"]), pytest.approx(250 * FX_RATES["EUR"])), (40.0, 40.0)]
+    conn.close()
+
+
+def test_bulk_loader_rejects_invalid_rows_and_resumes(tmp_path):
+    csv_path = tmp_path / "products.csv"
+    header = "Product ID,Category,Sub Category,Description PT,Description DE,Description FR,Description ES,Description EN,Description ZH,Color,Sizes,Production Cost"
+    rows = [f"{i},Feminine,Coats,pt,de,fr,es,en {i},zh,,S|M,{-1 if i == 2 else 10 * i}" for i in range(1, 6)]
+    csv_path.write_text("\n".join([header, *rows]) + "\n", encoding="utf-8")
+    conn = _open(tmp_path / "sales.db")
+    _create_schema(conn)
+
+    report = load_table(conn, ProductDB.__table__, csv_path, chunk_rows=2)
+    assert (report["rows"], report["rejected"], report["reasons"]) == (4, 1, {"ck_products_cost": 1})
+    assert conn.execute("SELECT description_en, color FROM products WHERE product_id = 5").fetchone() == ("en 5", None)
+
+    # Interrupted in the second chunk: one of its rows is in, its progress row is not
+    conn.execute("UPDATE load_progress SET chunks_done = 1, rows_read = 2, rows_loaded = 1, rows_rejected = 1, finished = 0")
+    conn.execute("DELETE FROM products WHERE product_id IN (4, 5)")
+    report = load_table(conn, ProductDB.__table__, csv_path, chunk_rows=2)
+    assert report["resumed"] and (report["rows"], report["rejected"]) == (4, 1)
+    assert [row[0] for row in conn.execute("SELECT product_id FROM products ORDER BY product_id")] == [1, 3, 4, 5]
+
+    # Interrupted in the very first chunk: no progress row yet, but a row is in
+    conn.execute("DELETE FROM load_progress")
+    conn.execute("DELETE FROM products WHERE product_id != 1")
+    report = load_table(conn, ProductDB.__table__, csv_path, chunk_rows=2)
+    assert not report["resumed"] and (report["rows"], report["rejected"]) == (4, 1)
+    conn.close()
+
+
+def test_partitions_prune_and_merge_like_sqlite(tmp_path, migrated_db):
+    build_partitions("month", migrated_db, out_dir=tmp_path / "partitions")
+    engine = PartitionEngine(migrated_db, data_dir=tmp_path / "partitions")
+    queries = [
+        ("SELECT s.country, SUM(t.line_total) AS revenue, AVG(t.quantity) AS avg_qty, COUNT(*) AS n FROM transactions t "
+         "JOIN stores s ON t.store_id = s.store_id WHERE t.sale_day BETWEEN '2024-03-01' AND '2024-04-30' "
+         "GROUP BY s.country HAVING COUNT(*) > 10 ORDER BY revenue DESC", 2),
+        ("SELECT product_id, SUM(quantity) AS units FROM transactions WHERE transaction_type = 'Sale' "
+         "GROUP BY product_id ORDER BY units DESC, product_id LIMIT 5", 12),
+        ("SELECT MIN(date), MAX(line_total), COUNT(*) FROM transactions WHERE SUBSTR(date, 1, 7) = '2031-01'", 0),
+        # Integer affinity: '5' matches store 5
+        ("SELECT COUNT(*), SUM(quantity) FROM transactions WHERE store_id = '5' AND sale_day < '2024-03-01'", 3),
+    ]
+    conn = sqlite3.connect(migrated_db)
+    for sql, scanned in queries:
+        before = engine.stats()["scanned"]
+        columns, rows = engine.execute(sql)
+        cursor = conn.execute(sql)
+        expected = cursor.fetchall()
+        assert columns == [col[0] for col in cursor.description]
+        assert [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows] == \
+            [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in expected]
+        assert engine.stats()["scanned"] - before == scanned
+    conn.close()
+    assert engine.execute("SELECT COUNT(DISTINCT customer_id) FROM transactions") is None
+    engine.close()
+
+
+def test_partitions_leave_undetermined_bare_columns_to_sqlite(tmp_path, migrated_db):
+    build_partitions("month", migrated_db, out_dir=tmp_path / "partitions")
+    engine = PartitionEngine(migrated_db, data_dir=tmp_path / "partitions")
+    # SQLite takes product_id from the row holding the MAX, the partitions cannot reproduce that
+    assert engine.execute("SELECT store_id, product_id, MAX(line_total) FROM transactions GROUP BY store_id") is None
+    assert engine.stats()["unsupported"] == 1
+    # A product column is fixed by the grouped product key it was joined on
+    sql = ("SELECT t.product_id, p.category, MAX(t.line_total) FROM transactions t "
+           "JOIN products p ON t.product_id = p.product_id GROUP BY t.product_id ORDER BY 1 LIMIT 5")
+    columns, rows = engine.execute(sql)
+    conn = sqlite3.connect(migrated_db)
+    assert [tuple(row) for row in rows] == conn.execute(sql).fetchall()
+    conn.close()
+    engine.close()
+
+
+def test_compact_layout_view_matches_plain_table(tmp_path, migrated_db):
+    db_path = tmp_path / "sales.db"
+    conn = _open(db_path)
+    _create_schema(conn)
+    stored = ", ".join(column.name for column in TransactionDB.__table__.columns if column.computed is None)
+    conn.execute(f"ATTACH DATABASE '{migrated_db}' AS src")
+    conn.execute(f"INSERT INTO transactions ({stored}) SELECT {stored} FROM src.transactions WHERE id <= 2000")
+    conn.execute("DETACH DATABASE src")
+    conn.close()
+    queries = [
+        "SELECT * FROM transactions ORDER BY id",
+        "SELECT payment_method, currency, size, COUNT(*), ROUND(SUM(line_total), 2) FROM transactions "
+        "WHERE transaction_type = 'Sale' GROUP BY payment_method, currency, size ORDER BY 1, 2, 3",
+    ]
+    conn = sqlite3.connect(db_path)
+    expected = [conn.execute(sql).fetchall() for sql in queries]
+    columns = [row[1] for row in conn.execute("PRAGMA table_xinfo(transactions)")]
+    conn.close()
+
+    compact(db_path)
+    conn = sqlite3.connect(db_path)
+    assert is_compact(conn)
+    assert [row[1] for row in conn.execute("PRAGMA table_xinfo(transactions)")] == columns
+    assert [conn.execute(sql).fetchall() for sql in queries] == expected
+    conn.execute("INSERT INTO transactions (id, invoice_id, line, customer_id, product_id, size, color, unit_price, quantity, date, "
+                 "discount, line_total, store_id, employee_id, currency, currency_symbol, sku, transaction_type, payment_method, invoice_total) "
+                 "VALUES (999999, 'INV-X', 1, 1, 1, 'XXL', 'Teal', 10.0, 2, '2024-05-01 10:00:00', 0.0, 20.0, 1, 1, "
+                 "'EUR', '€', 'NEW-SKU', 'Sale', 'Cash', 20.0)")
+    assert conn.execute(f"SELECT COUNT(*) FROM {COMPACT_TABLE} WHERE id = 999999").fetchone() == (1,)
+    assert conn.execute("SELECT sku, sale_month FROM transactions WHERE id = 999999").fetchone() == ("NEW-SKU", "2024-05")
+    conn.execute("UPDATE transactions SET sku = 'NEWER-SKU', quantity = 3, date = '2024-06-01 09:00:00' WHERE id = 999999")
+    assert conn.execute("SELECT sku, quantity, sale_month FROM transactions WHERE id = 999999").fetchone() == ("NEWER-SKU", 3, "2024-06")
+    conn.execute("DELETE FROM transactions WHERE id = 999999")
+    conn.commit()
+    conn.close()
+
+    expand(db_path)
+    conn = sqlite3.connect(db_path)
+    assert not is_compact(conn)
+    assert [conn.execute(sql).fetchall() for sql in queries] == expected
+    conn.close()
+
+
+def test_large_result_pages_and_summaries_come_from_handle():
+    sql = "SELECT id, line_total, transaction_type FROM transactions WHERE id <= 1000 ORDER BY id"
+    footer = query_sql.invoke({"sql": sql}).split("\n")[-1]
+    handle = footer.split("handle=")[1].split(":")[0]
+    page = fetch_sql_page.invoke({"handle": handle, "offset": 200, "limit": 3})
+    assert page.split("\n")[0] == "# rows 201-203 of 1000"
+    assert [line.split("\t")[0] for line in page.split("\n")[-3:]] == ["201", "202", "203"]
+    summary = summarize_sql_result.invoke({"handle": handle, "columns": ["id", "transaction_type"]})
+    assert "# all rows: values=1000, nulls=0" in summary
+    assert "\t".join(["id", "1000", "1", "1000", "500500", "500.5"]) in summary.split("\n")
+    assert "Error" in fetch_sql_page.invoke({"handle": "r_missing", "offset": 0})
+    assert fetch_sql_page.invoke({"handle": handle, "offset": -5}).startswith("Error: offset must be 0 or more")
+    assert RESULT_HANDLES.stats()["handles"] >= 1
+
+
+def test_handles_evicted_by_age_and_size():
+    store = ResultHandleStore(ttl_seconds=60, max_count=2)
+    rows = [(i, f"row {i}") for i in range(10)]
+    first, second, third = (store.spill("SELECT ...", ["n", "label"], rows[:5], [rows[5:]])[0] for _ in range(3))
+    assert not store.alive(first) and store.alive(second) and store.alive(third)
+    assert store.page(third, 8, 5)[1] == [(8, "row 8"), (9, "row 9")]
+    store._handles[second].last_used -= 120
+    store.get(third)
+    assert not store.alive(second) and store.stats()["handles"] == 1
+    assert store.spill("SELECT ...", ["n", "label"], rows, [[]]) == (None, 10)
+
+    def cancelled():
+        yield rows[5:]
+        raise QueryBudgetError("query cancelled")
+
+    with pytest.raises(QueryBudgetError):
+        store.spill("SELECT ...", ["n", "label"], rows[:5], cancelled())
+    assert sorted(path.stem for path in store._directory().glob("r_*.db")) == [third]
+    # Evicted by another thread after get() handed the handle out: the file is gone when it is opened
+    store._handles[third].path.unlink()
+    with pytest.raises(HandleExpiredError):
+        store.page(third, 0, 5)
+    with pytest.raises(HandleExpiredError):
+        store.summarize(third)
+    store.clear()
+
+
+def test_product_resolver_matches_languages_typos_and_prefixes():
+    resolver = ProductResolver([
+        (1, "Silk Retro Coat", "Seidenmantel Retro", "Manteau rétro en soie", "Abrigo retro de seda", "Casaco retrô de seda", "复古真丝大衣"),
+        (2, "Classic Floral Dress", "Klassisches Blumenkleid", "Robe fleurie classique", "Vestido Clásico Floral", "Vestido floral clássico", "经典碎花连衣裙"),
+        (3, "Denim Jacket", "Jeansjacke", "Veste en jean", "Chaqueta vaquera", "Jaqueta jeans", "牛仔夹克"),
+    ])
+    assert resolver.resolve("vestido clasico floral") == [(2, "Vestido Clásico Floral", "es", 1.0)]
+    assert resolver.resolve("denim jaket")[0].product_id == 3
+    assert resolver.resolve("silk ret")[0].product_id == 1
+    assert resolver.resolve("碎花连衣裙")[0][:3] == (2, "经典碎花连衣裙", "zh")
+    assert resolver.resolve("garden hose") == []
+
+
+def test_resolve_products_tool_returns_ids_from_sales_db():
+    with get_pool().connection() as conn:
+        product_id, description = conn.execute("SELECT product_id, description_en FROM products ORDER BY product_id LIMIT 1").fetchone()
+    output = resolve_products.invoke({"mentions": [description.upper(), "zzzz qqqq"]})
+    lines = output.split("\n")
+    # Constant columns (mention, score 1 for an exact name) are folded into the `# all rows:` line
+    assert "score=1" in lines[0] and str(product_id) in lines
+    assert output.split("\n")[-1] == "# no match: zzzz qqqq"